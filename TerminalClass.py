@@ -1,25 +1,85 @@
 import code
 import contextlib
 import sys
+import threading
 if sys.version_info >= (3, 0):
-    from io import StringIO
+    import queue
     unicode = lambda x:x
 else:
-    from io import BytesIO as StringIO
+    import Queue as queue
 import copy
 
 
+class ThreadOutputStream(object):
+    """Replacement for sys.stdout or sys.stderr that sends the writes of registered threads to their queue.
+
+Writes of all other threads, e.g. the GUI thread, go to the original stream. Queue items are tuples (name, text)
+with name 'stdout' or 'stderr'."""
+    def __init__(self, original, name):
+        self.original = original
+        self.name = name
+        self.targets = {}
+
+    def write(self, text):
+        target = self.targets.get(threading.current_thread().ident)
+        if target is None:
+            return self.original.write(text)
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        target.put((self.name, text))
+
+    def flush(self):
+        if threading.current_thread().ident not in self.targets:
+            self.original.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+
+def install_thread_streams():
+    """Replaces sys.stdout and sys.stderr by ThreadOutputStreams if this was not done yet."""
+    if not isinstance(sys.stdout, ThreadOutputStream):
+        sys.stdout = ThreadOutputStream(sys.stdout, 'stdout')
+    if not isinstance(sys.stderr, ThreadOutputStream):
+        sys.stderr = ThreadOutputStream(sys.stderr, 'stderr')
+
+
 @contextlib.contextmanager
-def capture():
-    oldout,olderr = sys.stdout, sys.stderr
+def capture(output_queue):
+    """Sends everything the current thread prints to output_queue while the context is active."""
+    install_thread_streams()
+    ident = threading.current_thread().ident
+    streams = [sys.stdout, sys.stderr]
+    for stream in streams:
+        stream.targets[ident] = output_queue
     try:
-        out=[StringIO(), StringIO()]
-        sys.stdout,sys.stderr = out
-        yield out
+        yield output_queue
     finally:
-        sys.stdout,sys.stderr = oldout, olderr
-        out[0] = out[0].getvalue()
-        out[1] = out[1].getvalue()
+        for stream in streams:
+            stream.targets.pop(ident, None)
+
+
+class OutputQueue(object):
+    """Collects the output of scripts until it is read by the GUI. Queue items are tuples (name, text) with name
+'stdout' or 'stderr'."""
+    def __init__(self):
+        self.output_queue = queue.Queue()
+
+    def write_output(self,text):
+        self.output_queue.put(('stdout',text))
+
+    def read_output(self):
+        """Returns all text that was written to output_queue since the last call."""
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.output_queue.get_nowait()[1])
+            except queue.Empty:
+                break
+        return ''.join(chunks)
 
 
 # class Parser(threading.Thread):
@@ -35,16 +95,17 @@ def capture():
 #         with self.output_lock:
 #             self.target(*self.arguments)
 
-class PythonTerminal(code.InteractiveConsole,object):
+class PythonTerminal(code.InteractiveConsole,OutputQueue):
 
     def __init__(self, shared_vars):
         self.shared_vars_start = copy.deepcopy(shared_vars)
         self.shared_vars = shared_vars
         super(PythonTerminal,self).__init__(shared_vars)
-        self.out_history = []
+        self.output_queue = queue.Queue()
 
     def run_code(self,code_string):
-        with capture() as out:
+        """Runs code_string. Its output is streamed to output_queue while it runs."""
+        with capture(self.output_queue):
             # for line in code_string.split('\n'):
             #     self.push(line)
 
@@ -54,11 +115,10 @@ class PythonTerminal(code.InteractiveConsole,object):
                 code_string = unicode(code_string)
             self.runcode(code_string)
 
-        self.out_history.append(out)
-        return out
-
     def restart_interpreter(self):
+        output_queue = self.output_queue
         self.__init__(self.shared_vars_start)
+        self.output_queue = output_queue
 
     def stop(self):
         raise NotImplementedError
@@ -101,9 +161,9 @@ print('Yeah')
 
 """
 
-    out = PyTerm.run_code(test_code)
-    print(out)
+    PyTerm.run_code(test_code)
+    print(PyTerm.read_output())
 
-    out2 = PyTerm.run_code(test2)
-    print(out2)
+    PyTerm.run_code(test2)
+    print(PyTerm.read_output())
 
@@ -1,6 +1,9 @@
 from __future__ import division,absolute_import,print_function,unicode_literals
 import numpy as np
 import solid_state_tools as sst
+import execution_backends
+import engine_futures
+import trajectory_reader
 import periodictable as pt
 import subprocess
 import os
@@ -36,6 +39,63 @@ def convert_greek(input):
     return result
 
 
+class RelaxOutputReader(trajectory_reader.TrajectoryReader):
+    """Reads the ionic steps of structure relaxations from the log of abinit incrementally. The species are taken
+from the echo of the input variables typat and znucl at the beginning of the log."""
+    def reset_state(self):
+        self.typat = None
+        self.znucl = None
+        self.xred = None
+        self.rprimd = None
+        self.forces = None
+
+    def parse_line(self, line):
+        stripped = line.strip()
+        res = stripped.split()
+        if len(res) > 1 and res[0] in ['typat', 'znucl'] and getattr(self, res[0]) is None:
+            setattr(self, res[0], [float(x) for x in res[1:]])
+            self.begin_block(res[0])
+        elif stripped.startswith('Reduced coordinates (xred)'):
+            self.begin_block('xred')
+        elif stripped.startswith('Real space primitive translations (rprimd)'):
+            self.begin_block('rprimd')
+        elif stripped.startswith('Cartesian forces (fcart)'):
+            self.begin_block('fcart')
+        elif stripped.startswith('Total energy (etotal)'):
+            self._add_step(float(stripped.split('=')[1].split()[0]))
+
+    def parse_row(self, name, line):
+        if name in ['typat', 'znucl']:
+            try:
+                return [float(x) for x in line.split()]
+            except ValueError:
+                return None
+        return trajectory_reader.float_row(line)
+
+    def end_block(self, name, rows):
+        if name in ['typat', 'znucl']:
+            for row in rows:
+                getattr(self, name).extend(row)
+        elif name == 'fcart':
+            self.forces = np.array(rows)
+        else:
+            setattr(self, name, np.array(rows))
+
+    def _add_step(self, energy):
+        if self.xred is None or self.rprimd is None or self.typat is None or self.znucl is None:
+            return
+        if len(self.typat) != len(self.xred) or len(self.rprimd) != 3:
+            return
+        atoms = np.zeros((len(self.xred), 4))
+        atoms[:, :3] = self.xred
+        atoms[:, 3] = [self.znucl[int(i)-1] for i in self.typat]
+        self.add_frame(sst.CrystalStructure(self.rprimd, atoms))
+        self.set_energy(energy)
+        if self.forces is not None and len(self.forces) == len(self.xred):
+            self.set_forces(self.forces)
+        self.forces = None
+
+
 class Handler:
     def __init__(self):
         self.engine_name = 'abinit'
@@ -44,6 +104,9 @@ class Handler:
         self.working_dirctory = '/abinit_files/'
         self.pseudo_directory = '/pseudos/'
         self.engine_process = None
+        # thread of runs that start the engine several times, e.g. ground state and band structure
+        self.engine_thread = None
+        self.executor = execution_backends.LocalExecutor()
         self.info_file = 'input.log'
         self.info_text = """ABINIT is a package whose main program allows one to find the total energy, charge density and electronic structure of systems made of electrons and nuclei (molecules and periodic solids) within Density Functional Theory (DFT), using pseudopotentials (or PAW atomic data) and a planewave basis. 
         ABINIT also optimize the geometry according to the DFT forces and stresses, or perform molecular dynamics simulations using these forces, 
@@ -121,7 +184,8 @@ However, a non-zero value for one such variable for one dataset will have preced
         self.optical_spectrum_options = {}
         self.optical_spectrum_options_tooltip = {}
 
-        self.relax_file_timestamp = None
+        self.relax_reader = None
+        self.relax_frames_loaded = 0
 
     def find_engine_folder(self):
         p = subprocess.Popen([search_command, 'abinit'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell_bool)
@@ -132,6 +196,7 @@ However, a non-zero value for one such variable for one dataset will have preced
     def parse_input_file(self, filename):
         raise NotImplementedError()
 
+    @engine_futures.engine_task(engine_futures.read_ground_state)
     def start_ground_state(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a ground state calculation in a subprocess. The configuration is stored in scf_options.
 
@@ -148,7 +213,7 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the band structure if band_structure_points are given (an EnergyDiagram for molecules), otherwise the scf status.
         """
         pseudos = self._copy_default_pseudos(crystal_structure)
         self._make_files_file(pseudos)
@@ -158,6 +223,7 @@ Returns:
         self._start_engine(blocking=blocking)
 
 
+    @engine_futures.engine_task(engine_futures.read_optical_spectrum)
     def start_optical_spectrum(self, crystal_structure):
         """This method starts a optical spectrum calculation in a subprocess. The configuration is stored in optical_spectrum_options.
 
@@ -165,10 +231,11 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the OpticalSpectrum.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_gw)
     def start_gw(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a g0w0 calculation in a subprocess. The configuration is stored in gw_options.
 
@@ -185,10 +252,11 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the quasi particle BandStructure.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_phonons)
     def start_phonon(self, crystal_structure, band_structure_points):
         """This method starts a phonon bandstructure calculation in a subprocess. The configuration is stored in phonons_options.
 
@@ -205,6 +273,7 @@ Returns:
                 """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_relax)
     def start_relax(self, crystal_structure):
         """This method starts a structure relaxation calculation in a subprocess. The configuration is stored in relax_options.
 
@@ -212,7 +281,7 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the relaxed structure.
         """
         if crystal_structure.n_atoms // 2 >= self.scf_options['nbnd']:
             raise Exception('Too few bands')
@@ -220,62 +289,35 @@ Returns:
         file = self._make_input_file()
         self._add_scf_to_file(file, crystal_structure, calculation='relax')
         file.close()
+        self.relax_reader = None
         self._start_engine()
 
+    def relax_output_reader(self):
+        """Returns a new incremental reader of the output of the relaxation (see trajectory_reader). Threads other than
+the GUI use their own reader, since load_relax_structure is not thread safe."""
+        file = self.project_directory + self.working_dirctory + self.info_file
+        return RelaxOutputReader(file)
+
     def load_relax_structure(self):
         """This method loads the result of a relaxation calculation, which is a molecular or crystal structure.
+Only the output that was written since the last call is parsed. All ionic steps are kept in relax_reader.trajectory.
 
 Returns:
-    - CrystalStructure or MolecularStructure object depending on the material under study.
+    - CrystalStructure or MolecularStructure object depending on the material under study. None if there is no new
+      structure since the last call.
         """
         file = self.project_directory + self.working_dirctory + self.info_file
-        if not os.path.isfile(file):
-            return None
-        if self.relax_file_timestamp is not None and os.path.getmtime(file) == self.relax_file_timestamp:
-            return None
-        self.relax_file_timestamp = os.path.getmtime(file)
-
-        with open(file) as f:
-            text = f.readlines()
-
-        matched_lines = [i for i, line in enumerate(text) if 'atomic_positions' in line.lower()]
-        if len(matched_lines) == 0:
+        if self.relax_reader is None or self.relax_reader.filename != file:
+            self.relax_reader = self.relax_output_reader()
+            self.relax_frames_loaded = 0
+        if self.relax_reader.update() == 'reset':
+            self.relax_frames_loaded = 0
+
+        trajectory = self.relax_reader.trajectory
+        if len(trajectory) == self.relax_frames_loaded:
             return None
-        highest_index = max(matched_lines)
-        species = []
-        coords = []
-        for line in text[highest_index + 1:]:
-            try:
-                res = line.split()
-                species.append(p_table_rev[res[0]])
-                coords.append(np.array([float(x) for x in res[1:]]))
-            except Exception:
-                if len(res) == 0:
-                    continue
-                else:
-                    break
-
-        atoms = np.zeros((len(species), 4))
-        for i, atom in enumerate(zip(species, coords)):
-            atoms[i, :3] = atom[1]
-            atoms[i, 3] = atom[0]
-
-        matched_line = [i for i, line in enumerate(text) if 'lattice parameter' in line.lower()]
-        line = text[matched_line[0]]
-        res = line.split('=')[1].replace('a.u.', '')
-        a = float(res)
-
-        matched_line = [i for i, line in enumerate(text) if 'a(1) =' in line.lower()][0]
-        lattice_vectors = np.zeros((3, 3))
-
-        for i in range(matched_line, matched_line + 3):
-            line = text[i]
-            res = line.split('=')[1]
-            res = res.replace('(', '').replace(')', '').split()
-            res = np.array([float(x) for x in res])
-            lattice_vectors[i - matched_line, :] = res * a
-
-        return sst.CrystalStructure(lattice_vectors, atoms)
+        self.relax_frames_loaded = len(trajectory)
+        return trajectory[-1]
 
     def read_scf_status(self):
         """This method reads the result of a self consistent ground state calculation.
@@ -459,9 +501,10 @@ Returns:
 
 
         r_data = data.reshape(n_list_int,order='f')
-        r_data = r_data/r_data.max()
+        r_data /= r_data.max()
         return sst.KohnShamDensity(r_data)
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_ks_density(self, crystal_structure, bs_point):
         """This method starts a calculation of a specific electronic state in a subprocess.
 
@@ -476,7 +519,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the KohnShamDensity.
                 """
         with open(self.project_directory + self.working_dirctory + '/cut3d.in', 'w') as f:
             f.write("""scf_xo_DS2_WFK
@@ -490,13 +533,10 @@ Returns:
 density
 0""".format(bs_point[0],bs_point[1]))
 
-        command = 'exec cut3d<cut3d.in>cut3d.log'
-        os.chdir(self.project_directory + self.working_dirctory)
-        self.engine_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                               shell=True, preexec_fn=os.setpgrp)
+        self._start_cut3d()
 
         def rename_result():
-            while self.is_engine_running():
+            while self._is_process_running():
                 time.sleep(0.001)
             filename = '/density_k{0:d}_b{1:d}_s1'.format(*bs_point)
             os.rename(self.project_directory+self.working_dirctory+filename,self.project_directory+self.working_dirctory+'/density.out')
@@ -504,10 +544,9 @@ density
 
         t = threading.Thread(target=rename_result)
         t.start()
+        self.engine_thread = t
 
-
-        os.chdir(self.project_directory)
-
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_electron_density(self, crystal_structure):
         """This method starts a calculation of the total (pseudo-) electron density in a subprocess.
 
@@ -519,7 +558,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the electron density.
                 """
         with open(self.project_directory+self.working_dirctory+'/cut3d.in','w') as f:
             f.write("""scf_xo_DS1_DEN
@@ -528,14 +567,15 @@ Returns:
 density.out
 0""")
 
-        command = 'exec cut3d<cut3d.in>cut3d.log'
-        os.chdir(self.project_directory + self.working_dirctory)
-        self.engine_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                               shell=True,preexec_fn=os.setpgrp)
-        os.chdir(self.project_directory)
+        self._start_cut3d()
+
+    def _start_cut3d(self):
+        # cut3d reads the wave functions of the last run, so it runs where the engine ran
+        self.engine_process = self.executor.submit('exec cut3d<cut3d.in>cut3d.log',
+                                                   self.project_directory + self.working_dirctory, shell=True)
 
     def kill_engine(self):
-        """Stops the execution of the engine process. Only possible for local execution and not in case of cluster calculation"""
+        """Stops the execution of the engine process. For cluster calculations the job is cancelled via the executor."""
         try:
             self.engine_process.kill()
             # os.killpg(os.getpgid(self.engine_process.pid), signal.SIGTERM)
@@ -546,21 +586,23 @@ density.out
         """Determines whether the engine is currently running.
 
 Keyword args:
-    - tasks:    List of tasks that are supposed to be running. Must be supplied when the calculations run on a cluster.
+    - tasks:    List of tasks that are supposed to be running. Not needed anymore since the state of the run is reported by the executor,
+                but still accepted for compatibility.
                 Possible tasks are: ['bandstructure', 'relax', 'ks density', 'scf', 'g0w0', 'g0w0 bands', 'optical spectrum']
 
 Returns:
     - res:      Boolean result. True: engine is running. False: engine is not running.
 """
-        if self.custom_command_active:
-            return self._is_engine_running_custom_command(tasks)
+        # runs that are queued or whose results are still being read count as running
+        return engine_futures.is_busy(self) or self._is_process_running()
+
+    def _is_process_running(self):
+        if self.engine_process is None:
+            return False
+        if self.engine_process.poll() is None:
+            return True
         else:
-            if self.engine_process is None:
-                return False
-            if self.engine_process.poll() is None:
-                return True
-            else:
-                return False
+            return False
 
     def will_scf_run(self):
         return True
@@ -639,25 +681,20 @@ getden2  -1
             file.write("""tolwfr2  1.0d-12\nenunit2  1   """)
 
     def _start_engine(self, filename='input.files',blocking=False):
-        os.chdir(self.project_directory + self.working_dirctory)
         if self.custom_command_active:
             command = ['bash', self.custom_command]
         else:
             command = self._engine_command
 
         outname = filename.split('.')[0] + '.log'
-        final_command = [None]
-        final_command[0] = command[0] + ' <' + filename + ' >' + outname
+        final_command = execution_backends.command_to_string(command) + ' <' + filename + ' >' + outname
 
-        self.engine_process = subprocess.Popen("exec " + final_command[0], stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE, shell=True)
-        os.chdir(self.project_directory)
+        self.engine_process = self.executor.submit("exec " + final_command, self.project_directory + self.working_dirctory,
+                                                   shell=True)
         if blocking:
-            while self.is_engine_running():
+            while self._is_process_running():
                 time.sleep(0.1)
 
-    def _is_engine_running_custom_command(self, tasks):
-        raise NotImplementedError
 
     def _get_engine_version(self):
         p = subprocess.Popen(['abinit','--version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell_bool)
@@ -0,0 +1,327 @@
+"""Fourier interpolation of band energies with symmetrized star functions.
+
+The bands are expanded in star functions S_R(k), the averages of exp(2 pi i k.R) over the lattice vectors R' of the
+star of R, i.e. the images of R under the point group of the crystal (Shankland, Koelling and Wood, as used in
+BoltzTraP). The expansion contains several times more stars than irreducible k points of the scf calculation and
+passes exactly through the calculated energies. Among all such expansions the one with the smallest roughness
+sum_R |a_R|**2 rho(R) is chosen (Pickett, Krakauer and Allen, PRB 38, 2721 (1988)), which needs a single linear
+solve for all bands.
+
+Once fitted, band energies along any path or on dense meshes cost a matrix product or one FFT per band, so band
+structures along new paths are available without running the engine again. The interpolation assumes sorted band
+energies, so it is smooth away from band crossings only."""
+from __future__ import division
+import itertools
+import numpy as np
+
+roughness_coefficients = (0.75, 0.75)
+
+
+def point_group(lattice_vectors, atoms=None, tolerance=1e-5):
+    """Returns the point group of a crystal as rotation matrices that act on fractional coordinates.
+
+Args:
+    - lattice_vectors:  Lattice vectors as rows of a (3,3) array.
+
+Keyword args:
+    - atoms:            Array with rows [x,y,z,type] in fractional coordinates. Operations of the lattice that do not
+                        map the atoms onto atoms of the same type (with any fractional translation) are discarded.
+                        Default: the point group of the lattice.
+
+    - tolerance:        Tolerance of the metric in units of the squared lattice vector lengths and of the atomic
+                        positions in fractional coordinates.
+
+Returns:
+    - rotations:        Integer array of shape (n_ops,3,3). A position x is mapped to rotations[i].dot(x).
+    """
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    metric = lattice_vectors.dot(lattice_vectors.T)
+    scale = np.max(np.abs(metric))
+    # column j of a rotation is the image of lattice vector j, i.e. a lattice vector of the same length
+    columns = []
+    axis_scale = np.linalg.norm(np.linalg.inv(lattice_vectors), axis=0)
+    for j in range(3):
+        bounds = np.ceil(np.sqrt(metric[j, j]) * axis_scale * (1 + tolerance)).astype(np.int64)
+        grid = np.mgrid[-bounds[0]:bounds[0] + 1, -bounds[1]:bounds[1] + 1, -bounds[2]:bounds[2] + 1]
+        points = grid.reshape(3, -1).T
+        squared_lengths = np.einsum('ni,ij,nj->n', points, metric, points)
+        columns.append(points[np.abs(squared_lengths - metric[j, j]) < tolerance * scale])
+    candidates = np.array([np.array(column).T for column in itertools.product(*columns)], dtype=np.int64)
+    transformed = np.einsum('nji,jk,nkl->nil', candidates, metric, candidates)
+    rotations = candidates[np.all(np.abs(transformed - metric) < tolerance * scale, axis=(1, 2))]
+    if atoms is None or len(atoms) == 0:
+        return rotations
+
+    atoms = np.asarray(atoms, dtype=float)
+    positions, types = np.mod(atoms[:, :3], 1), atoms[:, 3]
+
+    def maps_atoms(rotation):
+        rotated = positions.dot(rotation.T)
+        for target in positions[types == types[0]]:
+            shifted = rotated + (target - rotated[0])
+            difference = shifted[:, np.newaxis, :] - positions[np.newaxis, :, :]
+            difference -= np.round(difference)
+            match = np.all(np.abs(difference) < tolerance, axis=2) & (types[:, np.newaxis] == types[np.newaxis, :])
+            if np.all(np.any(match, axis=1)):
+                return True
+        return False
+
+    return np.array([rotation for rotation in rotations if maps_atoms(rotation)])
+
+
+def add_time_reversal(rotations):
+    """Returns the group generated by rotations and the inversion, which time reversal symmetry adds in k space."""
+    rotations = np.concatenate([rotations, -rotations])
+    return np.unique(rotations.reshape(-1, 9), axis=0).reshape(-1, 3, 3)
+
+
+def irreducible_points(k_points, rotations, decimals=5):
+    """Returns the indices of the first k point of every set of symmetry equivalent k points.
+
+Args:
+    - k_points:     Array of shape (n_k,3) in fractional coordinates of the reciprocal lattice vectors.
+
+    - rotations:    Rotations of the point group in fractional real space coordinates. k is mapped to rotation.T.dot(k).
+    """
+    scale = 10**decimals
+    images = np.einsum('oji,nj->oni', rotations, k_points)
+    images = np.mod(np.round(images * scale).astype(np.int64), scale)
+    keys = (images[:, :, 0] * scale + images[:, :, 1]) * scale + images[:, :, 2]
+    __, index = np.unique(keys.min(axis=0), return_index=True)
+    return np.sort(index)
+
+
+def lattice_stars(lattice_vectors, rotations, n_stars):
+    """Returns the shortest n_stars stars of lattice vectors, sorted by length.
+
+Returns:
+    - members:      Integer array of shape (n_members,3) with the lattice vectors of all stars in units of the lattice
+                    vectors, grouped by star.
+
+    - star_index:   Star of every member.
+
+    - lengths:      Length of the lattice vectors of every star.
+    """
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    volume = abs(np.linalg.det(lattice_vectors))
+    # lattice vectors along every axis that fit in a sphere of radius 1
+    axis_scale = np.linalg.norm(np.linalg.inv(lattice_vectors), axis=0)
+    n_points = 2 * n_stars * len(rotations) + 100
+    while True:
+        radius = (3 * volume * n_points / (4 * np.pi))**(1 / 3)
+        bounds = np.ceil(radius * axis_scale).astype(np.int64)
+        grid = np.mgrid[-bounds[0]:bounds[0] + 1, -bounds[1]:bounds[1] + 1, -bounds[2]:bounds[2] + 1]
+        points = grid.reshape(3, -1).T
+        lengths = np.linalg.norm(points.dot(lattice_vectors), axis=1)
+        inside = lengths <= radius
+        points, lengths = points[inside], lengths[inside]
+
+        size = 2 * bounds + 1
+        images = np.einsum('oij,nj->oni', rotations, points) + bounds
+        keys = (images[:, :, 0] * size[1] + images[:, :, 1]) * size[2] + images[:, :, 2]
+        # stars that touch the sphere may be incomplete, they are never among the selected stars
+        __, representative, star_index = np.unique(keys.max(axis=0), return_index=True, return_inverse=True)
+        star_lengths = lengths[representative]
+        order = np.lexsort((representative, star_lengths))
+        if len(order) > n_stars and star_lengths[order[n_stars - 1]] < radius * (1 - 1e-6):
+            break
+        n_points *= 2
+
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    star_index = rank[star_index]
+    selected = np.flatnonzero(star_index < n_stars)
+    selected = selected[np.argsort(star_index[selected], kind='mergesort')]
+    return points[selected], star_index[selected], star_lengths[order[:n_stars]]
+
+
+def roughness(lengths):
+    """Returns the roughness weights rho(R) of the stars with the lengths of their lattice vectors. The first star is
+R = 0."""
+    c1, c2 = roughness_coefficients
+    x = (lengths / lengths[1])**2
+    return (1 - c1 * x)**2 + c2 * x**3
+
+
+class StarFunctionInterpolation(object):
+    """Star function interpolation of band energies that are known on a k mesh, typically the irreducible k points of
+an scf calculation.
+
+Args:
+    - k_points:         Array of shape (n_k,3) in fractional coordinates of the reciprocal lattice vectors.
+                        Symmetry equivalent points are allowed, only the first of them is used.
+
+    - eigenvalues:      Band energies with shape (n_k,n_bands) or (n_spin,n_k,n_bands).
+
+    - lattice_vectors:  Lattice vectors as rows of a (3,3) array.
+
+Keyword args:
+    - rotations:        Point group as integer rotation matrices acting on fractional coordinates, see point_group.
+                        Default: the point group of the lattice.
+
+    - star_ratio:       Number of stars per irreducible k point.
+
+    - time_reversal:    Whether E(k) = E(-k) is used as additional symmetry.
+    """
+    def __init__(self, k_points, eigenvalues, lattice_vectors, rotations=None, star_ratio=5, time_reversal=True):
+        self.lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+        if rotations is None:
+            rotations = point_group(self.lattice_vectors)
+        rotations = np.asarray(rotations, dtype=np.int64)
+        if time_reversal:
+            rotations = add_time_reversal(rotations)
+        self.rotations = rotations
+
+        eigenvalues = np.asarray(eigenvalues, dtype=float)
+        self.band_shape = eigenvalues.shape[:-2] + eigenvalues.shape[-1:]
+        energies = np.moveaxis(eigenvalues, -2, 0).reshape(eigenvalues.shape[-2], -1)
+        k_points = np.asarray(k_points, dtype=float)
+        irreducible = irreducible_points(k_points, rotations)
+        self.k_points = k_points[irreducible]
+        energies = energies[irreducible]
+
+        n_stars = max(int(round(star_ratio * len(self.k_points))), len(self.k_points)) + 1
+        self.members, self.star_index, lengths = lattice_stars(self.lattice_vectors, rotations, n_stars)
+        self.coefficients = self._fit(energies, lengths)
+
+    def star_functions(self, k_points, chunk_size=2**22):
+        """Returns the star functions at k_points as array of shape (n_k,n_stars)."""
+        k_points = np.asarray(k_points, dtype=float)
+        star_sizes = np.bincount(self.star_index)
+        starts = np.append(0, np.cumsum(star_sizes)[:-1])
+        result = np.empty((len(k_points), len(star_sizes)))
+        chunk = max(1, chunk_size // len(self.members))
+        for start in range(0, len(k_points), chunk):
+            phases = np.cos(2 * np.pi * k_points[start:start + chunk].dot(self.members.T))
+            result[start:start + chunk] = np.add.reduceat(phases, starts, axis=1) / star_sizes
+        return result
+
+    def _fit(self, energies, lengths):
+        star_functions = self.star_functions(self.k_points)
+        if len(self.k_points) == 1:
+            coefficients = np.zeros((star_functions.shape[1], energies.shape[1]))
+            coefficients[0] = energies[0]
+        else:
+            rho = roughness(lengths)[1:]
+            # differences to the last k point, through which the expansion passes by the choice of the constant star
+            difference = star_functions[:-1, 1:] - star_functions[-1, 1:]
+            h = np.dot(difference / rho, difference.T)
+            multipliers = np.linalg.solve(h, energies[:-1] - energies[-1])
+            coefficients = np.zeros((star_functions.shape[1], energies.shape[1]))
+            coefficients[1:] = np.dot(difference.T, multipliers) / rho[:, np.newaxis]
+            coefficients[0] = energies[-1] - np.dot(star_functions[-1, 1:], coefficients[1:])
+        # coefficients of the single lattice vectors, so that the energies are a plain Fourier sum
+        return coefficients[self.star_index] / np.bincount(self.star_index)[self.star_index, np.newaxis]
+
+    def _shape_bands(self, energies):
+        energies = energies.reshape(energies.shape[:-1] + self.band_shape)
+        if len(self.band_shape) == 2:
+            energies = np.moveaxis(energies, -2, 0)
+        return energies
+
+    def energies(self, k_points, chunk_size=2**22):
+        """Returns the interpolated band energies.
+
+Args:
+    - k_points:     Array of shape (n_k,3) in fractional coordinates of the reciprocal lattice vectors.
+
+Returns:
+    - energies:     Array of shape (n_k,n_bands) or (n_spin,n_k,n_bands).
+        """
+        k_points = np.atleast_2d(np.asarray(k_points, dtype=float))
+        result = np.empty((len(k_points), self.coefficients.shape[1]))
+        chunk = max(1, chunk_size // len(self.members))
+        for start in range(0, len(k_points), chunk):
+            phases = np.cos(2 * np.pi * k_points[start:start + chunk].dot(self.members.T))
+            result[start:start + chunk] = phases.dot(self.coefficients)
+        return self._shape_bands(result)
+
+    def mesh_energies(self, mesh):
+        """Returns the interpolated band energies on the regular mesh k = (i1/n1,i2/n2,i3/n3) through FFTs.
+
+Returns:
+    - energies:     Array of shape (n1,n2,n3,n_bands) or (n_spin,n1,n2,n3,n_bands).
+        """
+        mesh = tuple(int(n) for n in mesh)
+        # the Fourier sum at the mesh points only depends on the lattice vectors modulo the mesh
+        wrapped = np.mod(self.members, mesh)
+        flat_index = (wrapped[:, 0] * mesh[1] + wrapped[:, 1]) * mesh[2] + wrapped[:, 2]
+        n_mesh = mesh[0] * mesh[1] * mesh[2]
+        result = np.empty(mesh + (self.coefficients.shape[1],))
+        for band in range(self.coefficients.shape[1]):
+            grid = np.bincount(flat_index, self.coefficients[:, band], minlength=n_mesh).reshape(mesh)
+            result[..., band] = np.fft.ifftn(grid).real * n_mesh
+        return self._shape_bands(result)
+
+
+def path_points(k_path, reciprocal_vectors, n_points=400):
+    """Returns k points along a path of special points with a spacing that is as uniform as possible.
+
+Args:
+    - k_path:               List of [point,label] with points in fractional coordinates of the reciprocal lattice.
+
+    - reciprocal_vectors:   Reciprocal lattice vectors as rows of a (3,3) array.
+
+Keyword args:
+    - n_points:             Approximate total number of points.
+
+Returns:
+    - k_points:             Array of shape (n,3) in fractional coordinates.
+
+    - distances:            Path coordinate of every point in the units of reciprocal_vectors.
+
+    - special_k_points:     List of [distance,label] of the special points.
+    """
+    special = np.array([point for point, label in k_path], dtype=float)
+    labels = [label for point, label in k_path]
+    segment_lengths = np.linalg.norm(np.diff(special, axis=0).dot(reciprocal_vectors), axis=1)
+    total_length = segment_lengths.sum()
+    k_points = [special[:1]]
+    for i, segment_length in enumerate(segment_lengths):
+        n = max(1, int(round(n_points * segment_length / total_length))) if total_length > 0 else 1
+        fractions = np.arange(1, n + 1)[:, np.newaxis] / n
+        k_points.append(special[i] + fractions * (special[i + 1] - special[i]))
+    k_points = np.concatenate(k_points)
+    steps = np.linalg.norm(np.diff(k_points, axis=0).dot(reciprocal_vectors), axis=1)
+    distances = np.append(0, np.cumsum(steps))
+    special_distances = np.append(0, np.cumsum(segment_lengths))
+    return k_points, distances, [[distance, label] for distance, label in zip(special_distances, labels)]
+
+
+if __name__ == "__main__":
+    import time
+
+    # tight binding band of an fcc lattice, fitted on the irreducible points of a coarse mesh
+    lattice_vectors = 6.719 * np.array([[0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+    rotations = point_group(lattice_vectors, atoms=np.array([[0, 0, 0, 6], [0.25, 0.25, 0.25, 6]]))
+    print('Point group with {0:d} operations'.format(len(rotations)))
+
+    def tight_binding(k):
+        k_cart = k.dot(2 * np.pi * np.linalg.inv(lattice_vectors).T)
+        a = 6.719
+        c = np.cos(k_cart * a / 2)
+        return -(c[:, 0] * c[:, 1] + c[:, 1] * c[:, 2] + c[:, 0] * c[:, 2])[:, np.newaxis] + np.array([0, 2.0])
+
+    n = 8
+    mesh = np.indices((n, n, n)).reshape(3, -1).T / n
+    irreducible = irreducible_points(mesh, add_time_reversal(rotations))
+    k_coarse = mesh[irreducible]
+
+    start = time.time()
+    interpolation = StarFunctionInterpolation(k_coarse, tight_binding(k_coarse), lattice_vectors, rotations=rotations)
+    print('Fit of {0:d} k points with {1:d} stars: {2:1.3f} s'.format(len(k_coarse), interpolation.star_index[-1] + 1,
+                                                                      time.time() - start))
+
+    k_path = [[np.array([0, 0, 0]), 'Gamma'], [np.array([0.5, 0, 0.5]), 'X'], [np.array([0.5, 0.25, 0.75]), 'W'],
+              [np.array([0.5, 0.5, 0.5]), 'L'], [np.array([0, 0, 0]), 'Gamma']]
+    start = time.time()
+    k_points, distances, special_k_points = path_points(k_path, 2 * np.pi * np.linalg.inv(lattice_vectors).T, 1000)
+    energies = interpolation.energies(k_points)
+    print('Path with {0:d} points: {1:1.3f} s, maximum error {2:1.2e} eV'.format(
+        len(k_points), time.time() - start, np.max(np.abs(energies - tight_binding(k_points)))))
+
+    start = time.time()
+    dense = interpolation.mesh_energies((40, 40, 40))
+    k_dense = np.indices((40, 40, 40)).reshape(3, -1).T / 40
+    print('Mesh with {0:d} points: {1:1.3f} s, maximum error {2:1.2e} eV'.format(
+        len(k_dense), time.time() - start, np.max(np.abs(dense.reshape(-1, 2) - tight_binding(k_dense)))))
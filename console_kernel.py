@@ -0,0 +1,546 @@
+"""Runs the code of the scripting console in a separate kernel process.
+
+CPU heavy scripts can not freeze the GUI this way and a running script can be interrupted with SIGINT. Objects
+that have to stay in the GUI process (the engine and the plot functions) are replaced in the kernel by proxies whose
+attribute accesses and calls are executed by the GUI process.
+
+All messages are pickled with dumps and loads. With python 3.8 or newer, large numpy arrays (e.g. densities) are put
+into shared memory blocks and only their names are pickled, so the receiving process uses them without a copy.
+
+The kernel talks to the GUI through two pipes:
+    - command connection:   GUI -> kernel: ('run', run_id, code), ('namespace', run_id), ('vars', dictionary),
+                                           ('remote', names), ('shutdown',)
+
+    - event connection:     kernel -> GUI: ('output', stream_name, text), ('done', run_id[, result]),
+                            ('request', request_id, kind, name, attribute, args, kwargs)
+                            GUI -> kernel: ('reply', request_id, status, value)
+
+Futures returned by the remote objects (see engine_futures) are mirrored by futures in the kernel, whose state and
+progress are polled from the GUI process.
+"""
+from __future__ import division, print_function
+import code
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import threading
+import time
+import traceback
+import weakref
+import numpy as np
+from TerminalClass import OutputQueue
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+shared_memory_threshold = 2**20
+
+# shared memory blocks whose arrays were garbage collected, they are closed as soon as their buffer is released
+_released_blocks = []
+
+
+class _Pickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        if isinstance(obj, RemoteObject):
+            # proxies that are passed back to the GUI process stand for the original object
+            return ('remote object', obj._name)
+        # memory mapped arrays (e.g. densities of the project store) are shared as well
+        if shared_memory is None or not isinstance(obj, np.ndarray) or obj.nbytes < shared_memory_threshold \
+                or obj.dtype.fields is not None or obj.dtype.hasobject:
+            return None
+        block = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        shared = np.ndarray(obj.shape, dtype=obj.dtype, buffer=block.buf)
+        shared[...] = np.asarray(obj)
+        del shared
+        block.close()
+        return ('shared array', block.name, obj.shape, obj.dtype.str)
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, remote_objects=None):
+        pickle.Unpickler.__init__(self, file)
+        self.remote_objects = remote_objects
+
+    def persistent_load(self, pid):
+        if pid[0] == 'remote object' and self.remote_objects is not None:
+            return resolve_remote_object(self.remote_objects, pid[1])
+        kind, name, shape, dtype = pid
+        if kind != 'shared array':
+            raise pickle.UnpicklingError('Unknown persistent id: ' + repr(kind))
+        # the receiver owns the block, unlinking removes only its name while the mapping stays valid
+        block = shared_memory.SharedMemory(name=name)
+        block.unlink()
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        weakref.finalize(array, _released_blocks.append, block)
+        return array
+
+
+def resolve_remote_object(remote_objects, name):
+    """Returns the object of the proxy name, which is either a key of remote_objects or an attribute path like
+engine.scf_options."""
+    names = name.split('.')
+    obj = remote_objects[names[0]]
+    for attribute in names[1:]:
+        obj = getattr(obj, attribute)
+    return obj
+
+
+def _close_released_blocks():
+    for block in list(_released_blocks):
+        try:
+            block.close()
+        except BufferError:
+            continue
+        _released_blocks.remove(block)
+
+
+def dumps(obj):
+    buffer = io.BytesIO()
+    _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+def loads(data, remote_objects=None):
+    """Unpickles data. Proxies of remote objects are replaced by the objects in the dictionary remote_objects."""
+    _close_released_blocks()
+    return _Unpickler(io.BytesIO(data), remote_objects=remote_objects).load()
+
+
+class RemoteError(Exception):
+    pass
+
+
+class _KernelOutputStream(object):
+    """Replaces sys.stdout and sys.stderr in the kernel. Writes are buffered and sent by flush, which the
+flusher thread of the kernel calls periodically."""
+    def __init__(self, kernel, name):
+        self.kernel = kernel
+        self.name = name
+        self.buffer = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        with self.lock:
+            self.buffer.append(text)
+
+    def flush(self):
+        with self.lock:
+            text = ''.join(self.buffer)
+            self.buffer = []
+        if text:
+            self.kernel.send(('output', self.name, text))
+
+    def isatty(self):
+        return False
+
+
+class RemoteObject(object):
+    """Proxy for an object of the GUI process. Attribute values are fetched when they are accessed and
+methods are called in the GUI process. Return values that can not be pickled are returned as None.
+
+Dictionary attributes (e.g. engine.scf_options) are returned as proxies as well, so item assignments change the
+dictionary in the GUI process. All other attribute values, including numpy arrays, are copies."""
+    def __init__(self, kernel, name):
+        object.__setattr__(self, '_kernel', kernel)
+        object.__setattr__(self, '_name', name)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        return self._kernel.request('getattr', self._name, attribute)
+
+    def __setattr__(self, attribute, value):
+        self._kernel.request('setattr', self._name, attribute, (value,))
+
+    def __call__(self, *args, **kwargs):
+        return self._kernel.request('call', self._name, None, args, kwargs)
+
+    def __getitem__(self, key):
+        return self._kernel.request('call', self._name, '__getitem__', (key,))
+
+    def __setitem__(self, key, value):
+        self._kernel.request('call', self._name, '__setitem__', (key, value))
+
+    def __delitem__(self, key):
+        self._kernel.request('call', self._name, '__delitem__', (key,))
+
+    def __contains__(self, key):
+        return self._kernel.request('call', self._name, '__contains__', (key,))
+
+    def __iter__(self):
+        return iter(self._kernel.request('call', self._name, 'keys'))
+
+    def __repr__(self):
+        return '<remote {0}>'.format(self._name)
+
+
+class RemoteMethod(object):
+    def __init__(self, kernel, name, attribute):
+        self.kernel = kernel
+        self.name = name
+        self.attribute = attribute
+
+    def __call__(self, *args, **kwargs):
+        return self.kernel.request('call', self.name, self.attribute, args, kwargs)
+
+    def __repr__(self):
+        return '<remote method {0}.{1}>'.format(self.name, self.attribute)
+
+
+class Kernel(object):
+    """The kernel side. It executes the commands from the command connection in its main thread."""
+    def __init__(self, command_connection, event_connection, flush_interval=0.02):
+        self.command_connection = command_connection
+        self.event_connection = event_connection
+        self.flush_interval = flush_interval
+        self.send_lock = threading.Lock()
+        self.request_lock = threading.Lock()
+        self.request_id = 0
+        self.remote_futures = {}
+        self.future_poll_interval = 0.2
+        self.namespace = {}
+        self.console = code.InteractiveConsole(self.namespace)
+        self.streams = [_KernelOutputStream(self, 'stdout'), _KernelOutputStream(self, 'stderr')]
+        sys.stdout, sys.stderr = self.streams
+
+    def send(self, message):
+        data = dumps(message)
+        with self.send_lock:
+            self.event_connection.send_bytes(data)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except (EOFError, IOError, OSError):
+                return
+
+    def request(self, kind, name, attribute=None, args=(), kwargs=None):
+        """Executes an access to the remote object name in the GUI process and returns the result."""
+        self.flush()
+        with self.request_lock:
+            self.request_id += 1
+            request_id = self.request_id
+            self.send(('request', request_id, kind, name, attribute, args, kwargs or {}))
+            while True:
+                reply = loads(self.event_connection.recv_bytes())
+                # replies of requests that were interrupted are dropped
+                if reply[1] == request_id:
+                    break
+        status, value = reply[2:]
+        if status == 'error':
+            raise value
+        elif status == 'method':
+            return RemoteMethod(self, name, attribute)
+        elif status == 'proxy':
+            return RemoteObject(self, name + '.' + attribute)
+        elif status == 'future':
+            return self.remote_future(value)
+        return value
+
+    def remote_future(self, future_id):
+        from engine_futures import EngineFuture
+        future = EngineFuture(future_id[1])
+        future.set_running_or_notify_cancel()
+        start_polling = not self.remote_futures
+        self.remote_futures[future_id] = future
+        if start_polling:
+            poller = threading.Thread(target=self.poll_futures)
+            poller.daemon = True
+            poller.start()
+        return future
+
+    def poll_futures(self):
+        """Transfers progress and results of the futures in the GUI process to the remote futures."""
+        while self.remote_futures:
+            time.sleep(self.future_poll_interval)
+            states = self.request('futures', None, None, (list(self.remote_futures.keys()),))
+            for future_id, (progress, status, value) in states.items():
+                future = self.remote_futures[future_id]
+                if progress is not None and (future.progress is None or not np.array_equal(progress, future.progress)):
+                    future.set_progress(progress)
+                if status is not None:
+                    del self.remote_futures[future_id]
+                    if status == 'error':
+                        future.set_exception(value)
+                    else:
+                        future.set_result(value)
+
+    def run(self, run_id, code_string):
+        try:
+            self.console.runcode(code_string)
+        except KeyboardInterrupt:
+            self.console.showtraceback()
+        finally:
+            self.flush()
+            self.send(('done', run_id))
+
+    def pickled_namespace(self):
+        """Returns the variables of the scripts that can be pickled, each pickled on its own."""
+        data = {}
+        for key, value in self.namespace.items():
+            if key.startswith('__'):
+                continue
+            try:
+                data[key] = dumps(value)
+            except Exception:
+                continue
+        return data
+
+    def serve(self):
+        flusher = threading.Thread(target=self.flush_periodically)
+        flusher.daemon = True
+        flusher.start()
+        while True:
+            try:
+                message = loads(self.command_connection.recv_bytes())
+            except KeyboardInterrupt:
+                continue
+            except EOFError:
+                break
+            kind = message[0]
+            if kind == 'run':
+                try:
+                    self.run(*message[1:])
+                except KeyboardInterrupt:
+                    continue
+            elif kind == 'namespace':
+                self.send(('done', message[1], self.pickled_namespace()))
+            elif kind == 'vars':
+                self.namespace.update(message[1])
+            elif kind == 'remote':
+                for name in message[1]:
+                    self.namespace[name] = RemoteObject(self, name)
+            elif kind == 'shutdown':
+                break
+
+
+def kernel_main(command_connection, event_connection):
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    Kernel(command_connection, event_connection).serve()
+
+
+_main_module_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _kernel_main_module():
+    """Makes this module the main module while the kernel process is started. Spawned processes import the main
+module of their parent, which would be the whole GUI (main.py) otherwise."""
+    with _main_module_lock:
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = sys.modules[__name__]
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main_module
+
+
+class KernelClient(OutputQueue):
+    """GUI side of the console kernel. It has the interface of TerminalClass.PythonTerminal.
+
+The kernel process is started on creation. A reader thread receives the output of the kernel, which is collected
+by read_output, and executes the requests of the remote objects."""
+    def __init__(self):
+        super(KernelClient, self).__init__()
+        self.shared_vars = {}
+        self.remote_objects = {}
+        self.run_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.run_id = 0
+        self.finished_runs = {}
+        self.run_results = {}
+        self.futures = {}
+        self.process = None
+        self.start()
+
+    def start(self):
+        try:
+            context = multiprocessing.get_context('spawn')
+        except AttributeError:
+            context = multiprocessing
+        self.command_connection, kernel_command_connection = context.Pipe(duplex=False)[::-1]
+        self.event_connection, kernel_event_connection = context.Pipe()
+        self.process = context.Process(target=kernel_main, args=(kernel_command_connection, kernel_event_connection))
+        self.process.daemon = True
+        with _kernel_main_module():
+            self.process.start()
+        kernel_command_connection.close()
+        kernel_event_connection.close()
+
+        self.reader_thread = threading.Thread(target=self.read_events, args=(self.event_connection,))
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+        self.send_vars(self.shared_vars, list(self.remote_objects.keys()))
+
+    def send(self, message):
+        data = dumps(message)
+        with self.send_lock:
+            self.command_connection.send_bytes(data)
+
+    def send_vars(self, shared_vars, remote_names):
+        if shared_vars:
+            self.send(('vars', shared_vars))
+        if remote_names:
+            self.send(('remote', remote_names))
+
+    def update_vars(self, vars, remote_names=()):
+        """Sets variables in the namespace of the scripts. Variables in remote_names stay in this process and are
+accessed through proxies, all others are copied to the kernel."""
+        shared_vars = dict((key, value) for key, value in vars.items() if key not in remote_names)
+        self.shared_vars.update(shared_vars)
+        for name in remote_names:
+            self.remote_objects[name] = vars[name]
+        self.send_vars(shared_vars, list(remote_names))
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def run_code(self, code_string):
+        """Runs code_string in the kernel and waits until it is finished. Its output is collected while it runs."""
+        self.send_and_wait(lambda run_id: ('run', run_id, code_string))
+
+    def get_namespace(self):
+        """Returns the variables of the scripts that can be pickled. Proxies are replaced by the objects of this
+process and variables that can not be unpickled here are left out."""
+        data = self.send_and_wait(lambda run_id: ('namespace', run_id)) or {}
+        namespace = {}
+        for key, value in data.items():
+            try:
+                namespace[key] = loads(value, remote_objects=self.remote_objects)
+            except Exception:
+                continue
+        return namespace
+
+    def send_and_wait(self, make_message):
+        """Sends the command make_message(run_id) and returns the result of its done event."""
+        with self.run_lock:
+            self.run_id += 1
+            run_id = self.run_id
+            finished = threading.Event()
+            self.finished_runs[run_id] = finished
+            self.send(make_message(run_id))
+            while not finished.wait(0.1):
+                if not self.is_alive():
+                    self.write_output('------- Kernel died -------\n')
+                    break
+            self.finished_runs.pop(run_id, None)
+            return self.run_results.pop(run_id, None)
+
+    def interrupt(self):
+        """Raises a KeyboardInterrupt in the running script. Without SIGINT (windows) the kernel is restarted."""
+        if not self.is_alive():
+            return
+        if os.name == 'posix':
+            os.kill(self.process.pid, signal.SIGINT)
+        else:
+            self.restart_interpreter()
+
+    def restart_interpreter(self):
+        """Starts a new kernel with the variables of the last update_vars."""
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(1)
+        self.command_connection.close()
+        self.start()
+
+    def read_events(self, connection):
+        while True:
+            try:
+                message = loads(connection.recv_bytes(), remote_objects=self.remote_objects)
+            except (EOFError, IOError, OSError):
+                break
+            kind = message[0]
+            if kind == 'output':
+                self.output_queue.put(message[1:])
+            elif kind == 'done':
+                if len(message) > 2:
+                    self.run_results[message[1]] = message[2]
+                finished = self.finished_runs.get(message[1])
+                if finished is not None:
+                    finished.set()
+            elif kind == 'request':
+                self.handle_request(connection, *message[1:])
+
+        connection.close()
+        for finished in list(self.finished_runs.values()):
+            finished.set()
+
+    def handle_request(self, connection, request_id, kind, name, attribute, args, kwargs):
+        try:
+            if kind == 'futures':
+                reply = ('value', self.future_states(args[0]))
+            else:
+                reply = self.access_remote_object(kind, name, attribute, args, kwargs)
+        except Exception as e:
+            reply = ('error', e)
+            message = traceback.format_exc()
+
+        try:
+            data = dumps(('reply', request_id) + reply)
+        except Exception:
+            if reply[0] == 'error':
+                data = dumps(('reply', request_id, 'error', RemoteError(message)))
+            else:
+                data = dumps(('reply', request_id, 'value', None))
+        connection.send_bytes(data)
+
+    def access_remote_object(self, kind, name, attribute, args, kwargs):
+        obj = resolve_remote_object(self.remote_objects, name)
+        if kind == 'getattr':
+            value = getattr(obj, attribute)
+            if callable(value):
+                return 'method', None
+            if isinstance(value, dict):
+                # item assignments to option dictionaries have to reach the GUI process
+                return 'proxy', None
+        elif kind == 'setattr':
+            setattr(obj, attribute, args[0])
+            return 'value', None
+        elif attribute is None:
+            value = obj(*args, **kwargs)
+        else:
+            value = getattr(obj, attribute)(*args, **kwargs)
+
+        if isinstance(value, (type({}.keys()), type({}.values()), type({}.items()))):
+            value = list(value)
+        if isinstance(value, concurrent.futures.Future):
+            future_id = (id(value), getattr(value, 'name', ''))
+            self.futures[future_id] = value
+            if hasattr(value, 'add_progress_callback'):
+                # makes the future read the progress, which is polled by the kernel
+                value.add_progress_callback(lambda progress: None)
+            return 'future', future_id
+        return 'value', value
+
+    def future_states(self, future_ids):
+        """Returns progress, status ('result', 'error' or None while running) and value of the futures future_ids.
+Finished futures are forgotten."""
+        states = {}
+        for future_id in future_ids:
+            future = self.futures[future_id]
+            status, value = None, None
+            if future.done():
+                del self.futures[future_id]
+                if future.cancelled():
+                    status, value = 'error', concurrent.futures.CancelledError()
+                elif future.exception() is not None:
+                    status, value = 'error', future.exception()
+                else:
+                    status, value = 'result', future.result()
+            states[future_id] = (getattr(future, 'progress', None), status, value)
+        return states
@@ -0,0 +1,241 @@
+"""Densities of states from the eigenvalues of all bands on a k-point mesh.
+
+Smeared densities of states are computed in one pass over the eigenvalues: they are deposited on a uniform energy grid
+by linear interpolation between the two neighbouring grid points (a weighted bincount) and the resulting histogram is
+convolved with the Gaussian or Lorentzian through FFTs. This costs O(N + M log M) for N eigenvalues and M energies
+instead of the O(N M) of adding up one broadening function per eigenvalue.
+
+The linear tetrahedron method (Bloechl, Jepsen and Andersen, PRB 49, 16223 (1994), without the correction term) needs
+the eigenvalues on the full regular mesh. Every cell of the mesh is split into six tetrahedra along its main diagonal
+and the bands are interpolated linearly within them. The number of states of a tetrahedron below an energy is known
+analytically, so the density of states on the energy grid follows from the differences of the number of states between
+the edges of the grid bins."""
+from __future__ import division
+import numpy as np
+
+# the six tetrahedra of a mesh cell, the corners are numbered 1*i + 2*j + 4*k for the cell offsets (i,j,k)
+tetrahedra = np.array([[0, 1, 3, 7], [0, 1, 5, 7], [0, 2, 3, 7], [0, 2, 6, 7], [0, 4, 5, 7], [0, 4, 6, 7]])
+
+
+def energy_grid(eigenvalues, n_points=2001, padding=1.0):
+    """Returns a uniform energy grid from the lowest eigenvalue minus padding to the highest eigenvalue plus padding."""
+    return np.linspace(np.min(eigenvalues) - padding, np.max(eigenvalues) + padding, n_points)
+
+
+def _grid_step(energy):
+    step = (energy[-1] - energy[0]) / (len(energy) - 1)
+    if not np.allclose(np.diff(energy), step, rtol=1e-6, atol=0):
+        raise ValueError('The energy grid must be uniform')
+    return step
+
+
+def histogram(eigenvalues, weights, energy, chunk_size=2**22):
+    """Deposits the weights of the eigenvalues on the uniform grid energy. Every eigenvalue is split between its two
+neighbouring grid points by linear interpolation, which conserves the total weight and the first moment.
+
+Args:
+    - eigenvalues:  Array of any shape.
+
+    - weights:      Array with the shape of eigenvalues.
+
+    - energy:       Uniform energy grid.
+
+Returns:
+    - density:      Deposited weight per energy on the grid points.
+    """
+    energy = np.asarray(energy, dtype=float)
+    step = _grid_step(energy)
+    n = len(energy)
+    eigenvalues = np.ravel(eigenvalues)
+    weights = np.ravel(weights)
+    result = np.zeros(n + 1)
+    for start in range(0, len(eigenvalues), chunk_size):
+        position = (eigenvalues[start:start + chunk_size] - energy[0]) / step
+        index = np.floor(position).astype(np.int64)
+        inside = (index >= 0) & (index < n)
+        index = index[inside]
+        fraction = position[inside] - index
+        chunk_weights = weights[start:start + chunk_size][inside]
+        result += np.bincount(index, chunk_weights * (1 - fraction), minlength=n + 1)
+        result += np.bincount(index + 1, chunk_weights * fraction, minlength=n + 1)
+    return result[:n] / step
+
+
+def broaden(density, step, width, kind='gaussian'):
+    """Convolves density, given on a uniform grid with spacing step, with a Gaussian (width is the standard deviation)
+or a Lorentzian (width is the half width at half maximum) through zero padded FFTs. Weight that is broadened beyond
+the ends of the grid is lost."""
+    n = len(density)
+    x = np.arange(-(n - 1), n) * step
+    if kind == 'gaussian':
+        kernel = np.exp(-x**2 / (2 * width**2))
+        # normalized on the grid, so that widths of the order of step conserve the weight as well
+        kernel /= kernel.sum() * step
+    elif kind == 'lorentzian':
+        kernel = width / np.pi / (x**2 + width**2)
+    else:
+        raise ValueError('kind must be gaussian or lorentzian')
+    n_fft = 2**int(np.ceil(np.log2(3 * n - 2)))
+    convolution = np.fft.irfft(np.fft.rfft(density, n_fft) * np.fft.rfft(kernel, n_fft), n_fft)
+    return convolution[n - 1:2 * n - 1] * step
+
+
+def smeared_dos(eigenvalues, weights=None, energy=None, width=0.1, kind='gaussian', degeneracy=2.0):
+    """Computes the density of states with Gaussian or Lorentzian smearing.
+
+Args:
+    - eigenvalues:  Eigenvalues in eV with shape (n_k, n_bands) or (n_spin, n_k, n_bands).
+
+Keyword args:
+    - weights:      Weights of the k points with shape (n_k,). They are normalized to one. Default: equal weights.
+
+    - energy:       Uniform energy grid in eV. Default: energy_grid(eigenvalues, padding=5*width).
+
+    - width:        Standard deviation of the Gaussian or half width of the Lorentzian in eV.
+
+    - kind:         'gaussian' or 'lorentzian'.
+
+    - degeneracy:   Number of electrons per state, i.e. 2 for spin degenerate and 1 for spin polarized bands.
+
+Returns:
+    - energy:       The energy grid.
+
+    - dos:          Density of states in states per eV and unit cell.
+    """
+    eigenvalues = np.asarray(eigenvalues, dtype=float)
+    n_k, n_bands = eigenvalues.shape[-2:]
+    if weights is None:
+        weights = np.ones(n_k)
+    weights = np.asarray(weights, dtype=float) / np.sum(weights) * degeneracy
+    if energy is None:
+        energy = energy_grid(eigenvalues, padding=5 * width)
+    energy = np.asarray(energy, dtype=float)
+
+    state_weights = np.broadcast_to(weights[:, np.newaxis], eigenvalues.shape)
+    density = histogram(eigenvalues, state_weights, energy)
+    return energy, broaden(density, _grid_step(energy), width, kind=kind)
+
+
+def tetrahedron_pieces(e):
+    """Returns the number of states below x of tetrahedra with the sorted corner energies e (shape (m, 4)) as cubic
+polynomials a0 + a1*u + a2*u**2 + a3*u**3 in u = x - reference on the three intervals [e1, e2), [e2, e3) and [e3, e4).
+
+Returns:
+    - start, stop:      Intervals with shape (3*m,).
+
+    - reference:        Expansion points with shape (3*m,).
+
+    - coefficients:     Array of shape (4, 3*m) with a0 to a3.
+    """
+    e1, e2, e3, e4 = e.T
+    e21, e31, e41, e32, e42, e43 = e2 - e1, e3 - e1, e4 - e1, e3 - e2, e4 - e2, e4 - e3
+    m = len(e)
+    coefficients = np.zeros((4, 3 * m))
+    # the denominators only vanish for empty intervals, whose pieces are never evaluated
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficients[3, :m] = 1 / (e21 * e31 * e41)
+        middle = 1 / (e31 * e41)
+        coefficients[0, m:2 * m] = e21**2 * middle
+        coefficients[1, m:2 * m] = 3 * e21 * middle
+        coefficients[2, m:2 * m] = 3 * middle
+        coefficients[3, m:2 * m] = -(e31 + e42) / (e32 * e42) * middle
+        coefficients[0, 2 * m:] = 1
+        coefficients[3, 2 * m:] = 1 / (e41 * e42 * e43)
+    start = np.concatenate([e1, e2, e3])
+    stop = np.concatenate([e2, e3, e4])
+    reference = np.concatenate([e1, e2, e4])
+    return start, stop, reference, coefficients
+
+
+def _first_edge(x, edge0, step, n_edges):
+    """Returns the index of the first edge of a uniform grid that is not below x, at most n_edges."""
+    return np.clip(np.ceil((x - edge0) / step), 0, n_edges).astype(np.int64)
+
+
+def tetrahedron_dos(eigenvalues, energy=None, degeneracy=2.0, chunk_size=2**20):
+    """Computes the density of states with the linear tetrahedron method.
+
+Args:
+    - eigenvalues:  Eigenvalues in eV on the full regular k mesh with shape (n1, n2, n3, n_bands) or
+                    (n_spin, n1, n2, n3, n_bands). The mesh is periodic, i.e. it must not contain the points of the
+                    next Brillouin zone.
+
+Keyword args:
+    - energy:       Uniform energy grid in eV. Default: energy_grid(eigenvalues).
+
+    - degeneracy:   Number of electrons per state, i.e. 2 for spin degenerate and 1 for spin polarized bands.
+
+    - chunk_size:   Number of tetrahedra and bands that are processed at once.
+
+Returns:
+    - energy:       The energy grid.
+
+    - dos:          Density of states in states per eV and unit cell, averaged over the bins around the grid points.
+    """
+    eigenvalues = np.asarray(eigenvalues, dtype=float)
+    if eigenvalues.ndim == 4:
+        eigenvalues = eigenvalues[np.newaxis]
+    if energy is None:
+        energy = energy_grid(eigenvalues)
+    energy = np.asarray(energy, dtype=float)
+    step = _grid_step(energy)
+    n = len(energy)
+    edges = np.append(energy - step / 2, energy[-1] + step / 2)
+
+    n_spin, n1, n2, n3, n_bands = eigenvalues.shape
+    weight = degeneracy / (6 * n1 * n2 * n3)
+    # number of states below every edge: complete tetrahedra are counted by the edge where they end,
+    # the edges within a tetrahedron get their analytic fraction
+    completed = np.zeros(n + 2)
+    partial = np.zeros(n + 1)
+    slab = max(1, chunk_size // (6 * n2 * n3 * n_bands))
+    for spin in range(n_spin):
+        for i0 in range(0, n1, slab):
+            rows = np.arange(i0, min(i0 + slab, n1))
+            corners = []
+            for corner in range(8):
+                di, dj, dk = corner & 1, (corner >> 1) & 1, (corner >> 2) & 1
+                values = eigenvalues[spin][(rows + di) % n1]
+                corners.append(np.roll(np.roll(values, -dj, axis=1), -dk, axis=2).reshape(-1, n_bands))
+            corners = np.array(corners)
+            e = np.sort(corners[tetrahedra].transpose(0, 2, 3, 1).reshape(-1, 4), axis=1)
+
+            completed += np.bincount(_first_edge(e[:, 3], edges[0], step, n + 1), minlength=n + 2)
+
+            start, stop, reference, coefficients = tetrahedron_pieces(e)
+            # edges with start < edge < stop
+            first = np.clip(np.floor((start - edges[0]) / step) + 1, 0, n + 1).astype(np.int64)
+            counts = _first_edge(stop, edges[0], step, n + 1) - first
+            inside = counts > 0
+            counts = counts[inside]
+            if len(counts) == 0:
+                continue
+            edge_index = np.repeat(first[inside] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            u = edges[0] + edge_index * step - np.repeat(reference[inside], counts)
+            a = np.repeat(coefficients[:, inside], counts, axis=1)
+            partial += np.bincount(edge_index, a[0] + u * (a[1] + u * (a[2] + u * a[3])), minlength=n + 1)
+
+    number_of_states = weight * (np.cumsum(completed)[:n + 1] + partial)
+    return energy, np.diff(number_of_states) / step
+
+
+if __name__ == "__main__":
+    import time
+
+    # free electron like band on a cubic mesh and a tight binding band with a van Hove singularity
+    n_k, n_bands = 100, 10
+    k = np.arange(n_k) / n_k
+    kx, ky, kz = np.meshgrid(k, k, k, indexing='ij')
+    cosines = np.cos(2 * np.pi * kx) + np.cos(2 * np.pi * ky) + np.cos(2 * np.pi * kz)
+    eigenvalues = -cosines[..., np.newaxis] + 3 * np.arange(n_bands)
+    energy = np.linspace(-4, 3 * n_bands + 1, 4001)
+
+    start = time.time()
+    energy, dos = smeared_dos(eigenvalues.reshape(-1, n_bands), energy=energy, width=0.05)
+    print('Gaussian smearing of {0:d} eigenvalues: {1:1.3f} s'.format(eigenvalues.size, time.time() - start))
+    print('Number of electrons: {0:1.4f}'.format(np.sum(dos) * (energy[1] - energy[0])))
+
+    start = time.time()
+    energy, dos = tetrahedron_dos(eigenvalues[::2, ::2, ::2], energy=energy)
+    print('Tetrahedron method: {0:1.3f} s'.format(time.time() - start))
+    print('Number of electrons: {0:1.4f}'.format(np.sum(dos) * (energy[1] - energy[0])))
@@ -0,0 +1,274 @@
+"""Futures for the calculations of the dft engine handlers.
+
+The start_* and calculate_* methods of the handlers are decorated with engine_task. They still start the engine
+immediately but return an EngineFuture, whose result is the parsed result of the run, e.g. a BandStructure,
+OpticalSpectrum or KohnShamDensity. A handler runs one calculation at a time in its working directory, so runs that
+are started while another one is still active are queued and started as soon as it has finished.
+
+The run only holds a weak reference to its future. The results are parsed only if the future is still referenced
+when the run has finished, so runs whose futures were discarded, e.g. the runs started by the GUI, which polls the
+handler itself, are not parsed twice.
+
+Example:
+    futures = [engine.start_ground_state(structure, band_structure_points=points) for structure in structures]
+    for future in concurrent.futures.as_completed(futures):
+        band_structure = future.result()
+
+    or within a coroutine:
+    band_structures = await asyncio.gather(*[engine.start_ground_state(structure, band_structure_points=points)
+                                             for structure in structures])
+"""
+from __future__ import division, print_function
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+import numpy as np
+import solid_state_tools as sst
+from execution_backends import ExecutionError
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+poll_interval = 0.5
+
+
+class EngineFuture(concurrent.futures.Future):
+    """Future of an engine run. Besides the methods of concurrent.futures.Future it offers progress callbacks,
+which are called with the scf status of the run (see read_scf_status of the handlers) whenever it changes.
+It can be awaited in asyncio coroutines."""
+    def __init__(self, name=''):
+        super(EngineFuture, self).__init__()
+        self.name = name
+        self.progress = None
+        self._progress_callbacks = []
+
+    def add_progress_callback(self, fn):
+        self._progress_callbacks.append(fn)
+        if self.progress is not None:
+            fn(self.progress)
+
+    def set_progress(self, progress):
+        self.progress = progress
+        for fn in self._progress_callbacks:
+            try:
+                fn(progress)
+            except Exception:
+                logging.exception('Progress callback of {0} failed'.format(self.name))
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+    def __repr__(self):
+        return '<EngineFuture {0} {1}>'.format(self.name, self._state.lower())
+
+
+class _Run(object):
+    def __init__(self, handler, start, reader, future):
+        self.handler = handler
+        self.start = start
+        self.reader = reader
+        self.future_ref = weakref.ref(future)
+        self.thread = None
+        self.process = None
+
+    @property
+    def future(self):
+        """The future of the run or None if nobody holds it anymore."""
+        return self.future_ref()
+
+    def is_active(self):
+        """A run is active while a thread started by it (e.g. the second step of a g0w0 calculation) is alive or
+while its engine process is still the current process of the handler and has not finished."""
+        if self.thread is not None and self.thread.is_alive():
+            return True
+        if self.process is None:
+            self.process = self.handler.engine_process
+        return self.process is not None and self.process is self.handler.engine_process and self.process.poll() is None
+
+
+class _TaskQueue(object):
+    """Runs the engine tasks of one handler one after another."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = None
+        self.pending = deque()
+
+    def submit(self, run):
+        with self.lock:
+            # the queue stays busy until the monitor of the active run has parsed its results and called start_next,
+            # a new run could overwrite the output files otherwise
+            start_now = self.active is None
+            if start_now:
+                self.active = run
+            else:
+                self.pending.append(run)
+        if start_now:
+            run.future.set_running_or_notify_cancel()
+            self.start(run, raise_errors=True)
+
+    def start(self, run, raise_errors=False):
+        thread = getattr(run.handler, 'engine_thread', None)
+        try:
+            run.start()
+        except Exception as e:
+            future = run.future
+            if future is not None:
+                future.set_exception(e)
+            else:
+                logging.exception('Queued engine run could not be started')
+            self.start_next(run)
+            if raise_errors:
+                raise
+            return
+        if getattr(run.handler, 'engine_thread', None) is not thread:
+            run.thread = run.handler.engine_thread
+        else:
+            run.process = run.handler.engine_process
+
+        monitor = threading.Thread(target=self.monitor, args=(run,))
+        monitor.daemon = True
+        monitor.start()
+
+    def monitor(self, run):
+        last_progress = None
+        while run.is_active():
+            time.sleep(poll_interval)
+            last_progress = self.report_progress(run, last_progress)
+        self.finish(run)
+        self.start_next(run)
+
+    def report_progress(self, run, last_progress):
+        future = run.future
+        if future is None or not future._progress_callbacks:
+            return last_progress
+        try:
+            progress = run.handler.read_scf_status()
+        except Exception:
+            progress = None
+        if progress is not None and (last_progress is None or not np.array_equal(progress, last_progress)):
+            future.set_progress(progress)
+            return progress
+        return last_progress
+
+    def finish(self, run):
+        """Sets the parsed results of the finished run, unless its future has been discarded."""
+        future = run.future
+        if future is None:
+            return
+        try:
+            result = run.reader()
+        except Exception as e:
+            returncode = run.process.poll() if run.process is not None else None
+            if returncode:
+                future.set_exception(ExecutionError('{0} failed with exit code {1}: {2}'.format(future.name, returncode, e)))
+            else:
+                future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def start_next(self, finished_run):
+        while True:
+            with self.lock:
+                if self.active is not finished_run:
+                    return
+                if not self.pending:
+                    self.active = None
+                    return
+                run = self.pending.popleft()
+                self.active = run
+            # a queued run whose future has been discarded is still started
+            future = run.future
+            if future is None or future.set_running_or_notify_cancel():
+                self.start(run)
+                return
+            finished_run = run
+
+
+_task_queues = weakref.WeakKeyDictionary()
+_task_queues_lock = threading.Lock()
+
+
+def task_queue(handler):
+    with _task_queues_lock:
+        if handler not in _task_queues:
+            _task_queues[handler] = _TaskQueue()
+        return _task_queues[handler]
+
+
+def is_busy(handler):
+    """Returns True while a run of handler is active or queued. A run stays active after its engine process has
+finished until its results have been read."""
+    with _task_queues_lock:
+        queue = _task_queues.get(handler)
+    if queue is None:
+        return False
+    with queue.lock:
+        return queue.active is not None or len(queue.pending) > 0
+
+
+def engine_task(reader):
+    """Decorator for the start_* and calculate_* methods of the handlers.
+
+The decorated method returns an EngineFuture whose result is reader(handler, *args, **kwargs), called with the
+arguments of the method after the run has finished. The blocking keyword is handled here: with blocking=True the
+call returns after the run has finished."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            blocking = kwargs.pop('blocking', False)
+            future = EngineFuture(method.__name__)
+            run = _Run(self, lambda: method(self, *args, **kwargs), lambda: reader(self, *args, **kwargs), future)
+            task_queue(self).submit(run)
+            if blocking:
+                concurrent.futures.wait([future])
+            return future
+        return wrapper
+    return decorator
+
+
+def read_ground_state(handler, crystal_structure, band_structure_points=None, *args, **kwargs):
+    """Returns an EnergyDiagram for molecules, the BandStructure if band_structure_points were given and the
+scf status otherwise."""
+    if type(crystal_structure) is sst.MolecularStructure and hasattr(handler, 'read_energy_diagram'):
+        return handler.read_energy_diagram()
+    if band_structure_points is None:
+        return handler.read_scf_status()
+    if handler.engine_name == 'quantum espresso':
+        coords = [x[0] for x in band_structure_points]
+        labels = [x[1] for x in band_structure_points]
+        new_coords = crystal_structure.convert_to_tpiba(coords)
+        return handler.read_bandstructure(special_k_points=list(zip(new_coords, labels)))
+    elif handler.engine_name == 'abinit':
+        return handler.read_bandstructure(special_k_points=band_structure_points, crystal_structure=crystal_structure)
+    return handler.read_bandstructure()
+
+
+def read_optical_spectrum(handler, *args, **kwargs):
+    return handler.read_optical_spectrum()
+
+
+def read_gw(handler, crystal_structure, band_structure_points=None, *args, **kwargs):
+    return handler.read_gw_bandstructure(special_k_points=band_structure_points, structure=crystal_structure)
+
+
+def read_phonons(handler, crystal_structure, band_structure_points=None, *args, **kwargs):
+    return handler.read_phonon_bandstructure(special_k_points=band_structure_points, structure=crystal_structure)
+
+
+def read_relax(handler, *args, **kwargs):
+    # the GUI polls the relaxation with handler.relax_reader, so the output is parsed with a reader of its own
+    reader = handler.relax_output_reader()
+    reader.update()
+    if len(reader.trajectory) == 0:
+        return None
+    return reader.trajectory[-1]
+
+
+def read_density(handler, *args, **kwargs):
+    return handler.read_ks_state()
@@ -1,5 +1,8 @@
 import numpy as np
 import solid_state_tools as sst
+import execution_backends
+import engine_futures
+import trajectory_reader
 import xml.etree.ElementTree as ET
 import xml
 from xml.dom import minidom
@@ -44,6 +47,9 @@ class Handler:
         self.working_dirctory = '/exciting_files/'
         self.pseudo_directory = None
         self.engine_process = None
+        # thread of runs that start the engine several times, e.g. ground state and band structure
+        self.engine_thread = None
+        self.executor = execution_backends.LocalExecutor()
         self.info_file = 'INFO.OUT'
         self.info_text = """<a href="http://exciting-code.org/">exciting</a> is an all-electron full-potential computer package <a href="http://iopscience.iop.org/0953-8984/26/36/363202">[GUL-2014]</a> for first-principles calculations, based on (linearized) augmented planewave + local orbital [(L)APW+lo] methods. 
         This family of basis sets is known as the most precise numerical scheme to solve the Kohn-Sham equations of density-functional theory (DFT), reaching extremely high - up to muHartree - precision <a href="http://iopscience.iop.org/0953-8984/26/36/363202">[GUL-2014]</a>, <a href="http://science.sciencemag.org/content/sci/351/6280/aad3000.full.pdf?ijkey=teUZMpwU49vhY&keytype=ref&siteid=sci">[LEJ-2016]</a>. Different schemes are available to account for van der Waals forces.
@@ -64,8 +70,6 @@ The interface with pre- and post-processing tools integrates the capabilities of
 
         self.supported_methods = sst.ComputationalMethods(['periodic', 'scf', 'g0w0', 'optical spectrum', 'phonons', 'relax','bandstructure'])
 
-        self._timestamp_tasks = {}
-
         self.project_directory = None
         self.input_filename = 'input.xml'
 
@@ -190,7 +194,8 @@ RPA (random phase approximation)
 singlet
 triplet"""}
 
-        self.relax_file_timestamp = None
+        self.relax_reader = None
+        self.relax_frames_loaded = 0
 
     def find_engine_folder(self):
         p = subprocess.Popen([search_command, 'excitingser'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,shell=shell_bool)
@@ -242,6 +247,7 @@ triplet"""}
         crystal_structure = sst.CrystalStructure(crystal_base, atom_array,scale=scale)
         return crystal_structure
 
+    @engine_futures.engine_task(engine_futures.read_ground_state)
     def start_ground_state(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a ground state calculation in a subprocess. The configuration is stored in scf_options.
 
@@ -258,13 +264,12 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the band structure if band_structure_points are given (an EnergyDiagram for molecules), otherwise the scf status.
         """
         try:
             os.remove(self.project_directory + self.working_dirctory + '/INFO.OUT')
         except Exception as e:
             print(e)
-        self._read_timestamps()
         self.current_output_file = 'INFO.OUT'
 
 
@@ -276,6 +281,7 @@ Returns:
         time.sleep(0.05)
         self._start_engine(blocking=blocking)
 
+    @engine_futures.engine_task(engine_futures.read_optical_spectrum)
     def start_optical_spectrum(self,crystal_structure):
         """This method starts a optical spectrum calculation in a subprocess. The configuration is stored in optical_spectrum_options.
 
@@ -283,11 +289,10 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the OpticalSpectrum.
         """
 
         self._filenames_tasks['optical spectrum'] = '/EPSILON_BSE' + self.optical_spectrum_options['bsetype'] + '_SCRfull_OC11.OUT'
-        self._read_timestamps()
         self.current_output_file = 'INFOXS.OUT'
 
         tree = self._make_tree()
@@ -297,6 +302,7 @@ Returns:
         time.sleep(0.05)
         self._start_engine()
 
+    @engine_futures.engine_task(engine_futures.read_gw)
     def start_gw(self,crystal_structure,band_structure_points=None,blocking=False):
         """This method starts a g0w0 calculation in a subprocess. The configuration is stored in gw_options.
 
@@ -313,9 +319,8 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the quasi particle BandStructure.
         """
-        self._read_timestamps()
         self.current_output_file = 'GW_INFO.OUT'
         tree = self._make_tree()
         self._add_scf_to_tree(tree, crystal_structure,skip=True)
@@ -324,11 +329,7 @@ Returns:
 
         def first_round():
             self._start_engine(blocking=blocking)
-            if self.custom_command_active:
-                while self.is_engine_running(tasks=['g0w0']):
-                    time.sleep(1)
-            else:
-                self.engine_process.wait()
+            self.engine_process.wait()
             if band_structure_points is not None:
                 tree = self._make_tree()
                 self._add_scf_to_tree(tree, crystal_structure,skip=True)
@@ -339,7 +340,9 @@ Returns:
 
         t = threading.Thread(target=first_round)
         t.start()
+        self.engine_thread = t
 
+    @engine_futures.engine_task(engine_futures.read_phonons)
     def start_phonon(self, crystal_structure, band_structure_points):
         """This method starts a phonon bandstructure calculation in a subprocess. The configuration is stored in phonons_options.
 
@@ -352,9 +355,8 @@ Args:
                                 Default: None
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the phonon BandStructure.
         """
-        self._read_timestamps()
         tree = self._make_tree()
         self._add_scf_to_tree(tree, crystal_structure)
         self._add_phonon_to_tree(tree, band_structure_points)
@@ -362,6 +364,7 @@ Returns:
         time.sleep(0.05)
         self._start_engine()
 
+    @engine_futures.engine_task(engine_futures.read_relax)
     def start_relax(self,crystal_structure):
         """This method starts a structure relaxation calculation in a subprocess. The configuration is stored in relax_options.
 
@@ -369,30 +372,42 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the relaxed structure.
         """
-        self._read_timestamps()
         tree = self._make_tree()
         self._add_scf_to_tree(tree, crystal_structure)
         self._add_relax_to_tree(tree)
         self._write_input_file(tree)
         time.sleep(0.05)
+        self.relax_reader = None
         self._start_engine()
 
+    def relax_output_reader(self):
+        """Returns a new incremental reader of the output of the relaxation (see trajectory_reader). Threads other than
+the GUI use their own reader, since load_relax_structure is not thread safe."""
+        file = self.project_directory+self.working_dirctory + 'geometry_opt.xml'
+        return trajectory_reader.SnapshotReader(file, self.parse_input_file)
+
     def load_relax_structure(self):
         """This method loads the result of a relaxation calculation, which is a molecular or crystal structure.
+Only the output that was written since the last call is parsed. All ionic steps are kept in relax_reader.trajectory.
 
 Returns:
-    - CrystalStructure or MolecularStructure object depending on the material under study.
+    - CrystalStructure or MolecularStructure object depending on the material under study. None if there is no new
+      structure since the last call.
         """
         file = self.project_directory+self.working_dirctory + 'geometry_opt.xml'
-        if not os.path.isfile(file):
-            return None
-        if self.relax_file_timestamp is not None and os.path.getmtime(file) == self.relax_file_timestamp:
+        if self.relax_reader is None or self.relax_reader.filename != file:
+            self.relax_reader = self.relax_output_reader()
+            self.relax_frames_loaded = 0
+        if self.relax_reader.update() == 'reset':
+            self.relax_frames_loaded = 0
+
+        trajectory = self.relax_reader.trajectory
+        if len(trajectory) == self.relax_frames_loaded:
             return None
-        struc = self.parse_input_file(file)
-        self.relax_file_timestamp = os.path.getmtime(file)
-        return struc
+        self.relax_frames_loaded = len(trajectory)
+        return trajectory[-1]
 
     def read_scf_status(self):
         """This method reads the result of a self consistent ground state calculation.
@@ -544,16 +559,12 @@ Returns:
         self._convert_3d_plot()
         l_data = np.genfromtxt(self.project_directory + self.working_dirctory + 'WF3D.xsf', skip_header=9, skip_footer=2, dtype=np.float)
         n_grid = l_data.shape[1]
-        # data = l_data.reshape((l_data.shape[1],l_data.shape[1],l_data.shape[1]),order='C')
-        data = np.zeros((n_grid,n_grid,n_grid))
-        for i in range(n_grid):
-            for j in range(n_grid):
-                for k in range(n_grid):
-                    data[i,k,j] = l_data[n_grid*j+k,i]
-            # data[:,:,i] = l_data[:,i].reshape((n_grid,n_grid),order='F')
-        data = data/data.max()
+        # row n_grid*j+k of l_data holds the values data[:,k,j]
+        data = np.ascontiguousarray(l_data.reshape((n_grid,n_grid,n_grid)).transpose(2,1,0))
+        data /= data.max()
         return sst.KohnShamDensity(data)
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_ks_density(self,crystal_structure,bs_point,grid='40 40 40'):
         """This method starts a calculation of a specific electronic state in a subprocess.
 
@@ -568,15 +579,15 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the KohnShamDensity.
                 """
-        self._read_timestamps()
         tree = self._make_tree()
         self._add_scf_to_tree(tree, crystal_structure, skip=True)
         self._add_ks_density_to_tree(tree, bs_point, grid)
         self._write_input_file(tree)
         self._start_engine()
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_electron_density(self, crystal_structure, grid='40 40 40'):
         """This method starts a calculation of the total (pseudo-) electron density in a subprocess.
 
@@ -588,13 +599,13 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the electron density.
                 """
         # TODO the total energy density calculation for exciting (if possible)
         raise NotImplementedError
 
     def kill_engine(self):
-        """Stops the execution of the engine process. Only possible for local execution and not in case of cluster calculation"""
+        """Stops the execution of the engine process. For cluster calculations the job is cancelled via the executor."""
         try:
             self.engine_process.kill()
         except Exception as e:
@@ -604,21 +615,23 @@ Returns:
         """Determines whether the engine is currently running.
 
 Keyword args:
-    - tasks:    List of tasks that are supposed to be running. Must be supplied when the calculations run on a cluster.
+    - tasks:    List of tasks that are supposed to be running. Not needed anymore since the state of the run is reported by the executor,
+                but still accepted for compatibility.
                 Possible tasks are: ['bandstructure', 'relax', 'ks density', 'scf', 'g0w0', 'g0w0 bands', 'optical spectrum']
 
 Returns:
     - res:      Boolean result. True: engine is running. False: engine is not running.
 """
-        if self.custom_command_active:
-            return self._is_engine_running_custom_command(tasks)
+        # runs that are queued or whose results are still being read count as running
+        return engine_futures.is_busy(self) or self._is_process_running()
+
+    def _is_process_running(self):
+        if self.engine_process is None:
+            return False
+        if self.engine_process.poll() is None:
+            return True
         else:
-            if self.engine_process is None:
-                return False
-            if self.engine_process.poll() is None:
-                return True
-            else:
-                return False
+            return False
 
     def will_scf_run(self):
         if self.scf_options['do'] == 'skip':
@@ -721,25 +734,6 @@ Returns:
             label = point[1]
             ET.SubElement(path, "point", coord="{0:1.6f} {1:1.6f} {2:1.6f}".format(*cords), label=label)
 
-    def _read_timestamps(self):
-        for task,filename in self._filenames_tasks.items():
-            if filename and os.path.isfile(self.project_directory+self.working_dirctory+filename):
-                self._timestamp_tasks[task]=os.path.getmtime(self.project_directory + self.working_dirctory + filename)
-
-    def _check_if_scf_is_finished(self):
-        try:
-            f = open(self.project_directory + self.working_dirctory + self.info_file, 'r')
-        except IOError:
-            return False
-        info_text = f.read()
-        f.close()
-        scf_list = []
-        matches = re.findall(r"EXCITING[\s\w]*stopped", info_text)
-        if len(matches) == 0:
-            return False
-        else:
-            return True
-
     def _write_input_file(self, tree):
         if not os.path.isdir(self.project_directory + self.working_dirctory):
             os.mkdir(self.project_directory + self.working_dirctory)
@@ -750,20 +744,14 @@ Returns:
             # tree.write(self.project_directory+self.working_dirctory+self.input_filename)
 
     def _start_engine(self,blocking=False):
-        os.chdir(self.project_directory + self.working_dirctory)
         if self.custom_command_active:
             command = ['bash',self.custom_command]
-            # if tasks is not None:
-            #     filenames = [self.filenames_tasks[task] for task in tasks if task != 'scf']
-            #     for filename in filenames:
-            #         os.remove(self.project_directory+self.working_dirctory+filename)
         else:
             command = self._engine_command
 
-        self.engine_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        os.chdir(self.project_directory)
+        self.engine_process = self.executor.submit(command, self.project_directory + self.working_dirctory)
         if blocking:
-            while self.is_engine_running():
+            while self._is_process_running():
                 time.sleep(0.1)
     #
     # def read_engine_status(self):
@@ -773,36 +761,6 @@ Returns:
     #     else:
     #         return None
 
-    def _is_engine_running_custom_command(self,tasks):
-        bool_list = []
-
-        for task in tasks:
-            if task == 'scf':
-                continue
-            filename = self._filenames_tasks[task]
-            # filenames[task] = filename
-            file_exists = os.path.isfile(self.project_directory + self.working_dirctory + filename)
-            # files_exists[task] = file_exists
-            if file_exists:
-                timestamp = os.path.getmtime(self.project_directory + self.working_dirctory + filename)
-                try:
-                    file_is_old_bool = timestamp == self._timestamp_tasks[task]
-                except KeyError:
-                    file_is_old_bool = False
-
-            file_exist_and_new = file_exists and not file_is_old_bool
-            bool_list.append(file_exist_and_new)
-
-
-        if 'scf' in tasks:
-            bool_list.append(self._check_if_scf_is_finished())
-
-        finished_bool = all(bool_list)
-        if finished_bool:
-            return False
-        else:
-            return True
-
     def _split_and_remove_whitespace(self, string):
         l1 = string.split()
         l2 = [float(x) for x in l1 if len(x) > 0]
@@ -856,7 +814,6 @@ if __name__ == '__main__':
 
     # handler.custom_command_active = True
     # ac_bo  = handler.is_engine_running(tasks = ['scf','bandstructure','g0w0'])
-    # ac_bo2 = handler._check_if_scf_is_finished()
 
     # print(ac_bo,ac_bo2)
 
@@ -0,0 +1,500 @@
+from __future__ import division, print_function
+import subprocess
+import signal
+import shlex
+import time
+import os
+import json
+from six import string_types
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+UNKNOWN = 'unknown'
+
+active_states = (PENDING, RUNNING)
+
+slurm_states = {'PENDING': PENDING, 'CONFIGURING': PENDING, 'REQUEUED': PENDING, 'RESV_DEL_HOLD': PENDING,
+                'RUNNING': RUNNING, 'COMPLETING': RUNNING, 'SUSPENDED': RUNNING, 'STAGE_OUT': RUNNING,
+                'RESIZING': RUNNING, 'SIGNALING': RUNNING,
+                'COMPLETED': COMPLETED,
+                'CANCELLED': CANCELLED, 'REVOKED': CANCELLED,
+                'FAILED': FAILED, 'TIMEOUT': FAILED, 'NODE_FAIL': FAILED, 'OUT_OF_MEMORY': FAILED,
+                'BOOT_FAIL': FAILED, 'DEADLINE': FAILED, 'PREEMPTED': FAILED}
+
+
+class ExecutionError(Exception):
+    pass
+
+
+def command_to_string(command):
+    if isinstance(command, string_types):
+        return command
+    return ' '.join(quote(x) for x in command)
+
+
+def _run(command, cwd=None):
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    out, err = p.communicate()
+    return p.returncode, out.decode('utf-8', 'replace'), err.decode('utf-8', 'replace')
+
+
+class Job(object):
+    """Handle for a submitted engine run.
+
+Mimics the parts of subprocess.Popen that are used throughout OpenDFT (poll, wait, kill, communicate),
+so that handlers can store it as engine_process regardless of where the engine actually runs."""
+    def __init__(self, executor, job_id, working_directory, process=None):
+        self.executor = executor
+        self.job_id = job_id
+        self.working_directory = working_directory
+        self.process = process
+        self.state = PENDING
+        self.returncode = None
+        self.last_poll = None
+        self.left_queue = None
+
+    @property
+    def pid(self):
+        if self.process is not None:
+            return self.process.pid
+        return None
+
+    def status(self):
+        return self.executor.status(self)
+
+    def is_active(self):
+        return self.status() in active_states
+
+    def poll(self):
+        if self.is_active():
+            return None
+        return self.returncode
+
+    def wait(self, interval=0.5):
+        while self.is_active():
+            time.sleep(interval)
+        return self.returncode
+
+    def kill(self):
+        self.executor.cancel(self)
+
+    def communicate(self):
+        return self.executor.communicate(self)
+
+    def fetch_outputs(self, filenames=None, destination=None):
+        return self.executor.fetch_outputs(self, filenames=filenames, destination=destination)
+
+    def __repr__(self):
+        return '<Job {0} ({1}) on {2}>'.format(self.job_id, self.state, self.executor.name)
+
+
+class Executor(object):
+    """Interface of the execution backends. All engine runs are submitted through one of these."""
+    name = 'abstract'
+
+    def submit(self, command, working_directory, shell=False):
+        """Starts command in working_directory and returns a Job."""
+        raise NotImplementedError
+
+    def status(self, job):
+        """Returns the current state of job, one of: pending, running, completed, failed, cancelled, unknown"""
+        raise NotImplementedError
+
+    def cancel(self, job):
+        raise NotImplementedError
+
+    def fetch_outputs(self, job, filenames=None, destination=None):
+        """Makes the output files of job available in destination (default: the local working directory of the job).
+Returns the list of local paths."""
+        if destination is None:
+            destination = job.working_directory
+        if filenames is None:
+            filenames = os.listdir(destination)
+        return [os.path.join(destination, filename) for filename in filenames]
+
+    def communicate(self, job):
+        return b'', b''
+
+    def _read_log_files(self, job, out_name, err_name):
+        res = []
+        for name in [out_name, err_name]:
+            path = os.path.join(job.working_directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    res.append(f.read())
+            except IOError:
+                res.append(b'')
+        return tuple(res)
+
+
+class LocalExecutor(Executor):
+    """Runs the engine as a child process on this machine."""
+    name = 'local'
+
+    def submit(self, command, working_directory, shell=False):
+        if shell:
+            command = command_to_string(command)
+        elif isinstance(command, string_types):
+            command = shlex.split(command)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell,
+                                   cwd=working_directory)
+        job = Job(self, process.pid, working_directory, process=process)
+        job.state = RUNNING
+        return job
+
+    def status(self, job):
+        if job.state not in active_states:
+            return job.state
+        returncode = job.process.poll()
+        if returncode is None:
+            return job.state
+        job.returncode = returncode
+        if job.state == CANCELLED:
+            pass
+        elif returncode == 0:
+            job.state = COMPLETED
+        else:
+            job.state = FAILED
+        return job.state
+
+    def cancel(self, job):
+        if job.state in active_states:
+            job.process.kill()
+            job.process.wait()
+            job.returncode = job.process.returncode
+            job.state = CANCELLED
+
+    def communicate(self, job):
+        return job.process.communicate()
+
+
+class SlurmExecutor(Executor):
+    """Submits the engine run as a batch job to a SLURM scheduler.
+
+The job states are read from squeue. Once the job has left the queue, its exit code is read from the exit file
+that the job writes or, if there is none, from sacct. A job stays active while squeue can not be reached.
+The scheduler commands can be replaced, e.g. by local scripts that emulate sbatch and squeue.
+The working directory is assumed to be on a file system that is shared with the compute nodes."""
+    name = 'slurm'
+    out_file = 'slurm-{0}.out'
+    err_file = 'slurm-{0}.err'
+    exit_file = 'slurm-{0}.exit'
+
+    def __init__(self, sbatch='sbatch', squeue='squeue', scancel='scancel', sacct='sacct', sbatch_options=None,
+                 poll_interval=5.0, exit_file_timeout=60.0):
+        self.sbatch = sbatch
+        self.squeue = squeue
+        self.scancel = scancel
+        self.sacct = sacct
+        if sbatch_options is None:
+            sbatch_options = []
+        self.sbatch_options = sbatch_options
+        self.poll_interval = poll_interval
+        # time the exit file may take to appear on the shared file system after the job has left the queue
+        self.exit_file_timeout = exit_file_timeout
+
+    def submit(self, command, working_directory, shell=False):
+        sbatch_command = [self.sbatch, '--parsable', '--output=' + self.out_file.format('%j'),
+                          '--error=' + self.err_file.format('%j')] + self.sbatch_options
+        wrapped_command = '( ' + command_to_string(command) + ' ); echo $? > ' + self.exit_file.format('$SLURM_JOB_ID')
+        sbatch_command += ['--wrap', wrapped_command]
+        returncode, out, err = _run(sbatch_command, cwd=working_directory)
+        job_id = out.strip().split(';')[0]
+        if returncode != 0 or not job_id:
+            raise ExecutionError('sbatch failed:\n' + out + err)
+        return Job(self, job_id, working_directory)
+
+    def status(self, job):
+        if job.state not in active_states:
+            return job.state
+        now = time.time()
+        if job.last_poll is not None and now - job.last_poll < self.poll_interval:
+            return job.state
+        job.last_poll = now
+
+        try:
+            returncode, out, err = _run([self.squeue, '-h', '-j', str(job.job_id), '-t', 'all', '-o', '%T'])
+        except OSError:
+            return job.state
+        slurm_state = out.strip().split()
+        if returncode == 0 and len(slurm_state) > 0:
+            state = self._convert_state(slurm_state[0])
+            if state in active_states or state == UNKNOWN:
+                if state != UNKNOWN:
+                    job.state = state
+                return job.state
+            self._read_final_state(job, state)
+        elif returncode == 0 or 'invalid job id' in err.lower():
+            # the job has left the queue
+            self._read_final_state(job, None)
+        # otherwise squeue failed, e.g. because the controller is not reachable, and the job stays active
+        return job.state
+
+    def cancel(self, job):
+        if job.state not in active_states:
+            return
+        returncode, out, err = _run([self.scancel, str(job.job_id)])
+        if returncode != 0:
+            raise ExecutionError('scancel failed:\n' + out + err)
+        job.state = CANCELLED
+        job.returncode = -signal.SIGTERM
+
+    def communicate(self, job):
+        return self._read_log_files(job, self.out_file.format(job.job_id), self.err_file.format(job.job_id))
+
+    def _read_final_state(self, job, queue_state):
+        """Sets the final state of a job that has finished (queue_state) or left the queue (queue_state None).
+The job stays active as long as neither its exit file nor the scheduler report how it ended."""
+        returncode = self._read_exit_file(job)
+        if returncode is not None:
+            job.returncode = returncode
+            if queue_state is None or queue_state == COMPLETED:
+                queue_state = COMPLETED if returncode == 0 else FAILED
+            job.state = queue_state
+            return
+
+        state, returncode = self._read_sacct(job)
+        if state is not None and state not in active_states:
+            job.state = state
+            job.returncode = returncode if returncode is not None else int(state != COMPLETED)
+            return
+
+        # the job ended without writing its exit file, e.g. it was killed, or the file is not visible yet
+        if queue_state is not None and queue_state != COMPLETED:
+            job.state = queue_state
+            job.returncode = 1
+        elif job.left_queue is None:
+            job.left_queue = time.time()
+        elif time.time() - job.left_queue > self.exit_file_timeout:
+            job.state = FAILED
+            job.returncode = 1
+
+    def _read_exit_file(self, job):
+        try:
+            with open(os.path.join(job.working_directory, self.exit_file.format(job.job_id))) as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def _read_sacct(self, job):
+        """Returns the state and the exit code of job reported by sacct. Both are None if sacct does not know it."""
+        if not self.sacct:
+            return None, None
+        try:
+            returncode, out, err = _run([self.sacct, '-n', '-X', '-P', '-j', str(job.job_id), '-o', 'State,ExitCode'])
+        except OSError:
+            return None, None
+        lines = [line for line in out.splitlines() if line.strip()]
+        if returncode != 0 or len(lines) == 0:
+            return None, None
+        fields = lines[0].split('|')
+        state = self._convert_state(fields[0])
+        if state == UNKNOWN:
+            return None, None
+        try:
+            return state, int(fields[1].split(':')[0])
+        except (IndexError, ValueError):
+            return state, None
+
+    def _convert_state(self, slurm_state):
+        # sacct reports e.g. "CANCELLED by 1000" and "CANCELLED+"
+        slurm_state = slurm_state.split()[0].rstrip('+').upper()
+        return slurm_states.get(slurm_state, UNKNOWN)
+
+
+class SshExecutor(Executor):
+    """Runs the engine on a remote host via ssh.
+
+The files of the local working directory that changed since they were last copied (usually the input files) are
+copied to remote_directory before the run and the results are copied back when the run has finished. The sizes and
+modification times of the copied files are recorded in sync_file. A job stays active while the host can not be
+reached."""
+    name = 'ssh'
+    out_file = 'opendft_job.out'
+    err_file = 'opendft_job.err'
+    exit_file = 'opendft_job.exit'
+    sync_file = 'opendft_job.sync'
+
+    def __init__(self, host, remote_directory, ssh='ssh', scp='scp', poll_interval=2.0):
+        self.host = host
+        self.remote_directory = remote_directory
+        self.ssh = ssh
+        self.scp = scp
+        self.poll_interval = poll_interval
+
+    def submit(self, command, working_directory, shell=False):
+        remote_dir = quote(self.remote_directory)
+        self._remote('mkdir -p ' + remote_dir + ' && rm -f ' + remote_dir + '/' + self.exit_file)
+        # the files of a previous job were fetched with its outputs, its exit code must not end up in the new run
+        job_files = [self.out_file, self.err_file, self.exit_file, self.sync_file]
+        names = [x for x in os.listdir(working_directory) if x not in job_files]
+        synced = self._read_sync_states(working_directory)
+        current = self._file_states(working_directory, names)
+        changed = [name for name in names if name in current and synced.get(name) != current[name]]
+        if len(changed) > 0:
+            self._copy([os.path.join(working_directory, x) for x in changed],
+                       self.host + ':' + self.remote_directory + '/')
+            synced.update((name, current[name]) for name in changed)
+            self._write_sync_states(working_directory, synced)
+
+        # the handlers start the engines with exec, which only replaces the subshell, so the exit code is still written
+        wrapped_command = '( ' + command_to_string(command) + ' ); echo $? > ' + self.exit_file
+        remote_command = 'cd {0} && nohup sh -c {1} >{2} 2>{3} </dev/null & echo $!'.format(
+            remote_dir, quote(wrapped_command), self.out_file, self.err_file)
+        out = self._remote(remote_command)
+        try:
+            pid = int(out.strip().split()[-1])
+        except (ValueError, IndexError):
+            raise ExecutionError('Could not start the job on ' + self.host + ':\n' + out)
+        job = Job(self, pid, working_directory)
+        job.state = RUNNING
+        return job
+
+    def status(self, job):
+        if job.state not in active_states:
+            return job.state
+        now = time.time()
+        if job.last_poll is not None and now - job.last_poll < self.poll_interval:
+            return job.state
+        job.last_poll = now
+
+        # the exit file is read again after kill -0, the job may have finished in between
+        exit_file = quote(self.remote_directory) + '/' + self.exit_file
+        remote_command = 'cat {0} 2>/dev/null || (kill -0 {1} 2>/dev/null && echo running) || cat {0} 2>/dev/null'
+        remote_command = remote_command.format(exit_file, job.job_id)
+        try:
+            ssh_returncode, out, err = _run([self.ssh, self.host, remote_command])
+        except OSError:
+            return job.state
+        out = out.strip()
+        try:
+            returncode = int(out)
+            state = COMPLETED if returncode == 0 else FAILED
+        except ValueError:
+            if ssh_returncode != 1 or out:
+                # the job is running or ssh failed (exit code 255), which does not tell anything about the job
+                return job.state
+            # neither running nor an exit code written: the process was killed
+            returncode = -signal.SIGTERM
+            state = FAILED
+        try:
+            self.fetch_outputs(job)
+        except ExecutionError:
+            # the outputs are fetched again with the next poll
+            return job.state
+        job.returncode = returncode
+        job.state = state
+        return job.state
+
+    def cancel(self, job):
+        if job.state not in active_states:
+            return
+        self._remote('pkill -TERM -P {0}; kill {0}'.format(job.job_id), check=False)
+        job.state = CANCELLED
+        job.returncode = -signal.SIGTERM
+        self.fetch_outputs(job)
+
+    def fetch_outputs(self, job, filenames=None, destination=None):
+        if destination is None:
+            destination = job.working_directory
+        if filenames is None:
+            sources = [self.host + ':' + self.remote_directory + '/*']
+        else:
+            sources = [self.host + ':' + self.remote_directory + '/' + filename for filename in filenames]
+        self._copy(sources, destination)
+        local_files = super(SshExecutor, self).fetch_outputs(job, filenames=filenames, destination=destination)
+        if os.path.abspath(destination) == os.path.abspath(job.working_directory):
+            # the fetched outputs are not uploaded again with the next run
+            synced = self._read_sync_states(destination)
+            synced.update(self._file_states(destination, [os.path.basename(x) for x in local_files]))
+            self._write_sync_states(destination, synced)
+        return local_files
+
+    def communicate(self, job):
+        return self._read_log_files(job, self.out_file, self.err_file)
+
+    def _remote(self, command, check=True):
+        returncode, out, err = _run([self.ssh, self.host, command])
+        if check and returncode != 0:
+            raise ExecutionError('ssh ' + self.host + ' failed:\n' + out + err)
+        return out
+
+    def _file_states(self, directory, names):
+        states = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            states[name] = [stat.st_mtime, stat.st_size]
+        return states
+
+    def _read_sync_states(self, directory):
+        """Returns the states of the files in directory that were copied from or to this host and directory."""
+        try:
+            with open(os.path.join(directory, self.sync_file)) as f:
+                return json.load(f).get(self.host + ':' + self.remote_directory, {})
+        except (IOError, ValueError):
+            return {}
+
+    def _write_sync_states(self, directory, states):
+        path = os.path.join(directory, self.sync_file)
+        try:
+            with open(path) as f:
+                all_states = json.load(f)
+        except (IOError, ValueError):
+            all_states = {}
+        all_states[self.host + ':' + self.remote_directory] = states
+        with open(path, 'w') as f:
+            json.dump(all_states, f)
+
+    def _copy(self, sources, destination):
+        returncode, out, err = _run([self.scp, '-q', '-r'] + sources + [destination])
+        if returncode != 0:
+            raise ExecutionError('scp failed:\n' + out + err)
+
+
+executors = {'local': LocalExecutor, 'slurm': SlurmExecutor, 'ssh': SshExecutor}
+
+
+def make_executor(name, **kwargs):
+    return executors[name](**kwargs)
+
+
+if __name__ == '__main__':
+    # Emulate a batch scheduler with two small scripts: sbatch runs the job in the background and
+    # records its pid, squeue reports RUNNING as long as that pid is alive and COMPLETED afterwards.
+    import tempfile
+    import stat
+
+    folder = tempfile.mkdtemp()
+    fake_sbatch = os.path.join(folder, 'sbatch')
+    fake_squeue = os.path.join(folder, 'squeue')
+    with open(fake_sbatch, 'w') as f:
+        f.write("""#!/bin/sh
+for last; do :; done
+SLURM_JOB_ID=$$ sh -c "$last" > slurm-$$.out 2> slurm-$$.err &
+echo $! > {0}/$$.pid
+echo "$$;fake"
+""".format(folder))
+    with open(fake_squeue, 'w') as f:
+        f.write("""#!/bin/sh
+pid=$(cat {0}/$3.pid 2>/dev/null) || exit 1
+kill -0 $pid 2>/dev/null && echo RUNNING || echo COMPLETED
+""".format(folder))
+    for script in [fake_sbatch, fake_squeue]:
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+    executor = SlurmExecutor(sbatch=fake_sbatch, squeue=fake_squeue, sacct=None, poll_interval=0.1)
+    job = executor.submit('sleep 1; echo finished', folder)
+    print(job, job.status())
+    job.wait(interval=0.2)
+    print(job, job.communicate())
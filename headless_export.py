@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""Renders the results of an OpenDFT project to image files without a display.
+
+Usage:
+    python headless_export.py project_directory output_directory [--format svg] [--processes 4]
+
+Structures and Kohn-Sham densities are drawn by StructureVisualization into an offscreen VTK render window,
+which needs a VTK build with offscreen support (e.g. OSMesa or EGL) on machines without an X server.
+Band structures and optical spectra are drawn with the Agg backend of matplotlib."""
+from __future__ import division, print_function
+import os
+os.environ['ETS_TOOLKIT'] = 'null'
+import argparse
+import logging
+import multiprocessing
+import re
+import traceback
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from traits.api import HasTraits, Instance, Event, Property
+from mayavi import mlab
+import solid_state_tools as sst
+from project_store import ProjectStore, ResultDictionary
+from visualization import StructureVisualization, draw_bandstructure, draw_energy_diagram, draw_optical_spectra
+
+mlab.options.offscreen = True
+
+image_formats = ('png', 'svg', 'pdf')
+exportable_kinds = ('crystal structure', 'band structure', 'optical spectra', 'ks densities')
+
+_worker = {}
+
+
+class OffscreenScene(HasTraits):
+    """Stands in for the MlabSceneModel of StructureVisualization and forwards to an offscreen mayavi figure."""
+    activated = Event
+    disable_render = Property
+    anti_aliasing_frames = Property
+
+    def __init__(self, size=(800, 600)):
+        super(OffscreenScene, self).__init__()
+        self.mlab = mlab
+        self.mayavi_scene = mlab.figure(size=size, bgcolor=(1, 1, 1))
+        self.tvtk_scene = self.mayavi_scene.scene
+
+    def _get_disable_render(self):
+        return self.tvtk_scene.disable_render
+
+    def _set_disable_render(self, value):
+        self.tvtk_scene.disable_render = value
+
+    def _get_anti_aliasing_frames(self):
+        return self.tvtk_scene.anti_aliasing_frames
+
+    def _set_anti_aliasing_frames(self, value):
+        self.tvtk_scene.anti_aliasing_frames = value
+
+    def render(self):
+        self.tvtk_scene.render()
+
+    def reset_zoom(self):
+        self.tvtk_scene.reset_zoom()
+
+    def add_actors(self, actors):
+        self.tvtk_scene.add_actors(actors)
+
+    def remove_actors(self, actors):
+        self.tvtk_scene.remove_actors(actors)
+
+
+class OffscreenStructureVisualization(StructureVisualization):
+    scene = Instance(OffscreenScene)
+
+    def __init__(self, crystal_structure, size=(800, 600)):
+        super(OffscreenStructureVisualization, self).__init__(crystal_structure)
+        self.scene = OffscreenScene(size)
+        self.update_plot()
+
+    def save(self, filename):
+        self.scene.mlab.savefig(filename, figure=self.scene.mayavi_scene)
+
+    def close(self):
+        self.scene.mlab.close(self.scene.mayavi_scene)
+
+
+def make_filename(kind, key, image_format):
+    name = re.sub(r'[^\w\-.]+', '_', '{0}_{1}'.format(kind, key))
+    return name + '.' + image_format
+
+
+def export_structure(filename, crystal_structure, ks_density=None, size=(800, 600)):
+    vis = OffscreenStructureVisualization(crystal_structure, size=size)
+    try:
+        if ks_density is not None:
+            vis.plot_density(ks_density, level_of_detail=0)
+        vis.save(filename)
+    finally:
+        vis.close()
+
+
+def export_plot(filename, kind, result, name='', size=(800, 600)):
+    figure = Figure(figsize=(size[0] / 100, size[1] / 100), dpi=100)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    if kind == 'optical spectra':
+        draw_optical_spectra(ax, [result], name_list=[name])
+    elif type(result) is sst.EnergyDiagram:
+        draw_energy_diagram(ax, result)
+    else:
+        draw_bandstructure(ax, result)
+    figure.tight_layout()
+    figure.savefig(filename)
+
+
+def _initialize_worker(project_directory, output_directory, image_format, size):
+    store = ProjectStore(project_directory)
+    dictionaries = {kind: ResultDictionary() for kind in exportable_kinds if kind != 'crystal structure'}
+    data = store.load(dictionaries)
+    _worker.update({'dictionaries': dictionaries, 'crystal structure': data['crystal structure'],
+                    'output directory': output_directory, 'format': image_format, 'size': size})
+
+
+def _export_task(task):
+    kind, key = task
+    filename = os.path.join(_worker['output directory'], make_filename(kind, key, _worker['format']))
+    try:
+        if kind == 'crystal structure':
+            export_structure(filename, _worker['crystal structure'], size=_worker['size'])
+        elif kind == 'ks densities':
+            export_structure(filename, _worker['crystal structure'], ks_density=_worker['dictionaries'][kind][key],
+                             size=_worker['size'])
+        else:
+            export_plot(filename, kind, _worker['dictionaries'][kind][key], name=key, size=_worker['size'])
+    except Exception:
+        return None, traceback.format_exc()
+    return filename, None
+
+
+def export_results(project_directory, output_directory, kinds=exportable_kinds, image_format='png', processes=None,
+                   size=(800, 600)):
+    """Renders results of the project in project_directory to image files in output_directory.
+
+Every result is rendered in its own task of a process pool. Results are loaded from the project store
+in the worker processes, so only the names of the results are sent to them.
+
+Args:
+    - project_directory:    Directory of a saved OpenDFT project.
+
+    - output_directory:     Directory the images are written to. It is created if necessary.
+
+Keyword args:
+    - kinds:                Kinds of results to render out of 'crystal structure', 'band structure',
+                            'optical spectra' and 'ks densities'.
+
+    - image_format:         'png', 'svg' or 'pdf'
+
+    - processes:            Number of worker processes. None uses the number of cpus.
+
+    - size:                 Size of the images in pixels.
+
+Returns:
+    - filenames:            List of the written image files. Failed results are logged as errors.
+    """
+    if image_format not in image_formats:
+        raise ValueError('Unknown image format: ' + image_format)
+    store = ProjectStore(project_directory)
+    if not store.exists():
+        raise ValueError('No saved project found in ' + project_directory)
+
+    dictionaries = {kind: ResultDictionary() for kind in exportable_kinds if kind != 'crystal structure'}
+    data = store.load(dictionaries)
+    tasks = []
+    if 'crystal structure' in kinds and data['crystal structure'] is not None:
+        tasks.append(('crystal structure', 'crystal structure'))
+    for kind in kinds:
+        if kind in dictionaries:
+            if kind == 'ks densities' and data['crystal structure'] is None:
+                continue
+            tasks.extend((kind, key) for key in sorted(dictionaries[kind].keys()))
+
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+
+    pool = multiprocessing.Pool(processes, initializer=_initialize_worker,
+                                initargs=(project_directory, output_directory, image_format, size))
+    try:
+        results = pool.map(_export_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    filenames = []
+    for task, (filename, error) in zip(tasks, results):
+        if error is None:
+            filenames.append(filename)
+        else:
+            logging.error('Export of {0} {1} failed:\n{2}'.format(task[0], task[1], error))
+    return filenames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the results of an OpenDFT project to images without a display.')
+    parser.add_argument('project_directory')
+    parser.add_argument('output_directory')
+    parser.add_argument('--format', default='png', choices=image_formats)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--kinds', nargs='+', default=list(exportable_kinds), choices=exportable_kinds)
+    parser.add_argument('--size', type=int, nargs=2, default=[800, 600])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    written = export_results(args.project_directory, args.output_directory, kinds=args.kinds,
+                             image_format=args.format, processes=args.processes, size=tuple(args.size))
+    logging.info('{0} images written to {1}'.format(len(written), args.output_directory))
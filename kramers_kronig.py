@@ -0,0 +1,107 @@
+"""Kramers-Kronig relations between the real and imaginary part of a dielectric function.
+
+The principal value integrals are evaluated as Hilbert transforms with FFTs on a zero padded uniform grid, which costs
+O(N log N) instead of the O(N^2) of a direct principal value sum. All functions work on arrays of shape (..., n_energy),
+so the three tensor components or many spectra on a common energy grid are transformed in one call.
+
+With the Hilbert transform H[f](w) = 1/pi P int f(w')/(w-w') dw' the relations for a causal response read
+epsilon1 - 1 = -H[epsilon2] and epsilon2 = H[epsilon1 - 1], where epsilon2 is continued as an odd and epsilon1 as an
+even function to negative energies."""
+from __future__ import division
+import numpy as np
+
+
+def uniform_grid(energy, start=0.0, max_points=2**16):
+    """Returns a uniform energy grid from start to energy.max() with the median positive step of energy. A few closely
+spaced points therefore do not refine the whole grid, and the grid never has more than max_points points."""
+    energy = np.asarray(energy)
+    steps = np.diff(energy)
+    step = np.median(steps[steps > 0])
+    n = min(int(np.round((energy.max() - start) / step)) + 1, max_points)
+    return np.linspace(start, energy.max(), n)
+
+
+def hilbert_transform(f, pad_factor=4):
+    """Returns the discrete Hilbert transform 1/pi P int f(y)/(x-y) dy of f along its last axis.
+
+f is padded with zeros to pad_factor times its length (rounded up to a power of two) so that the periodicity of the FFT
+does not fold the tails back into the range of f.
+    """
+    f = np.asarray(f, dtype=float)
+    n = f.shape[-1]
+    n_fft = 2**int(np.ceil(np.log2(pad_factor * n)))
+    spectrum = np.fft.fft(f, n_fft, axis=-1)
+    spectrum *= -1j * np.sign(np.fft.fftfreq(n_fft))
+    return np.fft.ifft(spectrum, axis=-1)[..., :n].real
+
+
+def interpolate_rows(x_new, x, values, left=None, right=None):
+    """Linear interpolation of all rows of values (shape (m, len(x))) at x_new with one set of weights.
+Points outside of x get the values left and right (arrays of shape (m,)) or the first and last column."""
+    index = np.clip(np.searchsorted(x, x_new, side='right') - 1, 0, len(x) - 2)
+    dx = x[index + 1] - x[index]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.clip(np.where(dx > 0, (x_new - x[index]) / dx, 0), 0, 1)
+    result = values[:, index] * (1 - t) + values[:, index + 1] * t
+    if left is not None:
+        result[:, x_new < x[0]] = left[:, np.newaxis]
+    if right is not None:
+        result[:, x_new > x[-1]] = right[:, np.newaxis]
+    return result
+
+
+def _symmetric_transform(energy, values, parity, pad_factor, left):
+    energy = np.asarray(energy, dtype=float)
+    values = np.asarray(values, dtype=float)
+    grid = uniform_grid(energy)
+    flat = values.reshape(-1, values.shape[-1])
+    on_grid = interpolate_rows(grid, energy, flat, left=left(flat))
+
+    # continue to negative energies, the grid then runs from -E_max to E_max
+    mirrored = parity * on_grid[:, :0:-1]
+    extended = np.concatenate([mirrored, on_grid], axis=1)
+    transformed = hilbert_transform(extended, pad_factor=pad_factor)[:, len(grid) - 1:]
+
+    return interpolate_rows(energy, grid, transformed).reshape(values.shape)
+
+
+def epsilon1_from_epsilon2(energy, epsilon2, pad_factor=4):
+    """Computes the real part of the dielectric function from the imaginary part.
+
+Args:
+    - energy:       Energy grid in eV with shape (n_energy,). It does not need to be uniform.
+
+    - epsilon2:     Imaginary parts with shape (..., n_energy), e.g. (3, n_energy) for the tensor components
+                    or (n_spectra, 3, n_energy) for many spectra.
+
+Keyword args:
+    - pad_factor:   Length of the zero padding for the FFTs in multiples of the (mirrored) input length.
+
+Returns:
+    - epsilon1:     Real parts with the shape of epsilon2.
+    """
+    return 1 - _symmetric_transform(energy, epsilon2, -1, pad_factor, lambda rows: np.zeros(len(rows)))
+
+
+def epsilon2_from_epsilon1(energy, epsilon1, pad_factor=4):
+    """Computes the imaginary part of the dielectric function from the real part. See epsilon1_from_epsilon2 for the arguments."""
+    return _symmetric_transform(energy, np.asarray(epsilon1, dtype=float) - 1, 1, pad_factor, lambda rows: rows[:, 0])
+
+
+if __name__ == "__main__":
+    import time
+
+    # Lorentz oscillator
+    omega_0, gamma, strength = 3.0, 0.3, 20.0
+    energy = np.linspace(0, 40, 8001)
+    denominator = (omega_0**2 - energy**2)**2 + (gamma * energy)**2
+    epsilon1_exact = 1 + strength * (omega_0**2 - energy**2) / denominator
+    epsilon2_exact = strength * gamma * energy / denominator
+
+    start = time.time()
+    epsilon1 = epsilon1_from_epsilon2(energy, np.array([epsilon2_exact] * 3))
+    epsilon2 = epsilon2_from_epsilon1(energy, epsilon1_exact)
+    print('Time: {0:1.3f} s'.format(time.time() - start))
+    mask = energy < 10
+    print('Max error epsilon1: {0:1.4f}'.format(np.abs(epsilon1[0] - epsilon1_exact)[mask].max()))
+    print('Max error epsilon2: {0:1.4f}'.format(np.abs(epsilon2 - epsilon2_exact)[mask].max()))
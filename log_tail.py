@@ -0,0 +1,139 @@
+"""Line indexed access to growing log files, e.g. the output files of running dft engines.
+
+Only the bytes that were appended since the last update are read, so polling a file of several GB costs as much as
+the new output. The byte offsets of all line starts are kept in a numpy array, which allows reading arbitrary line
+ranges and mapping search hits to line numbers without holding the file in memory."""
+from __future__ import division
+import mmap
+import os
+import numpy as np
+
+
+class LogFile:
+    """Index of the lines of a text file that grows by appending.
+
+Args:
+    - filename:     Path of the file. It does not need to exist yet.
+
+Keyword args:
+    - encoding:     Encoding used to decode the text.
+
+    - block_size:   Number of bytes that are read at once when indexing.
+    """
+    def __init__(self,filename,encoding='utf-8',block_size=2**24):
+        self.filename = filename
+        self.encoding = encoding
+        self.block_size = block_size
+        self.size = 0
+        self.file_size = 0
+        self.inode = None
+        # byte offsets of the line starts, the last entry is the start of the line that is not terminated yet
+        self.line_starts = np.zeros(1,dtype=np.int64)
+
+    @property
+    def n_lines(self):
+        """Number of lines including a last line without line break."""
+        return len(self.line_starts) - 1 + int(self.size > self.line_starts[-1])
+
+    def update(self,max_bytes=None):
+        """Indexes the content that was appended since the last call.
+
+Keyword args:
+    - max_bytes:    Maximum number of bytes that are indexed in this call. The rest is indexed by the next calls,
+                    see pending_bytes. Default: everything.
+
+Returns:
+    - status:   'unchanged', 'appended' or 'reset' if the file was truncated or replaced and has been indexed anew.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            if self.size == 0:
+                return 'unchanged'
+            self.reset()
+            return 'reset'
+
+        status = 'appended'
+        if stat.st_size < self.size or (self.inode is not None and stat.st_ino != self.inode):
+            self.reset()
+            status = 'reset'
+        self.inode = stat.st_ino
+        self.file_size = stat.st_size
+        if stat.st_size == self.size:
+            return 'unchanged' if status == 'appended' else status
+
+        end = stat.st_size if max_bytes is None else min(stat.st_size,self.size+max_bytes)
+        new_starts = [self.line_starts]
+        with open(self.filename,'rb') as f:
+            f.seek(self.size)
+            while self.size < end:
+                block = f.read(min(self.block_size,end-self.size))
+                if not block:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(block,dtype=np.uint8) == 10)
+                new_starts.append(newlines + self.size + 1)
+                self.size += len(block)
+        self.line_starts = np.concatenate(new_starts)
+        return status
+
+    @property
+    def pending_bytes(self):
+        """Number of bytes of the file at the last update that are not indexed yet."""
+        return max(0,self.file_size-self.size)
+
+    def reset(self):
+        self.size = 0
+        self.file_size = 0
+        self.inode = None
+        self.line_starts = np.zeros(1,dtype=np.int64)
+
+    def offset(self,line):
+        """Returns the byte offset of the start of line. Lines beyond the end give the size of the file."""
+        if line < len(self.line_starts):
+            return int(self.line_starts[line])
+        return self.size
+
+    def line_of_offset(self,offset):
+        """Returns the number of the line that contains the byte offset."""
+        return int(np.searchsorted(self.line_starts,offset,side='right')) - 1
+
+    def read(self,start,stop):
+        """Returns the bytes between the offsets start and stop."""
+        if stop <= start:
+            return b''
+        with open(self.filename,'rb') as f:
+            f.seek(start)
+            return f.read(stop-start)
+
+    def read_lines(self,start,stop):
+        """Returns the text of the lines start to stop (exclusive) with their line breaks."""
+        return self.read(self.offset(start),self.offset(stop)).decode(self.encoding,'replace')
+
+    def find(self,text,start=0):
+        """Searches text in the indexed part of the file through a memory map of the file.
+
+Keyword args:
+    - start:    Byte offset where the search starts.
+
+Returns:
+    - offset:   Byte offset of the first match at or after start or None if there is none.
+        """
+        pattern = text.encode(self.encoding)
+        if self.size == 0 or not pattern:
+            return None
+        try:
+            with open(self.filename,'rb') as f:
+                # the file may have been truncated since the last update, empty files can not be mapped
+                size = min(self.size,os.fstat(f.fileno()).st_size)
+                if size == 0:
+                    return None
+                mapped = mmap.mmap(f.fileno(),size,access=mmap.ACCESS_READ)
+                try:
+                    offset = mapped.find(pattern,start,size)
+                finally:
+                    mapped.close()
+        except (IOError,OSError,ValueError):
+            return None
+        if offset < 0:
+            return None
+        return offset
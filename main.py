@@ -16,21 +16,27 @@ else:
 
 os.environ['ETS_TOOLKIT'] = 'qt4'
 from pyface.qt import QtGui, QtCore
-from visualization import StructureVisualization, BandStructureVisualization, ScfVisualization, \
-    OpticalSpectrumVisualization, colormap_list, BrillouinVisualization
+from visualization import StructureVisualization, colormap_list, BrillouinVisualization, render_timings
+from plot_widgets import BandStructureVisualization, ScfVisualization, OpticalSpectrumVisualization
 import solid_state_tools as sst
 from solid_state_tools import p_table, p_table_rev
-from little_helpers import no_error_dictionary, CopySelectedCellsAction, PasteIntoTable, set_procname, get_proc_name, \
+import execution_backends
+from project_store import ProjectStore, ResultDictionary
+from log_tail import LogFile
+from little_helpers import no_error_dictionary, set_procname, get_proc_name, \
     find_data_file, get_stacktrace_as_string
+from console_kernel import KernelClient
 from TerminalClass import PythonTerminal
 import pickle
 import time
 import threading
+import multiprocessing
 from collections import OrderedDict
 import logging
 import syntax
 import re
 import copy
+import codecs
 
 try:
     import queue
@@ -207,12 +213,90 @@ class MayaviQWidget(QtGui.QWidget):
         self.visualization.update_plot(keep_view=keep_view)
 
     def update_crystal_structure(self, crystal_structure):
-        self.visualization.crystal_structure = crystal_structure
+        """Shows crystal_structure, which can also be a Trajectory that is then shown with playback controls."""
+        if type(crystal_structure) is sst.Trajectory:
+            self.visualization.set_trajectory(crystal_structure)
+        else:
+            self.visualization.set_trajectory(None)
+            self.visualization.crystal_structure = crystal_structure
 
     def do_select_event(self):
         pass
 
 
+class CopySelectedCellsAction(QtGui.QAction):
+    def __init__(self, table_widget):
+        if not isinstance(table_widget, QtGui.QTableWidget):
+            raise ValueError(str('CopySelectedCellsAction must be initialised with a QTableWidget. A %s was given.' % type(table_widget)))
+        super(CopySelectedCellsAction, self).__init__("Copy", table_widget)
+        self.setShortcut('Ctrl+c')
+        self.triggered.connect(self.copy_cells_to_clipboard)
+        self.table_widget = table_widget
+
+    def copy_cells_to_clipboard(self):
+        if len(self.table_widget.selectionModel().selectedIndexes()) > 0:
+            # sort select indexes into rows and columns
+            previous = self.table_widget.selectionModel().selectedIndexes()[0]
+            columns = []
+            rows = []
+            for index in self.table_widget.selectionModel().selectedIndexes():
+                if previous.column() != index.column():
+                    columns.append(rows)
+                    rows = []
+                rows.append(index.data())
+                previous = index
+            columns.append(rows)
+
+            # add rows and columns to clipboard
+            clipboard = ""
+            nrows = len(columns[0])
+            ncols = len(columns)
+            for r in range(nrows):
+                for c in range(ncols):
+                    clipboard += columns[c][r]
+                    if c != (ncols-1):
+                        clipboard += '\t'
+                clipboard += '\n'
+
+            # copy to the system clipboard
+            sys_clip = QtGui.QApplication.clipboard()
+            sys_clip.setText(clipboard)
+
+class PasteIntoTable(QtGui.QAction):
+    def __init__(self, table_widget,parent):
+        if not isinstance(table_widget, QtGui.QTableWidget):
+            raise ValueError(str('CopySelectedCellsAction must be initialised with a QTableWidget. A %s was given.' % type(table_widget)))
+        super(PasteIntoTable, self).__init__("Copy", table_widget)
+        self.setShortcut('Ctrl+v')
+        self.parent = parent
+        self.triggered.connect(self.paste_cells_from_clipboard)
+        self.table_widget = table_widget
+
+    def paste_cells_from_clipboard(self):
+        self.parent.disconnect_tables()
+        index = self.table_widget.selectedIndexes()[0]
+        i0 = index.row()
+        j0 = index.column()
+
+        sys_clip = QtGui.QApplication.clipboard()
+        clipboard = sys_clip.text()
+
+
+        rows = clipboard.split('\n')
+        n_rows = len(rows)
+        col_0 = rows[0].split()
+        n_col = len(col_0)
+
+        # data = np.zeros((n_rows,n_col))
+
+        for i,row in enumerate(rows):
+            col = row.split()
+            for j,el in enumerate(col):
+                self.table_widget.item(i+i0,j+j0).setText(el)
+        self.parent.connect_tables()
+        self.parent.handle_change()
+
+
 class EntryWithLabel(QtGui.QWidget):
     def __init__(self, parent, label, value=None, width_text=200, width_label=90):
         QtGui.QWidget.__init__(self, parent)
@@ -249,6 +333,8 @@ class EntryWithLabel(QtGui.QWidget):
 
 
 class ConsoleWindow(QtGui.QMainWindow):
+    scrollback_lines = 20000
+
     def __init__(self, parent=None):
         super(ConsoleWindow, self).__init__(parent)
 
@@ -292,8 +378,10 @@ class ConsoleWindow(QtGui.QMainWindow):
         self.input_scrollbar = self.input_text_widget.verticalScrollBar()
         self.splitter.addWidget(self.input_text_widget)
 
-        self.output_text_widget = QtGui.QTextBrowser(self)
-        self.output_text_widget.setStyleSheet('QTextBrowser { font-size: 10pt; font-family: monospace; }')
+        self.output_text_widget = QtGui.QPlainTextEdit(self)
+        self.output_text_widget.setReadOnly(True)
+        self.output_text_widget.setMaximumBlockCount(self.scrollback_lines)
+        self.output_text_widget.setStyleSheet('QPlainTextEdit { font-size: 10pt; font-family: monospace; }')
         self.output_scrollbar = self.output_text_widget.verticalScrollBar()
         self.splitter.addWidget(self.output_text_widget)
 
@@ -325,22 +413,30 @@ class ConsoleWindow(QtGui.QMainWindow):
 
         self.main_layout.addWidget(sub_frame)
 
-        self.python_interpreter = PythonTerminal({})
+        self.python_interpreter = KernelClient()
+        # the matplotlib section of a script needs the Qt event loop and therefore runs in this process
+        self.matplotlib_interpreter = PythonTerminal({})
 
         self.welcome_text = """# Welcome to the OpenDFT scripting console
 #
 # You can normally(*) use python to script here in addition to OpenDFT objects that can be
 # used to calculate electronic properties and visualize them. The structure, engine options etc. are loaded, when the
-# scripting window is opened and can be changed within the script. 
+# scripting window is opened and can be changed within the script, e.g. engine.scf_options['ecutwfc'] = 30.
+# Arrays like structure.atoms are copies, assign the changed array to change the structure: structure.atoms = atoms
 #
 # Predefined variables:
 # 
 # engine:           Dft engine object that can be used to calculate electronic properties. 
+#                   Its start_* and calculate_* methods return futures, whose results are the parsed results
+#                   of the calculation, e.g. engine.start_optical_spectrum(structure).result() or with asyncio.
 #
 # structure:        crystal or molecular structure from the main application. 
 #                   If you defined a structure with the main window you can directly use it here.
+#                   Assignments to its attributes (not to items of its arrays) change the structure of the
+#                   main window.
 #
-# plot_structure:   Function that updates the plot in the main window.
+# plot_structure:   Function that updates the plot in the main window. It also accepts a sst.Trajectory,
+#                   whose frames can then be played back.
 #
 # plot_scf:         Function that plots the current scf convergence in the main window.
 #
@@ -348,7 +444,8 @@ class ConsoleWindow(QtGui.QMainWindow):
 # e.g. help(engine) and help(engine.start_ground_state) should be quite helpful
 #
 # (*) For technical reasons matplotlib can be used but has to be put at the end of the script after a special seperator,
-# namely [dollarsign]matplotlib (see example below)
+# namely [dollarsign]matplotlib (see example below). The script runs in a separate process, the matplotlib part
+# runs in the main window with copies of the variables of the script.
 #
 # Following is an runnable (press f5) example of how to find the optimal cell scale (with very few steps for faster run-time)
 #
@@ -392,7 +489,6 @@ plt.show()
         """
         self.input_text_widget.setPlainText(self.welcome_text)
 
-        self.last_history = None
 
         self.saved_code = self.welcome_text
         self.saved_code_filename = None
@@ -454,10 +550,15 @@ plt.show()
         run_selection_action.triggered.connect(self.run_selection)
         self.run_menu.addAction(run_selection_action)
 
-        # terminate_execution_action = QtGui.QAction("Terminate execution", self)
-        # terminate_execution_action.setShortcut("F12")
-        # terminate_execution_action.triggered.connect(self.terminate_execution)
-        # self.run_menu.addAction(terminate_execution_action)
+        terminate_execution_action = QtGui.QAction("Interrupt execution", self)
+        terminate_execution_action.setShortcut("F12")
+        terminate_execution_action.triggered.connect(self.terminate_execution)
+        self.run_menu.addAction(terminate_execution_action)
+
+        restart_kernel_action = QtGui.QAction("Restart kernel", self)
+        restart_kernel_action.setToolTip('Starts a new python process for the scripts. All variables are reset.')
+        restart_kernel_action.triggered.connect(self.restart_kernel)
+        self.run_menu.addAction(restart_kernel_action)
 
     def update_output(self):
         if self.code_thread.is_alive():
@@ -465,25 +566,21 @@ plt.show()
         else:
             self.status_bar.set_engine_status(False)
 
-        if self.last_history == self.python_interpreter.out_history:
+        text = self.python_interpreter.read_output()
+        if not text:
             return
-        else:
-            self.last_history = copy.deepcopy(self.python_interpreter.out_history)
 
-        cur_pos = self.output_scrollbar.value()
-        if cur_pos == self.output_scrollbar.maximum():
-            final_pos = None
-        else:
-            final_pos = cur_pos
+        follow = self.output_scrollbar.value() == self.output_scrollbar.maximum()
+        self.append_output(text.replace(u"\u2029", '\n'))
+        if follow:
+            self.output_scrollbar.setValue(self.output_scrollbar.maximum())
 
-        history = [item.replace(u"\u2029", '\n') for sublist in self.python_interpreter.out_history for item in sublist
-                   if len(item) > 0]  # collapse list of list to one list
-        out_text = u'\n'.join(history)
-        self.output_text_widget.setPlainText(out_text)
-        if final_pos is None:
-            final_pos = self.output_scrollbar.maximum()
-        self.output_scrollbar.setValue(final_pos)
-        QtGui.QApplication.processEvents()
+    def append_output(self, text):
+        """Appends text at the end of the output widget. Lines beyond scrollback_lines are dropped at the top."""
+        document = self.output_text_widget.document()
+        cursor = QtGui.QTextCursor(document)
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
 
     def history_move(self, x):
         self.current_history_element += x
@@ -499,7 +596,7 @@ plt.show()
     def run_selection(self):
         cursor = self.input_text_widget.textCursor()
         code_text = cursor.selectedText().replace(u"\u2029", '\n')
-        out = self.python_interpreter.run_code(code_text)
+        self.start_code_thread(lambda: self.python_interpreter.run_code(code_text))
         # self.update_output()
 
     def run_cell(self, jump=False):
@@ -514,7 +611,7 @@ plt.show()
             sel_cell = 0
         else:
             sel_cell = max(tr)
-        out = self.python_interpreter.run_code(cells[sel_cell])
+        self.start_code_thread(lambda: self.python_interpreter.run_code(cells[sel_cell]))
         # self.update_output()
         if jump:
             index = 0
@@ -532,7 +629,7 @@ plt.show()
         if code_text is None:
             code_text = self.input_text_widget.toPlainText()
         s_time = time.time()
-        out = self.python_interpreter.run_code(code_text)
+        self.python_interpreter.run_code(code_text)
         run_time = time.time() - s_time
         if run_time < 600:
             unit = 's'
@@ -546,22 +643,25 @@ plt.show()
         else:
             show_time = run_time / 60 ** 2 / 24
             unit = 'days'
-        self.python_interpreter.out_history.append(
-            ['------- Code execution finished after {0:1.1f} {1} -------\n'.format(show_time, unit)])
+        self.python_interpreter.write_output(
+            '------- Code execution finished after {0:1.1f} {1} -------\n'.format(show_time, unit))
 
     def handle_interactive_text(self):
         code_text = self.interactive_text.get_text()
-        self.python_interpreter.out_history.append(['>> ' + code_text])
+        self.python_interpreter.write_output('>> ' + code_text + '\n')
         self.interactive_text.set_text('')
-        out = self.python_interpreter.run_code(code_text)
+        self.start_code_thread(lambda: self.python_interpreter.run_code(code_text))
         # self.update_output()
         self.interactive_history.insert(0, code_text)
         self.current_history_element = -1
 
     def terminate_execution(self):
         if self.code_thread.is_alive():
-            # self.code_thread.__stop()
-            pass
+            self.python_interpreter.interrupt()
+
+    def restart_kernel(self):
+        self.python_interpreter.restart_interpreter()
+        self.python_interpreter.write_output('------- Kernel restarted -------\n')
 
     def new_file(self):
         if self.check_saved_progress():
@@ -635,7 +735,7 @@ plt.show()
         self.code_thread.start()
 
     def show(self):
-        self.update_fields_timer.start(100)
+        self.update_fields_timer.start(30)
         super(ConsoleWindow, self).show()
 
     def closeEvent(self, event):
@@ -647,10 +747,15 @@ plt.show()
 
         if task == 'matplotlib':
             if not self.code_thread.is_alive():
-                self.python_interpreter.run_code(item['code'])
+                self.run_matplotlib_code(item['code'])
             else:
                 self.queue.put({'task': 'matplotlib', 'code': item['code']})
 
+    def run_matplotlib_code(self, code_text):
+        self.matplotlib_interpreter.update_vars(self.python_interpreter.get_namespace())
+        self.matplotlib_interpreter.run_code(code_text)
+        self.python_interpreter.write_output(self.matplotlib_interpreter.read_output())
+
     def check_queue_and_update(self):
         if not self.queue.empty():
             q_item = self.queue.get()
@@ -723,6 +828,38 @@ class CodeInformationWindow(QtGui.QDialog):
         self.text_view.setPlainText(text)
 
 
+class RenderTimingsWindow(QtGui.QDialog):
+    def __init__(self, parent=None):
+        super(RenderTimingsWindow, self).__init__(parent)
+
+        self.resize(400, 500)
+        self.setWindowTitle('Render timings')
+        layout = QtGui.QVBoxLayout(self)
+        self.table = QtGui.QTableWidget(self)
+        self.table.setColumnCount(3)
+        self.table.setHorizontalHeaderLabels(['Update', 'Build [ms]', 'Render [ms]'])
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        render_timings.listeners.append(self.handle_new_timing)
+
+    def showEvent(self, event):
+        self.update_table()
+        super(RenderTimingsWindow, self).showEvent(event)
+
+    def handle_new_timing(self, entry):
+        if self.isVisible():
+            self.update_table()
+
+    def update_table(self):
+        entries = list(render_timings.entries)[::-1]
+        self.table.setRowCount(len(entries))
+        for i, (name, build_time, render_time) in enumerate(entries):
+            texts = [name, '{0:1.1f}'.format(build_time * 1000), '{0:1.1f}'.format(render_time * 1000)]
+            for j, text in enumerate(texts):
+                self.table.setItem(i, j, QtGui.QTableWidgetItem(text))
+
+
 class LoadResultsWindow(QtGui.QDialog):
     def __init__(self, parent, tasks):
         super(LoadResultsWindow, self).__init__(parent)
@@ -946,8 +1083,6 @@ class DftEngineWindow(QtGui.QWidget):
                 raise Exception(task + ' is not supported by the selected dft engine')
 
     def check_if_engine_is_running_and_warn_if_so(self):
-        if esc_handler.custom_command_active:
-            return
         if esc_handler.is_engine_running():
             raise Exception('Engine is already running')
 
@@ -1091,19 +1226,47 @@ class ScfWindow(QtGui.QWidget):
 
 
 class InfoWindow(QtGui.QWidget):
+    """Shows the input and output files of the current calculation.
+
+Only a window of at most max_lines lines of the file is held in the text widget. While the window reaches the end of
+the file, appended output is added to it. Older or newer lines are loaded in chunks of chunk_lines when the view is
+scrolled to the top or bottom of the window."""
+    max_lines = 5000
+    chunk_lines = 1000
+    # large files are indexed in steps of index_bytes between the events of the GUI
+    index_bytes = 2**25
+
     def __init__(self, parent=None):
         QtGui.QWidget.__init__(self, parent)
         layout = QtGui.QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
-        self.text_widget = QtGui.QTextBrowser(parent=self)
-        self.text_widget.setFontFamily('monospace')
+        self.text_widget = QtGui.QPlainTextEdit(parent=self)
+        self.text_widget.setReadOnly(True)
+        font = QtGui.QFont('monospace')
+        font.setStyleHint(QtGui.QFont.TypeWriter)
+        self.text_widget.setFont(font)
         layout.addWidget(self.text_widget)
         self.vertical_scrollbar = self.text_widget.verticalScrollBar()
-        self.last_text = ''
+        self.vertical_scrollbar.valueChanged.connect(self.handle_scroll)
+
+        self.log_file = None
+        self.first_line = 0
+        self.end_offset = 0
+        self.decoder = None
+        self.changing_text = False
+        self.index_timer = QtCore.QTimer()
+        self.index_timer.setSingleShot(True)
+        self.index_timer.timeout.connect(self.continue_indexing)
+
+        option_widget = QtGui.QWidget(self)
+        option_layout = QtGui.QHBoxLayout(option_widget)
+        option_layout.setContentsMargins(0, 0, 0, 0)
+        option_layout.setAlignment(QtCore.Qt.AlignLeft)
+        layout.addWidget(option_widget)
 
         self.combobox = QtGui.QComboBox(self)
-        layout.addWidget(self.combobox)
+        option_layout.addWidget(self.combobox)
         self.combobox.addItem('Output')
         self.combobox.addItem('Input')
 
@@ -1111,6 +1274,16 @@ class InfoWindow(QtGui.QWidget):
         self.combobox.currentIndexChanged.connect(self.do_select_event)
         self.combobox.setMaximumWidth(150)
 
+        self.search_entry = QtGui.QLineEdit(self)
+        self.search_entry.setPlaceholderText('Search')
+        self.search_entry.setMaximumWidth(300)
+        self.search_entry.returnPressed.connect(self.find_next)
+        option_layout.addWidget(self.search_entry)
+
+        self.search_button = QtGui.QPushButton('Find next', self)
+        self.search_button.clicked.connect(self.find_next)
+        option_layout.addWidget(self.search_button)
+
     def do_select_event(self):
         if esc_handler.project_directory is None:
             return
@@ -1119,21 +1292,159 @@ class InfoWindow(QtGui.QWidget):
             file = files[self.combobox.currentIndex()]
             self.update_text(esc_handler.project_directory + esc_handler.working_dirctory + file)
         except IOError:
-            self.text_widget.setHtml('')
-            self.last_text = ''
+            self.index_timer.stop()
+            self.log_file = None
+            self.set_text('')
 
     def update_text(self, filename):
-        cur_pos = self.vertical_scrollbar.value()
-        with open(filename, 'r') as f:
-            text = f.read()
-        if text == self.last_text:
+        if self.log_file is None or self.log_file.filename != filename:
+            self.log_file = LogFile(filename)
+            self.log_file.update(max_bytes=self.index_bytes)
+            self.show_tail()
+            self.schedule_indexing()
+            return
+
+        at_tail = self.end_offset == self.log_file.size
+        status = self.log_file.update(max_bytes=self.index_bytes)
+        self.schedule_indexing()
+        if status == 'reset':
+            self.show_tail()
+        elif status == 'appended' and at_tail:
+            if self.log_file.n_lines - self.first_line > 2 * self.max_lines:
+                self.show_tail()
+            else:
+                self.append_tail()
+
+    def schedule_indexing(self):
+        if self.log_file.pending_bytes > 0:
+            self.index_timer.start(0)
+
+    def continue_indexing(self):
+        if self.log_file is not None:
+            self.update_text(self.log_file.filename)
+
+    def set_text(self, text):
+        self.changing_text = True
+        try:
+            self.text_widget.setPlainText(text)
+        finally:
+            self.changing_text = False
+
+    def show_lines(self, first_line):
+        """Replaces the text by the lines first_line to first_line + max_lines of the file."""
+        self.first_line = max(0, first_line)
+        self.end_offset = self.log_file.offset(self.first_line + self.max_lines)
+        self.decoder = codecs.getincrementaldecoder(self.log_file.encoding)('replace')
+        text = self.decoder.decode(self.log_file.read(self.log_file.offset(self.first_line), self.end_offset))
+        self.set_text(text)
+
+    def show_tail(self):
+        self.show_lines(self.log_file.n_lines - self.max_lines)
+        self.vertical_scrollbar.setValue(self.vertical_scrollbar.maximum())
+
+    def append_tail(self):
+        follow = self.vertical_scrollbar.value() == self.vertical_scrollbar.maximum()
+        text = self.decoder.decode(self.log_file.read(self.end_offset, self.log_file.size))
+        self.end_offset = self.log_file.size
+        self.insert_text(text, at_start=False)
+        self.trim_top()
+        if follow:
+            self.vertical_scrollbar.setValue(self.vertical_scrollbar.maximum())
+
+    def insert_text(self, text, at_start=False):
+        self.changing_text = True
+        try:
+            cursor = QtGui.QTextCursor(self.text_widget.document())
+            cursor.movePosition(QtGui.QTextCursor.Start if at_start else QtGui.QTextCursor.End)
+            cursor.insertText(text)
+        finally:
+            self.changing_text = False
+
+    def n_shown_lines(self):
+        return self.log_file.line_of_offset(self.end_offset) - self.first_line
+
+    def trim_top(self):
+        """Removes lines from the top of the text until at most max_lines are left."""
+        excess = self.n_shown_lines() - self.max_lines
+        if excess <= 0:
+            return
+        value = self.vertical_scrollbar.value()
+        self.changing_text = True
+        try:
+            cursor = QtGui.QTextCursor(self.text_widget.document())
+            cursor.movePosition(QtGui.QTextCursor.Start)
+            cursor.movePosition(QtGui.QTextCursor.NextBlock, QtGui.QTextCursor.KeepAnchor, excess)
+            cursor.removeSelectedText()
+        finally:
+            self.changing_text = False
+        self.first_line += excess
+        self.vertical_scrollbar.setValue(max(0, value - excess))
+
+    def trim_bottom(self):
+        """Removes lines from the bottom of the text until at most max_lines are left."""
+        if self.n_shown_lines() <= self.max_lines:
+            return
+        document = self.text_widget.document()
+        self.changing_text = True
+        try:
+            cursor = QtGui.QTextCursor(document)
+            cursor.setPosition(document.findBlockByNumber(self.max_lines).position())
+            cursor.movePosition(QtGui.QTextCursor.End, QtGui.QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        finally:
+            self.changing_text = False
+        self.end_offset = self.log_file.offset(self.first_line + self.max_lines)
+
+    def handle_scroll(self, value):
+        if self.changing_text or self.log_file is None:
+            return
+        if value == self.vertical_scrollbar.minimum() and self.first_line > 0:
+            self.load_older()
+        elif value == self.vertical_scrollbar.maximum() and self.end_offset < self.log_file.size:
+            self.load_newer()
+
+    def load_older(self):
+        n = min(self.chunk_lines, self.first_line)
+        text = self.log_file.read_lines(self.first_line - n, self.first_line)
+        self.insert_text(text, at_start=True)
+        self.first_line -= n
+        self.trim_bottom()
+        self.vertical_scrollbar.setValue(n)
+
+    def load_newer(self):
+        end_line = self.log_file.line_of_offset(self.end_offset) + self.chunk_lines
+        end_offset = self.log_file.offset(end_line)
+        text = self.decoder.decode(self.log_file.read(self.end_offset, end_offset))
+        self.end_offset = end_offset
+        self.insert_text(text, at_start=False)
+        self.trim_top()
+
+    def find_next(self):
+        """Searches the text of the search entry in the whole file, starting after the current cursor position."""
+        text = self.search_entry.text()
+        if self.log_file is None or not text:
+            return
+        cursor = self.text_widget.textCursor()
+        start = self.log_file.offset(self.first_line + cursor.blockNumber())
+        start += len(cursor.block().text()[:cursor.positionInBlock()].encode(self.log_file.encoding))
+        offset = self.log_file.find(text, start)
+        if offset is None:
+            offset = self.log_file.find(text, 0)
+        if offset is None:
             return
 
-        self.last_text = text
+        line = self.log_file.line_of_offset(offset)
+        if not self.first_line <= line < self.log_file.line_of_offset(self.end_offset):
+            self.show_lines(line - self.max_lines // 2)
+        line_offset = self.log_file.offset(line)
+        column = len(self.log_file.read(line_offset, offset).decode(self.log_file.encoding, 'replace'))
 
-        # text = text.replace('\n','<br>')
-        self.text_widget.setPlainText(text)
-        self.vertical_scrollbar.setValue(cur_pos)
+        block = self.text_widget.document().findBlockByNumber(line - self.first_line)
+        cursor = QtGui.QTextCursor(block)
+        cursor.setPosition(block.position() + column)
+        cursor.setPosition(block.position() + column + len(text), QtGui.QTextCursor.KeepAnchor)
+        self.text_widget.setTextCursor(cursor)
+        self.text_widget.ensureCursorVisible()
 
 
 class PlotWithTreeview(QtGui.QWidget):
@@ -1236,7 +1547,7 @@ class PlotWithTreeview(QtGui.QWidget):
     def update_tree(self):
         self.treeview.itemSelectionChanged.disconnect()
         self.treeview.clear()
-        for key, value in OrderedDict(sorted(self.data_dictionary.items())).items():
+        for key in sorted(self.data_dictionary.keys()):
             self.add_result_key(key)
         self.treeview.itemSelectionChanged.connect(self.handle_item_changed)
 
@@ -1443,6 +1754,19 @@ class EngineOptionsDialog(QtGui.QDialog):
         self.ask_engine_combobox = QtGui.QComboBox(self)
         self.grid_layout.addWidget(self.ask_engine_combobox, 4, 1, 1, 1)
 
+        backend_label = QtGui.QLabel(self)
+        backend_label.setText('Execution backend')
+        self.grid_layout.addWidget(backend_label, 5, 0, 1, 1)
+
+        self.backend_combobox = QtGui.QComboBox(self)
+        for backend in sorted(execution_backends.executors.keys()):
+            self.backend_combobox.addItem(backend)
+        self.grid_layout.addWidget(self.backend_combobox, 5, 1, 1, 1)
+
+        self.remote_host_entry = EntryWithLabel(self, 'Remote host')
+        self.remote_host_entry.textbox.setToolTip('Only used by the ssh backend. Format: user@host:/remote/directory')
+        self.grid_layout.addWidget(self.remote_host_entry, 6, 0, 1, 2)
+
         self.startup_text = 'Ask at startup'
         self.ask_engine_combobox.addItem(self.startup_text)
         for handler in general_handler.handlers.keys():
@@ -1472,6 +1796,10 @@ class EngineOptionsDialog(QtGui.QDialog):
             self.parent.project_properties['custom dft folder'] = species_path
             esc_handler.dft_installation_folder = species_path
 
+        self.parent.project_properties['execution backend'] = self.backend_combobox.currentText()
+        self.parent.project_properties['remote host'] = self.remote_host_entry.get_text()
+        self.parent.configure_executor()
+
         startup_text = self.ask_engine_combobox.currentText()
         if startup_text == self.startup_text:
             self.parent.defaults['default engine'] = None
@@ -1508,6 +1836,11 @@ class EngineOptionsDialog(QtGui.QDialog):
                     self.custom_command_checkbox.toggle()
         self.species_path_entry.set_text(esc_handler.dft_installation_folder)
         self.filename_label.setText(self.parent.project_properties['custom command'])
+        index = self.backend_combobox.findText(self.parent.project_properties['execution backend'],
+                                               QtCore.Qt.MatchFixedString)
+        if index >= 0:
+            self.backend_combobox.setCurrentIndex(index)
+        self.remote_host_entry.set_text(self.parent.project_properties['remote host'])
 
 
 class OptionWithTreeview(PlotWithTreeview):
@@ -1532,7 +1865,7 @@ class OptionWithTreeview(PlotWithTreeview):
 
     def update_tree(self):
         self.treeview.clear()
-        for key, value in OrderedDict(sorted(self.data_dictionary.items())).items():
+        for key in sorted(self.data_dictionary.keys()):
             self.add_result_key(key)
         self.add_result_key('None')
 
@@ -2284,17 +2617,21 @@ class EditStructureWindow(QtGui.QMainWindow):
 
 
 class CentralWindow(QtGui.QWidget):
+    # emitted by other threads after they put an item into the queue
+    queue_updated = QtCore.Signal()
+
     def __init__(self, parent=None, *args, **kwargs):
         super(CentralWindow, self).__init__(*args, **kwargs)
         self.project_loaded = False
         self.project_directory = None
         self.parent = parent
         self._crystal_structure = None
-        self.band_structures = {}
-        self.optical_spectra = {}
-        self.ks_densities = {}
+        self.band_structures = ResultDictionary()
+        self.optical_spectra = ResultDictionary()
+        self.ks_densities = ResultDictionary()
+        self.project_store = None
         self.project_properties = {'title': '', 'dft engine': '', 'custom command': '', 'custom command active': False,
-                                   'custom dft folder': ''}
+                                   'custom dft folder': '', 'execution backend': 'local', 'remote host': ''}
         self.esc_handler_options = {}
         self.last_run_information = {'scf': {}, 'bandstructure': {}, 'gw': {}, 'optical spectrum': {}, 'relax': {},
                                      'phonon': {}}
@@ -2345,6 +2682,7 @@ class CentralWindow(QtGui.QWidget):
         self.brillouin_window = BrillouinWindow(self)
         self.console_window = ConsoleWindow(self)
         self.information_window = CodeInformationWindow(self)
+        self.render_timings_window = RenderTimingsWindow(self)
 
         self.tab_layout = QtGui.QVBoxLayout()
         self.tabWidget.setLayout(self.tab_layout)
@@ -2377,6 +2715,13 @@ class CentralWindow(QtGui.QWidget):
         self.queue_timer.timeout.connect(self.update_program)
         self.queue_timer.start(200)
 
+        # the queue is drained as soon as the event loop is idle after new items have arrived
+        self.idle_queue_timer = QtCore.QTimer()
+        self.idle_queue_timer.setSingleShot(True)
+        self.idle_queue_timer.setInterval(0)
+        self.idle_queue_timer.timeout.connect(self.handle_queue)
+        self.queue_updated.connect(self.idle_queue_timer.start)
+
         if DEBUG:
             if sys.platform in ['linux', 'linux2']:
                 project_directory = r"/home/jannick/OpenDFT_projects/test_abinit/"
@@ -2415,7 +2760,9 @@ class CentralWindow(QtGui.QWidget):
     def initialize_project(self):
         self.project_properties.update(
             {'title': '', 'dft engine': '', 'custom command': '', 'custom command active': False,
-             'custom dft folder': ''})
+             'custom dft folder': '', 'execution backend': 'local', 'remote host': ''})
+        esc_handler.executor = execution_backends.LocalExecutor()
+        self.make_project_store()
         self.window.setWindowTitle("OpenDFT - " + self.project_directory)
         os.chdir(self.project_directory)
         if (esc_handler.pseudo_directory is not None) and (
@@ -2445,7 +2792,7 @@ class CentralWindow(QtGui.QWidget):
             folder_name = QtGui.QFileDialog().getExistingDirectory(parent=self)
 
         save_filename = folder_name + '/save.pkl'
-        if folder_name and os.path.isfile(save_filename):
+        if folder_name and (ProjectStore(folder_name).exists() or os.path.isfile(save_filename)):
             self.reset_results_and_plots()
             self.project_directory = folder_name
             os.chdir(self.project_directory)
@@ -2463,7 +2810,10 @@ class CentralWindow(QtGui.QWidget):
             self.error_dialog.showMessage(error_message)
 
     def save_results(self):
+        """Saves the project. Returns False if it could not be saved."""
         # Todo move engine folder and custom command into engine specific dic
+        if self.project_store is None:
+            return True
         try:
             self.dft_engine_window.read_all_option_widgets()
 
@@ -2476,98 +2826,126 @@ class CentralWindow(QtGui.QWidget):
                                            'relax options': esc_handler.relax_options,
                                            'last run information': self.last_run_information}
             self.esc_handler_options[esc_handler.engine_name] = option_dic_specific_handler
-            a = {'crystal structure': self.crystal_structure, 'band structure': self.band_structures,
-                 'optical spectra': self.optical_spectra, 'esc handler options': self.esc_handler_options,
-                 'properties': self.project_properties, 'dft engine': esc_handler.engine_name,
-                 'ks densities': self.ks_densities, 'k path': self.dft_engine_window.band_structure_points}
-            with open(self.project_directory + '/save.pkl', 'wb') as handle:
-                pickle.dump(a, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            a = {'esc handler options': self.esc_handler_options, 'properties': self.project_properties,
+                 'dft engine': esc_handler.engine_name, 'k path': self.dft_engine_window.band_structure_points}
+            skipped = self.project_store.save(a, self.result_dictionaries(), crystal_structure=self.crystal_structure)
         except Exception as e:
             logging.exception(e)
+            self.error_dialog.showMessage('The project could not be saved:<br>' + repr(e))
+            return False
+        if skipped:
+            logging.warning('Entries that could not be saved: ' + ', '.join(skipped))
+            self.error_dialog.showMessage('The following entries could not be saved and were replaced by None:<br>' +
+                                          '<br>'.join(skipped))
+        return True
 
     def load_saved_results(self):
         esc_handler.project_directory = self.project_directory
+        self.make_project_store()
         try:
-            with open(self.project_directory + '/save.pkl', 'rb') as handle:
-                b = pickle.load(handle)
+            if self.project_store.exists():
+                b = self.project_store.load(self.result_dictionaries())
+            else:
+                # projects saved by older versions, the results are moved into the store on the next save
+                with open(self.project_directory + '/save.pkl', 'rb') as handle:
+                    b = pickle.load(handle)
 
-                k_path = b.pop('k path', None)
-                if k_path is not None:
-                    self.dft_engine_window.band_structure_points = k_path
+            k_path = b.pop('k path', None)
+            if k_path is not None:
+                self.dft_engine_window.band_structure_points = k_path
 
-                self.crystal_structure = b.pop('crystal structure', None)
-                if self.crystal_structure is not None:
-                    self.mayavi_widget.update_crystal_structure(self.crystal_structure)
-                    self.mayavi_widget.update_plot()
+            self.crystal_structure = b.pop('crystal structure', None)
+            if self.crystal_structure is not None:
+                self.mayavi_widget.update_crystal_structure(self.crystal_structure)
+                self.mayavi_widget.update_plot()
 
-                loaded_bandstructure_dict = b.pop('band structure', None)
-                if type(loaded_bandstructure_dict) == dict:
-                    for key, value in loaded_bandstructure_dict.items():
-                        self.band_structures[key] = value
+            loaded_bandstructure_dict = b.pop('band structure', None)
+            if type(loaded_bandstructure_dict) == dict:
+                for key, value in loaded_bandstructure_dict.items():
+                    self.band_structures[key] = value
 
-                loaded_optical_spectra_dict = b.pop('optical spectra', None)
-                if type(loaded_optical_spectra_dict) == dict:
-                    for key, value in loaded_optical_spectra_dict.items():
-                        self.optical_spectra[key] = value
+            loaded_optical_spectra_dict = b.pop('optical spectra', None)
+            if type(loaded_optical_spectra_dict) == dict:
+                for key, value in loaded_optical_spectra_dict.items():
+                    self.optical_spectra[key] = value
 
-                loaded_ksdens_dict = b.pop('ks densities', None)
-                if type(loaded_ksdens_dict) == dict:
-                    for key, value in loaded_ksdens_dict.items():
-                        self.ks_densities[key] = value
+            loaded_ksdens_dict = b.pop('ks densities', None)
+            if type(loaded_ksdens_dict) == dict:
+                for key, value in loaded_ksdens_dict.items():
+                    self.ks_densities[key] = value
 
-                self.esc_handler_options = b.pop('esc handler options', {})
+            self.esc_handler_options = b.pop('esc handler options', {})
 
-                option_dic_specific_handler = self.esc_handler_options.pop(esc_handler.engine_name, None)
+            option_dic_specific_handler = self.esc_handler_options.pop(esc_handler.engine_name, None)
 
-                if option_dic_specific_handler is not None:
+            if option_dic_specific_handler is not None:
 
-                    last_run_information = option_dic_specific_handler.pop('last run information', None)
-                    if last_run_information is not None:
-                        self.last_run_information = last_run_information
+                last_run_information = option_dic_specific_handler.pop('last run information', None)
+                if last_run_information is not None:
+                    self.last_run_information = last_run_information
 
-                    def set_esc_handler_dic_to_loaded_dic(esc_dic, loaded_dic):
-                        if loaded_dic is not None:
-                            for key, value in loaded_dic.items():
-                                if key in esc_dic.keys():
-                                    esc_dic[key] = value
+                def set_esc_handler_dic_to_loaded_dic(esc_dic, loaded_dic):
+                    if loaded_dic is not None:
+                        for key, value in loaded_dic.items():
+                            if key in esc_dic.keys():
+                                esc_dic[key] = value
 
-                    load_scf_options = option_dic_specific_handler.pop('scf_options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.scf_options, load_scf_options)
+                load_scf_options = option_dic_specific_handler.pop('scf_options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.scf_options, load_scf_options)
 
-                    load_general_options = option_dic_specific_handler.pop('general options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.general_options, load_general_options)
+                load_general_options = option_dic_specific_handler.pop('general options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.general_options, load_general_options)
 
-                    load_bs_options = option_dic_specific_handler.pop('bs options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.bs_options, load_bs_options)
+                load_bs_options = option_dic_specific_handler.pop('bs options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.bs_options, load_bs_options)
 
-                    load_phonon_options = option_dic_specific_handler.pop('phonon options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.phonons_options, load_phonon_options)
+                load_phonon_options = option_dic_specific_handler.pop('phonon options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.phonons_options, load_phonon_options)
 
-                    load_gw_options = option_dic_specific_handler.pop('gw options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.gw_options, load_gw_options)
+                load_gw_options = option_dic_specific_handler.pop('gw options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.gw_options, load_gw_options)
 
-                    load_optical_spectrum_options = option_dic_specific_handler.pop('optical spectrum options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.optical_spectrum_options,
-                                                      load_optical_spectrum_options)
+                load_optical_spectrum_options = option_dic_specific_handler.pop('optical spectrum options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.optical_spectrum_options,
+                                                  load_optical_spectrum_options)
 
-                    load_relax_options = option_dic_specific_handler.pop('relax options', None)
-                    set_esc_handler_dic_to_loaded_dic(esc_handler.relax_options, load_relax_options)
+                load_relax_options = option_dic_specific_handler.pop('relax options', None)
+                set_esc_handler_dic_to_loaded_dic(esc_handler.relax_options, load_relax_options)
 
-                self.project_properties.update(b['properties'])
-                ## Update esc_handler ! DANGER ZONE !
-                try:
-                    esc_handler.custom_command_active = self.project_properties['custom command active']
-                    esc_handler.custom_command = self.project_properties['custom command']
-                    if self.project_properties['custom dft folder']:
-                        esc_handler.dft_installation_folder = self.project_properties['custom dft folder']
-                except:
-                    self.project_properties['custom command active'] = False
-                    self.project_properties['custom command'] = ''
-                    self.project_properties['custom dft folder'] = ''
+            self.project_properties.update(b['properties'])
+            ## Update esc_handler ! DANGER ZONE !
+            try:
+                esc_handler.custom_command_active = self.project_properties['custom command active']
+                esc_handler.custom_command = self.project_properties['custom command']
+                if self.project_properties['custom dft folder']:
+                    esc_handler.dft_installation_folder = self.project_properties['custom dft folder']
+                self.configure_executor()
+            except:
+                self.project_properties['custom command active'] = False
+                self.project_properties['custom command'] = ''
+                self.project_properties['custom dft folder'] = ''
 
         except IOError:
             print('file not found')
 
+    def make_project_store(self):
+        if self.defaults['single precision densities']:
+            mapped_dtype = np.float32
+        else:
+            mapped_dtype = None
+        self.project_store = ProjectStore(self.project_directory, mapped_dtype=mapped_dtype)
+        for kind, dic in self.result_dictionaries().items():
+            dic.attach(self.project_store, kind, [])
+
+    def toggle_single_precision_densities(self, checked):
+        self.defaults['single precision densities'] = checked
+        if self.project_store is not None:
+            self.project_store.mapped_dtype = np.float32 if checked else None
+
+    def result_dictionaries(self):
+        return {'band structure': self.band_structures, 'optical spectra': self.optical_spectra,
+                'ks densities': self.ks_densities}
+
     def load_defaults(self):
         self.defaults = {}
 
@@ -2581,6 +2959,7 @@ class CentralWindow(QtGui.QWidget):
         default_engine = b.pop('default engine', None)
 
         self.defaults['default engine'] = default_engine
+        self.defaults['single precision densities'] = b.pop('single precision densities', False)
 
     def save_defaults(self):
         with open(self.temp_folder + '/defaults.pkl', 'wb') as handle:
@@ -2712,6 +3091,23 @@ class CentralWindow(QtGui.QWidget):
         ks_vis_action.triggered.connect(self.open_state_vis_window)
         self.vis_menu.addAction(ks_vis_action)
 
+        single_precision_action = QtGui.QAction("Store KS states in single precision", self.window)
+        single_precision_action.setStatusTip('Halves the disk and memory usage of new Kohn-Sham densities')
+        single_precision_action.setCheckable(True)
+        single_precision_action.setChecked(self.defaults['single precision densities'])
+        single_precision_action.toggled.connect(self.toggle_single_precision_densities)
+        self.vis_menu.addAction(single_precision_action)
+
+        relax_trajectory_action = QtGui.QAction("Show relaxation trajectory", self.window)
+        relax_trajectory_action.setStatusTip('Replay the ionic steps of the last structure relaxation in the structure window')
+        relax_trajectory_action.triggered.connect(self.show_relax_trajectory)
+        self.vis_menu.addAction(relax_trajectory_action)
+
+        render_timings_action = QtGui.QAction("Render timings", self.window)
+        render_timings_action.setStatusTip('Shows how long the last updates of the 3D scenes took')
+        render_timings_action.triggered.connect(self.render_timings_window.show)
+        self.vis_menu.addAction(render_timings_action)
+
         self.dft_menu = self.menu_bar.addMenu('&DFT Engine')
 
         dft_options_action = QtGui.QAction("Options", self.window)
@@ -2732,11 +3128,38 @@ class CentralWindow(QtGui.QWidget):
 
         if DEBUG or reply == QtGui.QMessageBox.Yes:
             self.save_defaults()
-            self.save_results()
+            if not self.save_results():
+                reply = QtGui.QMessageBox.question(self, 'Message', "The project could not be saved. Quit anyway?",
+                                                   QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
+                if reply != QtGui.QMessageBox.Yes:
+                    return
             self.parent.quit()
             logging.info('Program stopped normally')
             # sys.exit()
 
+    def configure_executor(self):
+        backend = self.project_properties['execution backend']
+        try:
+            if backend == 'ssh':
+                host, remote_directory = self.project_properties['remote host'].split(':', 1)
+                esc_handler.executor = execution_backends.SshExecutor(host, remote_directory)
+            else:
+                esc_handler.executor = execution_backends.make_executor(backend)
+        except Exception:
+            esc_handler.executor = execution_backends.LocalExecutor()
+            self.project_properties['execution backend'] = 'local'
+            self.error_dialog.showMessage('Could not set up the ' + backend + ' backend, falling back to local execution.'
+                                          '<br>For ssh the remote host must be given as user@host:/remote/directory')
+
+    def show_relax_trajectory(self):
+        esc_handler.load_relax_structure()
+        if esc_handler.relax_reader is None or len(esc_handler.relax_reader.trajectory) == 0:
+            self.error_dialog.showMessage('No relaxation trajectory found')
+            return
+        self.mayavi_widget.update_crystal_structure(esc_handler.relax_reader.trajectory)
+        self.mayavi_widget.update_plot()
+        self.tabWidget.setCurrentIndex(0)
+
     def check_relax(self):
         new_struc = esc_handler.load_relax_structure()
         if new_struc is not None:
@@ -2929,12 +3352,11 @@ class CentralWindow(QtGui.QWidget):
 
         def add_plot_to_queue(structure):
             q_item = {'task': 'plot structure', 'structure': structure}
-            self.queue.put(q_item)
+            self.put_queue_item(q_item)
 
         def add_scf_to_queue(scf_data):
             q_item = {'task': 'plot scf', 'scf data': scf_data}
-            self.queue.put(q_item)
-            time.sleep(0.3)
+            self.put_queue_item(q_item)
 
         shared_vars = {'structure': self.crystal_structure, 'engine': esc_handler, 'plot_structure': add_plot_to_queue,
                        'CrystalStructure': sst.CrystalStructure,
@@ -2942,7 +3364,9 @@ class CentralWindow(QtGui.QWidget):
                        'BandStructure': sst.BandStructure, 'EnergyDiagram': sst.EnergyDiagram,
                        'KohnShamDensity': sst.KohnShamDensity, 'MolecularDensity': sst.MolecularDensity,
                        'plot_scf': add_scf_to_queue}
-        self.console_window.python_interpreter.update_vars(shared_vars)
+        self.console_window.python_interpreter.update_vars(shared_vars,
+                                                           remote_names=('engine', 'structure', 'plot_structure',
+                                                                         'plot_scf'))
 
     def configure_buttons(self, disable_all=False):
         self.dft_engine_window.configure_buttons(disable_all=disable_all)
@@ -2959,23 +3383,32 @@ class CentralWindow(QtGui.QWidget):
             self.import_structure_menu.setEnabled(True)
             self.vis_menu.setEnabled(True)
 
-    def handle_queue(self):
-        if self.queue.empty():
-            return
-
-        queue_item = self.queue.get()
-        taskname = queue_item['task']
+    def put_queue_item(self, q_item):
+        """Puts q_item into the queue, which is handled by the GUI thread. Can be called from any thread."""
+        self.queue.put(q_item)
+        self.queue_updated.emit()
 
-        if taskname == 'plot structure':
-            structure = queue_item['structure']
-            self.mayavi_widget.update_crystal_structure(structure)
-            self.mayavi_widget.update_plot()
-            QtGui.QApplication.processEvents()
-        elif taskname == 'plot scf':
-            scf_data = queue_item['scf data']
-            if scf_data is not None:
-                self.scf_window.scf_widget.plot(scf_data)
-            QtGui.QApplication.processEvents()
+    def handle_queue(self):
+        """Handles all items in the queue. Only the latest item of each task is executed, e.g. a script that plots
+many structures in a loop only causes one update of the structure plot per pass."""
+        latest_items = OrderedDict()
+        while True:
+            try:
+                queue_item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            latest_items.pop(queue_item['task'], None)
+            latest_items[queue_item['task']] = queue_item
+
+        for taskname, queue_item in latest_items.items():
+            if taskname == 'plot structure':
+                structure = queue_item['structure']
+                self.mayavi_widget.update_crystal_structure(structure)
+                self.mayavi_widget.update_plot()
+            elif taskname == 'plot scf':
+                scf_data = queue_item['scf data']
+                if scf_data is not None:
+                    self.scf_window.scf_widget.plot(scf_data)
 
     def check_integrety(self):
         scf_check = self.dft_engine_window.scf_option_widget.options == esc_handler.scf_options
@@ -2999,6 +3432,8 @@ class CentralWindow(QtGui.QWidget):
 
 
 if __name__ == "__main__":
+    # the console kernel is a spawned process, frozen builds start their executable again for it
+    multiprocessing.freeze_support()
 
     current_time = time.localtime()
     current_time_string = [str(x) for x in current_time[:3]]
@@ -1,5 +1,8 @@
 import numpy as np
 import solid_state_tools as sst
+import execution_backends
+import engine_futures
+import trajectory_reader
 import periodictable as pt
 import subprocess
 import os
@@ -30,6 +33,46 @@ def convert_greek(input):
             result.append(el)
     return result
 
+
+class RelaxOutputReader(trajectory_reader.TrajectoryReader):
+    """Reads the steps of geometry optimizations from the output of nwchem incrementally."""
+    def reset_state(self):
+        self.scale = 1.0
+
+    def parse_line(self, line):
+        stripped = line.strip()
+        if stripped.lower().startswith('output coordinates in'):
+            match = re.search(r'scale by\s+([-+]?\d*\.\d+)', stripped)
+            self.scale = float(match.group(1)) if match else 1.0
+            self.begin_block('coordinates', skip=2)
+        elif 'ENERGY GRADIENTS' in stripped:
+            self.begin_block('gradients', skip=2)
+        elif stripped.startswith('@'):
+            res = stripped.split()
+            if len(res) > 2 and res[1].isdigit():
+                self.set_energy(float(res[2]))
+
+    def parse_row(self, name, line):
+        res = line.split()
+        if len(res) < 6 or not res[0].isdigit():
+            return None
+        if name == 'coordinates':
+            match = re.match(r'[A-Za-z]+', res[1])
+            species = p_table_rev.get(match.group(0).title()) if match else None
+            coords = trajectory_reader.float_row(' '.join(res[3:]))
+            if species is None or coords is None:
+                return None
+            return list(coords*self.scale) + [species]
+        elif name == 'gradients':
+            return trajectory_reader.float_row(' '.join(res[-3:])) if len(res) >= 8 else None
+
+    def end_block(self, name, rows):
+        if name == 'coordinates':
+            self.add_frame(sst.MolecularStructure(np.array(rows)))
+        elif name == 'gradients':
+            self.set_forces(-np.array(rows))
+
+
 class Handler:
     def __init__(self):
         self.engine_name = 'nwchem'
@@ -38,6 +81,9 @@ class Handler:
         self.working_dirctory = '/nwchem_files/'
         self.pseudo_directory = None
         self.engine_process = None
+        # thread of runs that start the engine several times, e.g. ground state and band structure
+        self.engine_thread = None
+        self.executor = execution_backends.LocalExecutor()
         self.info_file = 'scf.out'
         self.info_text = """NWChem aims to provide its users with computational chemistry tools that are scalable both in their ability to treat large scientific computational chemistry problems efficiently, and in their use of available parallel computing resources from high-performance parallel supercomputers to conventional workstation clusters.
 
@@ -87,7 +133,8 @@ At the same time continued development is needed to enable NWChem to effectively
         self.optical_spectrum_options_tooltip = {}
 
 
-        self.relax_file_timestamp = None
+        self.relax_reader = None
+        self.relax_frames_loaded = 0
 
     def find_engine_folder(self):
         p = subprocess.Popen([search_command, 'nwchem'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,shell=shell_bool)
@@ -99,6 +146,7 @@ At the same time continued development is needed to enable NWChem to effectively
     def parse_input_file(self, filename):
         raise NotImplementedError()
 
+    @engine_futures.engine_task(engine_futures.read_ground_state)
     def start_ground_state(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a ground state calculation in a subprocess. The configuration is stored in scf_options.
 
@@ -115,7 +163,7 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the band structure if band_structure_points are given (an EnergyDiagram for molecules), otherwise the scf status.
         """
         file = self._make_input_file()
         self._add_scf_to_file(file,crystal_structure)
@@ -135,6 +183,7 @@ Returns:
         #     t = threading.Thread(target=run_bs)
         #     t.start()
 
+    @engine_futures.engine_task(engine_futures.read_optical_spectrum)
     def start_optical_spectrum(self, crystal_structure):
         """This method starts a optical spectrum calculation in a subprocess. The configuration is stored in optical_spectrum_options.
 
@@ -142,10 +191,11 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the OpticalSpectrum.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_gw)
     def start_gw(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a g0w0 calculation in a subprocess. The configuration is stored in gw_options.
 
@@ -162,10 +212,11 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the quasi particle BandStructure.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_phonons)
     def start_phonon(self, crystal_structure, band_structure_points):
         """This method starts a phonon bandstructure calculation in a subprocess. The configuration is stored in phonons_options.
 
@@ -182,6 +233,7 @@ Returns:
                 """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_relax)
     def start_relax(self, crystal_structure):
         """This method starts a structure relaxation calculation in a subprocess. The configuration is stored in relax_options.
 
@@ -189,52 +241,40 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the relaxed structure.
         """
         file = self._make_input_file()
         self._add_scf_to_file(file,crystal_structure,calculation='optimize')
         file.close()
+        self.relax_reader = None
         self._start_engine()
 
+    def relax_output_reader(self):
+        """Returns a new incremental reader of the output of the relaxation (see trajectory_reader). Threads other than
+the GUI use their own reader, since load_relax_structure is not thread safe."""
+        file = self.project_directory+self.working_dirctory+self.info_file
+        return RelaxOutputReader(file)
+
     def load_relax_structure(self):
         """This method loads the result of a relaxation calculation, which is a molecular or crystal structure.
+Only the output that was written since the last call is parsed. All ionic steps are kept in relax_reader.trajectory.
 
 Returns:
-    - CrystalStructure or MolecularStructure object depending on the material under study.
+    - CrystalStructure or MolecularStructure object depending on the material under study. None if there is no new
+      structure since the last call.
         """
         file = self.project_directory+self.working_dirctory+self.info_file
-        if not os.path.isfile(file):
-            return None
-        if self.relax_file_timestamp is not None and os.path.getmtime(file) == self.relax_file_timestamp:
+        if self.relax_reader is None or self.relax_reader.filename != file:
+            self.relax_reader = self.relax_output_reader()
+            self.relax_frames_loaded = 0
+        if self.relax_reader.update() == 'reset':
+            self.relax_frames_loaded = 0
+
+        trajectory = self.relax_reader.trajectory
+        if len(trajectory) == self.relax_frames_loaded:
             return None
-        self.relax_file_timestamp = os.path.getmtime(file)
-
-        with open(file) as f:
-            text = f.readlines()
-
-        matched_lines = [i for i,line in enumerate(text) if 'output coordinates in a.u.' in line.lower()]
-        if len(matched_lines) == 0:
-            return None
-        highest_index = max(matched_lines)
-        species = []
-        coords = []
-        for line in text[highest_index+4:]:
-            try:
-                res = line.split()
-                species.append(p_table_rev[res[1].title()])
-                coords.append(np.array([float(x) for x in res[3:]]))
-            except Exception:
-                if len(res)==0:
-                    continue
-                else:
-                    break
-
-        atoms = np.zeros((len(species),4))
-        for i,atom in enumerate(zip(species,coords)):
-            atoms[i,:3] = atom[1]
-            atoms[i,3] =atom[0]
-
-        return sst.MolecularStructure(atoms)
+        self.relax_frames_loaded = len(trajectory)
+        return trajectory[-1]
 
     def read_scf_status(self):
         """This method reads the result of a self consistent ground state calculation.
@@ -426,9 +466,10 @@ Returns:
         if data.min() == data.max():
             return None
 
-        data = data / data.max()
+        data /= data.max()
         return sst.MolecularDensity(data,lattice_vecs,origin)
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_ks_density(self, crystal_structure, bs_point):
         """This method starts a calculation of a specific electronic state in a subprocess.
 
@@ -443,7 +484,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the KohnShamDensity.
                 """
         file = self._make_input_file()
         file.write('title '+'"'+self.general_options['title']+'"\n')
@@ -455,6 +496,7 @@ Returns:
         file.close()
         self._start_engine()
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_electron_density(self,crystal_structure):
         """This method starts a calculation of the total (pseudo-) electron density in a subprocess.
 
@@ -466,7 +508,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the electron density.
                 """
         file = self._make_input_file()
         file.write('title '+'"'+self.general_options['title']+'"\n')
@@ -479,7 +521,7 @@ Returns:
         self._start_engine()
 
     def kill_engine(self):
-        """Stops the execution of the engine process. Only possible for local execution and not in case of cluster calculation"""
+        """Stops the execution of the engine process. For cluster calculations the job is cancelled via the executor."""
         try:
             self.engine_process.kill()
             # os.killpg(os.getpgid(self.engine_process.pid), signal.SIGTERM)
@@ -502,21 +544,23 @@ Returns:
         """Determines whether the engine is currently running.
 
 Keyword args:
-    - tasks:    List of tasks that are supposed to be running. Must be supplied when the calculations run on a cluster.
+    - tasks:    List of tasks that are supposed to be running. Not needed anymore since the state of the run is reported by the executor,
+                but still accepted for compatibility.
                 Possible tasks are: ['bandstructure', 'relax', 'ks density', 'scf', 'g0w0', 'g0w0 bands', 'optical spectrum']
 
 Returns:
     - res:      Boolean result. True: engine is running. False: engine is not running.
 """
-        if self.custom_command_active:
-            return self._is_engine_running_custom_command(tasks)
+        # runs that are queued or whose results are still being read count as running
+        return engine_futures.is_busy(self) or self._is_process_running()
+
+    def _is_process_running(self):
+        if self.engine_process is None:
+            return False
+        if self.engine_process.poll() is None:
+            return True
         else:
-            if self.engine_process is None:
-                return False
-            if self.engine_process.poll() is None:
-                return True
-            else:
-                return False
+            return False
 
     def _add_scf_to_file(self, file, crystal_structure, calculation='scf', band_points=None):
         file.write('title '+'"'+self.general_options['title']+'"\n')
@@ -535,21 +579,18 @@ Returns:
         return f
 
     def _start_engine(self, filename='scf.in',blocking=False):
-        os.chdir(self.project_directory + self.working_dirctory)
         if self.custom_command_active:
             command = ['bash', self.custom_command]
         else:
             command = self._engine_command
 
         outname = filename.split('.')[0] + '.out'
-        final_command = [None]
-        final_command[0] = command[0] +' '+ filename + ' >' + outname
+        final_command = execution_backends.command_to_string(command) +' '+ filename + ' >' + outname
 
-        self.engine_process = subprocess.Popen("exec " + final_command[0], stdout=subprocess.PIPE,
-                                               stderr=subprocess.PIPE, shell=True)
-        os.chdir(self.project_directory)
+        self.engine_process = self.executor.submit("exec " + final_command, self.project_directory + self.working_dirctory,
+                                                   shell=True)
         if blocking:
-            while self.is_engine_running():
+            while self._is_process_running():
                 time.sleep(0.1)
 
 
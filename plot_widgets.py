@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+"""Qt widgets with the matplotlib plots of band structures, optical spectra and the scf convergence.
+
+The drawing functions are in visualization, which does not need Qt, so that headless_export can use them as well."""
+from __future__ import division
+
+from bisect import bisect
+import numpy as np
+from pyface.qt import QtGui, QtCore
+import solid_state_tools as sst
+from visualization import draw_bandstructure, draw_energy_diagram, draw_optical_spectra, set_optical_limits, \
+    broaden_spectrum, nearest_index, optical_quantities
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.ticker import MaxNLocator
+
+
+class OpticalSpectrumVisualization(QtGui.QWidget):
+    def __init__(self, parent=None):
+        super(OpticalSpectrumVisualization, self).__init__()
+        self.first_plot_bool = True
+        self.last_optical_spectrum = None
+        # a figure instance to plot on
+        self.figure = plt.figure(1)
+        plt.close(plt.figure(1))
+        self.ax = None
+
+        self.canvas = FigureCanvas(self.figure)
+
+        self.toolbar = NavigationToolbar(self.canvas, self)
+
+        # color = self.palette().color(QtGui.QPalette.Base)
+        # self.figure.patch.set_facecolor([color.red()/255,color.green()/255,color.blue()/255])
+        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236 / 255])
+        # self.figure.patch.set_alpha(1.0)
+        # self.figure.patch.set_facecolor('blue')
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+        option_widget = QtGui.QWidget()
+        option_widget.setFixedHeight(60)
+        option_layout = QtGui.QHBoxLayout(option_widget)
+        option_layout.setAlignment(QtCore.Qt.AlignLeft)
+        layout.addWidget(option_widget)
+        from main import EntryWithLabel
+
+        self.select_epsilon_cb =  QtGui.QComboBox(self)
+        option_layout.addWidget(self.select_epsilon_cb)
+        self.select_epsilon_cb.addItem('Angular mean')
+        self.select_epsilon_cb.addItem(u"ε_11")
+        self.select_epsilon_cb.addItem(u"ε_22")
+        self.select_epsilon_cb.addItem(u"ε_33")
+
+        self.select_epsilon_cb.setCurrentIndex(0)
+        self.select_epsilon_cb.currentIndexChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
+
+        self.select_quantity_cb = QtGui.QComboBox(self)
+        option_layout.addWidget(self.select_quantity_cb)
+        for quantity in optical_quantities.keys():
+            self.select_quantity_cb.addItem(quantity.capitalize())
+        self.select_quantity_cb.setCurrentIndex(0)
+        self.select_quantity_cb.currentIndexChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
+
+        self.imaginary_checkbox = QtGui.QCheckBox('Imag',self)
+        option_layout.addWidget(self.imaginary_checkbox)
+        self.imaginary_checkbox.toggle()
+        self.imaginary_checkbox.stateChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
+
+        self.real_checkbox = QtGui.QCheckBox('Real',self)
+        option_layout.addWidget(self.real_checkbox)
+        self.real_checkbox.stateChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
+
+        width_text = 70
+        width_label = 40
+
+        self.Emin_entry = EntryWithLabel(option_widget,'Emin',width_text=width_text,width_label=width_label)
+        self.Emin_entry.connect_editFinished(self.update_limits)
+        option_layout.addWidget(self.Emin_entry)
+
+        self.Emax_entry = EntryWithLabel(option_widget,'Emax',width_text=width_text,width_label=width_label)
+        self.Emax_entry.connect_editFinished(self.update_limits)
+        option_layout.addWidget(self.Emax_entry)
+
+        self.eps_min_entry = EntryWithLabel(option_widget,u"ε min",width_text=width_text,width_label=width_label)
+        self.eps_min_entry.connect_editFinished(self.update_limits)
+        option_layout.addWidget(self.eps_min_entry)
+
+        self.eps_max_entry = EntryWithLabel(option_widget,u"ε max",width_text=width_text,width_label=width_label)
+        self.eps_max_entry.connect_editFinished(self.update_limits)
+        option_layout.addWidget(self.eps_max_entry)
+
+        self.broadening_entry = EntryWithLabel(option_widget,u"Γ",width_text=width_text,width_label=width_label)
+        self.broadening_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
+        option_layout.addWidget(self.broadening_entry)
+
+        self.broadening_mode_cb = QtGui.QComboBox(self)
+        option_layout.addWidget(self.broadening_mode_cb)
+        self.broadening_mode_cb.addItem('Lorentzian')
+        self.broadening_mode_cb.addItem('Gaussian')
+        self.broadening_mode_cb.addItem('None')
+
+        self.broadening_mode_cb.setCurrentIndex(0)
+        self.broadening_mode_cb.currentIndexChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
+        self.broadening_mode_cb.setMaximumWidth(150)
+
+        self.setLayout(layout)
+        self.show()
+
+    def clear_plot(self):
+        if not self.first_plot_bool:
+            self.figure.clf()
+            self.first_plot_bool = True
+            self.canvas.draw()
+
+    def read_entries(self):
+        try:
+            Emin = float(self.Emin_entry.get_text())
+        except Exception:
+            Emin = None
+
+        try:
+            Emax = float(self.Emax_entry.get_text())
+        except Exception:
+            Emax = None
+
+        try:
+            eps_max = float(self.eps_max_entry.get_text())
+        except Exception:
+            eps_max = None
+
+        try:
+            eps_min = float(self.eps_min_entry.get_text())
+        except Exception:
+            eps_min = None
+
+        try:
+            gamma = float(self.broadening_entry.get_text())
+        except Exception:
+            gamma = None
+
+        broaden_mode = self.broadening_mode_cb.currentText().lower()
+
+        return {'Emin':Emin,'Emax':Emax,'eps min':eps_min,'eps max':eps_max,'Gamma':gamma,'broaden mode':broaden_mode}
+
+    def plot(self, optical_spectrum_list,*args,**kwargs):
+        name_list = kwargs.pop('name_list',None)
+        if optical_spectrum_list is None:
+            return
+
+        if type(optical_spectrum_list) is not list:
+            optical_spectrum_list = [optical_spectrum_list]
+
+        self.last_optical_spectrum = [optical_spectrum_list,name_list]
+        if self.first_plot_bool:
+            self.ax = self.figure.add_subplot(111)
+            self.ax.format_coord = lambda x, y: u'E = {0:1.2f} eV, y = {1:1.3f}'.format(x,y)
+        self.ax.cla()
+
+        quantity = list(optical_quantities.keys())[self.select_quantity_cb.currentIndex()]
+        entry_values = self.read_entries()
+        draw_optical_spectra(self.ax,optical_spectrum_list,name_list=name_list,quantity=quantity,
+                             component=self.select_epsilon_cb.currentIndex(),
+                             imaginary=self.imaginary_checkbox.checkState(),real=self.real_checkbox.checkState(),
+                             Emin=entry_values['Emin'],Emax=entry_values['Emax'],
+                             eps_min=entry_values['eps min'],eps_max=entry_values['eps max'],
+                             gamma=entry_values['Gamma'],broaden_mode=entry_values['broaden mode'])
+
+        if self.first_plot_bool:
+            self.first_plot_bool = False
+            self.figure.tight_layout()
+        self.canvas.draw()
+
+    def update_limits(self):
+        """Applies the limit entries to the current plot without redrawing the spectra."""
+        if self.ax is None or self.last_optical_spectrum is None:
+            return
+        entry_values = self.read_entries()
+        set_optical_limits(self.ax,self.last_optical_spectrum[0],Emin=entry_values['Emin'],Emax=entry_values['Emax'],
+                           eps_min=entry_values['eps min'],eps_max=entry_values['eps max'])
+        self.canvas.draw()
+
+    def broaden_spectrum(self,energy,epsilon,width,mode='lorentzian'):
+        return broaden_spectrum(energy,epsilon,width,mode=mode)
+
+
+class BandStructureVisualization(QtGui.QWidget):
+    def __init__(self, parent=None):
+        super(BandStructureVisualization, self).__init__()
+        self.first_plot_bool = True
+        # a figure instance to plot on
+        self.figure = plt.figure(1)
+        plt.close(plt.figure(1))
+        self.ax = None
+        self.last_bandstructure = None
+        self.canvas = FigureCanvas(self.figure)
+
+        # The hover readout consists of animated artists that are blitted onto a copy of the last full draw
+        self.hover_table = None
+        self.hover_artists = []
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.handle_draw)
+        self.canvas.mpl_connect('motion_notify_event', self.handle_mouse_move)
+        self.canvas.mpl_connect('axes_leave_event', self.hide_hover)
+
+        self.toolbar = NavigationToolbar(self.canvas, self)
+
+        # color = self.palette().color(QtGui.QPalette.Base)
+        # self.figure.patch.set_facecolor([color.red() / 255, color.green() / 255, color.blue() / 255])
+        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236/ 255])
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+        option_widget = QtGui.QWidget()
+        option_widget.setFixedHeight(60)
+        option_layout = QtGui.QHBoxLayout(option_widget)
+        option_layout.setAlignment(QtCore.Qt.AlignLeft)
+        layout.addWidget(option_widget)
+        from main import EntryWithLabel
+        self.Emin_entry = EntryWithLabel(option_widget,'Emin')
+        self.Emin_entry.connect_editFinished(lambda: self.plot(self.last_bandstructure))
+        option_layout.addWidget(self.Emin_entry)
+        self.Emax_entry = EntryWithLabel(option_widget,'Emax')
+        self.Emax_entry.connect_editFinished(lambda: self.plot(self.last_bandstructure))
+        option_layout.addWidget(self.Emax_entry)
+
+        # layout.addWidget(self.button)
+        self.setLayout(layout)
+        self.show()
+
+    def clear_plot(self):
+        if not self.first_plot_bool:
+            self.ax.cla()
+            self.hover_table = None
+            self.hover_artists = []
+            self.canvas.draw()
+
+    def plot(self,band_structure,*args,**kwargs):
+        if band_structure is None:
+            return
+        if type(band_structure) is list:
+            band_structure = band_structure[0]
+        self.last_bandstructure = band_structure
+        if self.first_plot_bool:
+            self.ax = self.figure.add_subplot(111)
+        if type(band_structure) is sst.EnergyDiagram:
+            self.plot_energy_diagram(band_structure)
+        elif type(band_structure) is sst.BandStructure:
+            self.plot_bandstructure(band_structure)
+
+        if self.first_plot_bool:
+            self.first_plot_bool = False
+            self.figure.tight_layout()
+
+        try:
+            Emin = float(self.Emin_entry.get_text())
+        except Exception:
+            Emin = None
+
+        try:
+            Emax = float(self.Emax_entry.get_text())
+        except Exception:
+            Emax = None
+
+        if Emin is not None:
+            self.ax.set_ylim(bottom=Emin)
+        if Emax is not None:
+            self.ax.set_ylim(top=Emax)
+        self.canvas.draw()
+
+    def plot_energy_diagram(self,energy_diagram):
+
+        self.ax.format_coord = lambda x, y: 'E = {0:1.2f} eV, E_gap = {1:1.2f} eV'.format(*self.make_interactive_text_energy_diagram(x,y,energy_diagram))
+        draw_energy_diagram(self.ax,energy_diagram)
+        self.hover_table = None
+        self.hover_artists = []
+
+    def plot_bandstructure(self,band_structure):
+        self.ax.format_coord = lambda x, y: 'k_d = {0:1.1f}, E = {1:1.2f} eV, Gap = {2:1.2f} eV'.format(
+            *self.make_interactive_text(x, y, band_structure))
+        draw_bandstructure(self.ax,band_structure)
+        self.make_hover_table(band_structure)
+
+        cursor_line = self.ax.axvline(x=0,color='0.4',linewidth=1,animated=True)
+        gap_line, = self.ax.plot([0,0],[0,0],color='#d62728',linewidth=4,solid_capstyle='butt',animated=True)
+        cursor_text = self.ax.annotate('',xy=(0,0),xytext=(12,12),textcoords='offset points',fontsize=14,animated=True,
+                                       bbox={'boxstyle':'round','facecolor':'white','alpha':0.85,'linewidth':0})
+        self.hover_artists = [cursor_line,gap_line,cursor_text]
+
+    def make_hover_table(self,band_structure):
+        """Stores the k values and for each k the sorted band energies, so that the hover readout only needs two binary searches."""
+        k = band_structure.bands[0][:,0]
+        energies = np.array([band[:,1] for band in band_structure.bands]).T
+        self.hover_table = (band_structure,k,np.sort(energies,axis=1))
+
+    def hover_values(self,k_in,E,band_structure):
+        """Returns the index of the closest k point and the energies of the bands directly below and above E at this k.
+The energies are None when E is below the lowest or above the highest band."""
+        if self.hover_table is None or self.hover_table[0] is not band_structure:
+            self.make_hover_table(band_structure)
+        k,sorted_energies = self.hover_table[1:]
+        index_k = nearest_index(k,k_in)
+        E_values_at_k = sorted_energies[index_k]
+        E_index = np.searchsorted(E_values_at_k,E,side='right')
+        if E_index == 0 or E_index == len(E_values_at_k):
+            return index_k,None,None
+        return index_k,E_values_at_k[E_index-1],E_values_at_k[E_index]
+
+    def make_interactive_text(self,k_in,E,band_structure):
+        index_k,E_below,E_above = self.hover_values(k_in,E,band_structure)
+        if E_below is None:
+            gap = 0
+        else:
+            gap = max(E_above - E_below,0)
+        return [k_in,E,gap]
+
+    def handle_draw(self,event):
+        if self.ax is not None:
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    def hide_hover(self,event=None):
+        if self.background is not None and len(self.hover_artists) > 0:
+            self.canvas.restore_region(self.background)
+            self.canvas.blit(self.ax.bbox)
+
+    def handle_mouse_move(self,event):
+        if self.background is None or len(self.hover_artists) == 0 or self.toolbar.mode:
+            return
+        if event.inaxes is not self.ax or event.xdata is None:
+            self.hide_hover()
+            return
+
+        band_structure = self.hover_table[0]
+        index_k,E_below,E_above = self.hover_values(event.xdata,event.ydata,band_structure)
+        k = self.hover_table[1][index_k]
+        cursor_line,gap_line,cursor_text = self.hover_artists
+
+        cursor_line.set_xdata([k,k])
+        if E_below is None:
+            gap_line.set_visible(False)
+            cursor_text.set_text('E = {0:1.2f} eV'.format(event.ydata))
+        else:
+            gap_line.set_visible(True)
+            gap_line.set_data([k,k],[E_below,E_above])
+            cursor_text.set_text('E = {0:1.2f} eV\nGap = {1:1.2f} eV'.format(event.ydata,max(E_above-E_below,0)))
+        cursor_text.xy = (event.xdata,event.ydata)
+
+        self.canvas.restore_region(self.background)
+        for artist in self.hover_artists:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+    def make_interactive_text_energy_diagram(self,x,E,energy_diagram):
+        energies = energy_diagram.energies
+        E_index = bisect(energies,E)
+        try:
+            E_above = energies[E_index]
+            E_below = energies[E_index-1]
+            gap = E_above - E_below
+        except IndexError:
+            gap = 0
+        if gap<0:
+            gap = 0
+        return [E,gap]
+
+    def export(self,filename,band_structure,code=False):
+        bands = band_structure.bands
+        data = np.zeros((bands[0].shape[0],len(bands)+1))
+        data[:,0] = bands[0][:,0]
+        for i,band in enumerate(bands):
+            data[:,i+1] = band[:,1]
+        np.savetxt(filename,data)
+
+        if code:
+            #TODO do this!
+            code_string = """
+import numpy as np
+import matplotlib.pyplot as plt
+
+            
+self.first_plot_bool = True
+self.figure = plt.figure(1)
+plt.close(plt.figure(1))
+self.ax = None
+self.last_bandstructure = None"""
+
+
+class ScfVisualization(QtGui.QWidget):
+    def __init__(self, parent=None):
+        super(ScfVisualization, self).__init__()
+
+        # a figure instance to plot on
+        self.figure = plt.figure(2)
+        plt.close(plt.figure(2))
+        self.ax = None
+        self.first_plot_bool = True
+        self.canvas = FigureCanvas(self.figure)
+
+        # The scf lines are animated artists that are blitted onto a copy of the last full draw,
+        # a full draw is only needed when the axis limits change
+        self.scf_data = None
+        self.lines = []
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.handle_draw)
+
+        # color = self.palette().color(QtGui.QPalette.Base)
+        # self.figure.patch.set_facecolor([color.red() / 255, color.green() / 255, color.blue() / 255])
+        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236 / 255])
+        # self.figure.patch.set_facecolor('none')
+        # self.figure.patch.set_alpha(0.0)
+
+        self.toolbar = NavigationToolbar(self.canvas, self)
+
+        # set the layout
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+        option_widget = QtGui.QWidget()
+        option_widget.setFixedHeight(40)
+        option_layout = QtGui.QHBoxLayout(option_widget)
+        option_layout.setAlignment(QtCore.Qt.AlignLeft)
+        layout.addWidget(option_widget)
+
+        self.log_checkbox = QtGui.QCheckBox('Energy difference (log scale)',self)
+        option_layout.addWidget(self.log_checkbox)
+        self.log_checkbox.stateChanged.connect(self.change_view)
+
+        self.setLayout(layout)
+        self.show()
+
+    def clear_plot(self):
+        if not self.first_plot_bool:
+            self.ax.cla()
+            self.scf_data = None
+            self.lines = []
+            self.background = None
+            self.canvas.draw()
+
+    def change_view(self):
+        scf_data = self.scf_data
+        self.scf_data = None
+        self.lines = []
+        if scf_data is not None:
+            self.plot(scf_data)
+
+    def setup_axes(self):
+        if self.ax is None:
+            self.ax = self.figure.add_subplot(111)
+        self.ax.cla()
+        marker_line, = self.ax.plot([],[],marker='o',color='#1f77b4',ms=12,markeredgecolor='none',linewidth=0,animated=True)
+        dashed_line, = self.ax.plot([],[],linestyle='--',color='#1f77b4',linewidth=3,alpha=0.5,animated=True)
+        self.lines = [marker_line,dashed_line]
+        self.background = None
+
+        self.ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+        self.ax.set_xlabel('Scf iteration')
+        if self.log_checkbox.checkState():
+            self.ax.set_yscale('log')
+            self.ax.set_ylabel(r'Energy difference $|E_n - E_{n-1}|$')
+        else:
+            self.ax.set_ylabel('Total Energy')
+
+    def plot_values(self,scf_data):
+        """Returns the x and y values of the current view (total energies or energy differences) of scf_data."""
+        if not self.log_checkbox.checkState():
+            return scf_data[:,0],scf_data[:,1]
+        x = scf_data[1:,0]
+        y = np.abs(np.diff(scf_data[:,1]))
+        mask = y > 0
+        return x[mask],y[mask]
+
+    def plot(self,scf_data):
+        if scf_data is None or len(scf_data) == 0:
+            return
+        if self.lines and self.scf_data is not None and np.array_equal(scf_data,self.scf_data):
+            return
+
+        new_axes = not self.lines
+        if new_axes:
+            self.setup_axes()
+        self.scf_data = np.array(scf_data)
+
+        x,y = self.plot_values(self.scf_data)
+        for line in self.lines:
+            line.set_data(x,y)
+        if len(x) > 0:
+            dist = x.max() - x.min()
+            if dist < 20:
+                self.lines[0].set_markersize(12)
+            elif dist < 50:
+                self.lines[0].set_markersize(9)
+            else:
+                self.lines[0].set_markersize(6)
+
+        limits_changed = self.update_limits(x,y,reset=new_axes)
+        if self.first_plot_bool:
+            self.first_plot_bool = False
+            self.figure.tight_layout()
+        if limits_changed or self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.canvas.blit(self.ax.bbox)
+
+    def update_limits(self,x,y,reset=False):
+        """Expands the axis limits with some headroom when x and y do not fit into them anymore.
+
+Returns:
+    - changed:  True if the limits were changed and the axes have to be drawn again
+        """
+        if len(x) == 0:
+            return reset
+        xmin,xmax = self.ax.get_xlim()
+        ymin,ymax = self.ax.get_ylim()
+        changed = reset
+
+        if reset or x.min() < xmin or x.max() > xmax:
+            headroom = max(2,int(np.ceil(0.25*(x.max()-x.min()))))
+            self.ax.set_xlim(x.min()-0.1,x.max()+headroom+0.1)
+            changed = True
+
+        if reset or y.min() < ymin or y.max() > ymax:
+            if self.ax.get_yscale() == 'log':
+                self.ax.set_ylim(y.min()/3,y.max()*3)
+            else:
+                margin = 0.05*(y.max()-y.min())
+                if margin == 0:
+                    margin = max(abs(y.max())*1e-6,1e-6)
+                self.ax.set_ylim(y.min()-margin,y.max()+margin)
+            changed = True
+        return changed
+
+    def draw_lines(self):
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
+    def handle_draw(self,event):
+        if self.ax is not None and self.lines:
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.draw_lines()
@@ -0,0 +1,412 @@
+from __future__ import division, print_function
+import numpy as np
+import base64
+import json
+import os
+import pickle
+from collections import OrderedDict
+from six import integer_types, string_types
+
+store_folder = '/opendft_results'
+manifest_filename = 'manifest.json'
+store_version = 1
+
+result_folders = {'band structure': 'band_structures', 'optical spectra': 'optical_spectra',
+                  'ks densities': 'ks_densities', 'crystal structure': 'structure'}
+
+# arrays with at least this many dimensions (i.e. densities) are kept in .npy files and memory mapped
+mapped_ndim = 3
+
+
+class _NotLoaded(object):
+    def __repr__(self):
+        return '<not loaded>'
+
+
+not_loaded = _NotLoaded()
+
+
+class _Empty:
+    pass
+
+
+def _encode(obj, skipped=None, path=()):
+    """Converts obj into JSON compatible types. Tuples are tagged so that they are loaded as tuples again and all other
+objects, e.g. attributes added by scripts, are stored pickled.
+
+Objects that can not be pickled either are stored as None and their path is appended to the list skipped. Without
+skipped a TypeError is raised instead."""
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        return {'__ndarray__': obj.tolist(), 'dtype': str(obj.dtype)}
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif obj is None or isinstance(obj, (bool, float) + integer_types + string_types):
+        return obj
+    elif isinstance(obj, tuple):
+        return {'__tuple__': [_encode(x, skipped, path + (str(i),)) for i, x in enumerate(obj)]}
+    elif isinstance(obj, (list, set, frozenset)):
+        return [_encode(x, skipped, path + (str(i),)) for i, x in enumerate(obj)]
+    elif isinstance(obj, dict) and all(isinstance(key, string_types) for key in obj.keys()):
+        return {key: _encode(value, skipped, path + (key,)) for key, value in obj.items()}
+    try:
+        data = pickle.dumps(obj, protocol=2)
+    except Exception as e:
+        message = '{0} ({1}: {2})'.format(' / '.join(path), type(obj).__name__, e)
+        if skipped is None:
+            raise TypeError('Can not store ' + message)
+        skipped.append(message)
+        return None
+    return {'__pickle__': base64.b64encode(data).decode('ascii')}
+
+
+def _decode(dic):
+    if '__ndarray__' in dic:
+        return np.array(dic['__ndarray__'], dtype=dic['dtype'])
+    elif '__tuple__' in dic:
+        return tuple(dic['__tuple__'])
+    elif '__pickle__' in dic:
+        return pickle.loads(base64.b64decode(dic['__pickle__']))
+    return dic
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # python 2 has no os.replace and os.rename does not overwrite on windows
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def _new_instance(class_name):
+    import solid_state_tools as sst
+    cls = getattr(sst, class_name)
+    try:
+        return cls.__new__(cls)
+    except (AttributeError, TypeError):
+        obj = _Empty()
+        obj.__class__ = cls
+        return obj
+
+
+class ArrayCache(object):
+    """Least recently used cache that holds memory mapped arrays in memory up to a total of max_bytes."""
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.n_bytes = 0
+
+    def get(self, array):
+        """Returns array loaded into memory. Arrays that are not memory mapped are returned unchanged."""
+        if not isinstance(array, np.memmap) or array.filename is None:
+            return array
+        key = array.filename
+        if key in self.arrays:
+            loaded = self.arrays.pop(key)
+            self.arrays[key] = loaded
+            return loaded
+
+        loaded = np.array(array)
+        self.arrays[key] = loaded
+        self.n_bytes += loaded.nbytes
+        while self.n_bytes > self.max_bytes and len(self.arrays) > 1:
+            old_key, old_array = self.arrays.popitem(last=False)
+            self.n_bytes -= old_array.nbytes
+        return loaded
+
+    def discard(self, filename):
+        loaded = self.arrays.pop(filename, None)
+        if loaded is not None:
+            self.n_bytes -= loaded.nbytes
+
+    def clear(self):
+        self.arrays.clear()
+        self.n_bytes = 0
+
+
+array_cache = ArrayCache()
+
+
+class ResultDictionary(dict):
+    """Dictionary of results (band structures, spectra, densities) that is backed by a ProjectStore.
+
+Entries read from the store are only placeholders until they are accessed for the first time.
+Assigned and deleted keys are remembered so that the next save only writes what has changed."""
+    def __init__(self, *args, **kwargs):
+        super(ResultDictionary, self).__init__()
+        self.kind = None
+        self.store = None
+        self.changed_keys = set()
+        self.deleted_keys = set()
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is not_loaded:
+            value = self.store.load_result(self.kind, key)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.store is not None:
+            self.store.map_arrays(self.kind, key, value)
+        dict.__setitem__(self, key, value)
+        self.changed_keys.add(key)
+        self.deleted_keys.discard(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.deleted_keys.add(key)
+        self.changed_keys.discard(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *args)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def clear(self):
+        dict.clear(self)
+        self.changed_keys.clear()
+        self.deleted_keys.clear()
+
+    def is_loaded(self, key):
+        return dict.__getitem__(self, key) is not not_loaded
+
+    def attach(self, store, kind, keys):
+        """Fills the dictionary with placeholders for keys, which are loaded from store on first access."""
+        self.clear()
+        self.store = store
+        self.kind = kind
+        for key in keys:
+            dict.__setitem__(self, key, not_loaded)
+
+
+class ProjectStore(object):
+    """Directory based storage of an OpenDFT project.
+
+Every result is written to its own npz file that holds its numpy arrays. All other attributes
+of the results as well as the project settings are kept in a JSON manifest.
+Large arrays like densities are written to separate .npy files as soon as the result is added and are only
+accessed through read-only memory maps afterwards. With mapped_dtype=np.float32 they are stored in single precision."""
+    def __init__(self, project_directory, mapped_dtype=None):
+        self.directory = project_directory + store_folder
+        self.mapped_dtype = mapped_dtype
+        self.manifest = {'version': store_version, 'next id': 0, 'metadata': {},
+                         'results': {kind: {} for kind in result_folders.keys()}}
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.directory, manifest_filename))
+
+    def load(self, result_dictionaries):
+        """Reads the manifest and attaches result_dictionaries ({kind: ResultDictionary}) to the store.
+Returns the project metadata together with the crystal structure."""
+        with open(os.path.join(self.directory, manifest_filename), 'r') as f:
+            self.manifest = json.load(f, object_hook=_decode)
+        for kind in result_folders.keys():
+            self.manifest['results'].setdefault(kind, {})
+
+        for kind, dic in result_dictionaries.items():
+            dic.attach(self, kind, self.manifest['results'][kind].keys())
+
+        data = dict(self.manifest['metadata'])
+        if 'crystal structure' in self.manifest['results']['crystal structure']:
+            data['crystal structure'] = self.load_result('crystal structure', 'crystal structure')
+        else:
+            data['crystal structure'] = None
+        return data
+
+    def save(self, metadata, result_dictionaries, crystal_structure=None):
+        """Writes all results that were added or changed since the last save, removes deleted ones and updates the manifest.
+
+Args:
+    - metadata:             JSON serializable dictionary with the project settings. Numpy arrays are allowed.
+
+    - result_dictionaries:  Dictionary {kind: ResultDictionary} with kind in 'band structure', 'optical spectra', 'ks densities'
+
+Keyword args:
+    - crystal_structure:    CrystalStructure or MolecularStructure of the project.
+
+Returns:
+    - skipped:              List of the entries that could not be stored, not even pickled. They are saved as None.
+        """
+        self._make_folders()
+
+        for kind, dic in result_dictionaries.items():
+            entries = self.manifest['results'][kind]
+            for key in dic.deleted_keys:
+                entry = entries.pop(key, None)
+                if entry is not None:
+                    self._remove_files(entry)
+            for key in dic.changed_keys:
+                if key in dic:
+                    self._write_result(kind, key, dic[key])
+            for key in dic.keys():
+                if 'class' not in entries.get(key, {}):
+                    self._write_result(kind, key, dic[key])
+            dic.changed_keys.clear()
+            dic.deleted_keys.clear()
+            dic.store = self
+            dic.kind = kind
+
+        if crystal_structure is not None:
+            self._write_result('crystal structure', 'crystal structure', crystal_structure)
+
+        self.manifest['metadata'] = metadata
+        skipped = []
+        manifest = _encode(self.manifest, skipped)
+        manifest_file = os.path.join(self.directory, manifest_filename)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        _replace(manifest_file + '.tmp', manifest_file)
+        return skipped
+
+    def load_result(self, kind, key):
+        entry = self.manifest['results'][kind][key]
+        obj = _new_instance(entry['class'])
+        obj.__dict__.update(entry['attributes'])
+        with np.load(os.path.join(self.directory, entry['file'])) as arrays:
+            for name in entry['arrays']:
+                obj.__dict__[name] = arrays[name]
+            for name, length in entry['array lists'].items():
+                obj.__dict__[name] = [arrays['{0}_{1}'.format(name, i)] for i in range(length)]
+        for name in entry.get('mapped arrays', []):
+            obj.__dict__[name] = np.load(self._mapped_filename(entry['file'], name), mmap_mode='r')
+        return obj
+
+    def map_arrays(self, kind, key, obj):
+        """Moves the large arrays of obj into .npy files of the store and replaces them by read-only memory maps."""
+        for name, value in list(obj.__dict__.items()):
+            if isinstance(value, np.ndarray) and value.ndim >= mapped_ndim and value.dtype != object:
+                obj.__dict__[name] = self._map_array(kind, key, name, value)
+
+    def _map_array(self, kind, key, name, array):
+        filename = self._mapped_filename(self._result_filename(kind, key), name)
+        if isinstance(array, np.memmap) and array.filename is not None and \
+                os.path.abspath(array.filename) == os.path.abspath(filename):
+            return array
+
+        self._make_folders()
+        if self.mapped_dtype is not None and array.dtype.kind == 'f':
+            array = array.astype(self.mapped_dtype, copy=False)
+        with open(filename + '.tmp', 'wb') as f:
+            np.save(f, array)
+        _replace(filename + '.tmp', filename)
+        array_cache.discard(filename)
+
+        mapped_names = self.manifest['results'][kind][key].setdefault('mapped arrays', [])
+        if name not in mapped_names:
+            mapped_names.append(name)
+        return np.load(filename, mmap_mode='r')
+
+    def _mapped_filename(self, filename, name):
+        return os.path.join(self.directory, filename[:-len('.npz')] + '_' + name + '.npy')
+
+    def _result_filename(self, kind, key):
+        entries = self.manifest['results'][kind]
+        if key not in entries:
+            entries[key] = {'file': '{0}/{1:05d}.npz'.format(result_folders[kind], self.manifest['next id'])}
+            self.manifest['next id'] += 1
+        return entries[key]['file']
+
+    def _make_folders(self):
+        for folder in result_folders.values():
+            if not os.path.isdir(os.path.join(self.directory, folder)):
+                os.makedirs(os.path.join(self.directory, folder))
+
+    def _write_result(self, kind, key, obj):
+        entries = self.manifest['results'][kind]
+        filename = self._result_filename(kind, key)
+
+        attributes = {}
+        arrays = {}
+        array_names = []
+        mapped_names = []
+        array_lists = {}
+        for name, value in list(obj.__dict__.items()):
+            if isinstance(value, np.ndarray) and value.ndim >= mapped_ndim and value.dtype != object:
+                obj.__dict__[name] = self._map_array(kind, key, name, value)
+                mapped_names.append(name)
+            elif isinstance(value, np.ndarray) and value.dtype != object:
+                arrays[name] = value
+                array_names.append(name)
+            elif isinstance(value, list) and len(value) > 0 and all(isinstance(x, np.ndarray) for x in value):
+                array_lists[name] = len(value)
+                for i, x in enumerate(value):
+                    arrays['{0}_{1}'.format(name, i)] = x
+            else:
+                attributes[name] = value
+
+        full_filename = os.path.join(self.directory, filename)
+        with open(full_filename + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        _replace(full_filename + '.tmp', full_filename)
+
+        entries[key] = {'file': filename, 'class': obj.__class__.__name__, 'attributes': attributes,
+                        'arrays': array_names, 'mapped arrays': mapped_names, 'array lists': array_lists}
+
+    def _remove_files(self, entry):
+        filenames = [os.path.join(self.directory, entry['file'])]
+        filenames += [self._mapped_filename(entry['file'], name) for name in entry.get('mapped arrays', [])]
+        for filename in filenames:
+            array_cache.discard(filename)
+            try:
+                os.remove(filename)
+            except OSError:
+                # memory mapped files can not be removed on windows while they are still in use
+                pass
+
+
+if __name__ == '__main__':
+    # save and load a band structure and check that all attributes, including tuples in lists and attributes that
+    # are stored pickled, come back unchanged and that attributes that can not be pickled do not stop the save
+    import fractions
+    import shutil
+    import tempfile
+    import solid_state_tools as sst
+
+    folder = tempfile.mkdtemp()
+    k = np.linspace(0, 1, 50)
+    bands = [np.column_stack([k, np.cos(np.pi * k) + i]) for i in range(3)]
+    band_structure = sst.BandStructure(bands, special_k_points=[(0.0, 'Gamma'), (1.0, 'X')])
+    band_structure.engine_information = {'program': 'test', 'scf_options': {'k points': '8 8 8'}, 'shift': (0, 0, 0)}
+    band_structure.script_attributes = {1: fractions.Fraction(1, 3)}
+    band_structure.callback = lambda x: x
+    metadata = {'k path': [(np.array([0, 0, 0]), 'Gamma'), (np.array([0.5, 0, 0.5]), 'X')]}
+
+    try:
+        dictionary = ResultDictionary()
+        dictionary['bands'] = band_structure
+        skipped = ProjectStore(folder).save(metadata, {'band structure': dictionary})
+        assert len(skipped) == 1 and 'callback' in skipped[0]
+
+        loaded_dictionary = ResultDictionary()
+        loaded_metadata = ProjectStore(folder).load({'band structure': loaded_dictionary})
+        loaded = loaded_dictionary['bands']
+        assert loaded.special_k_points == band_structure.special_k_points
+        assert loaded.engine_information == band_structure.engine_information
+        assert loaded.script_attributes == band_structure.script_attributes
+        assert loaded.callback is None
+        assert all(np.array_equal(a, b) for a, b in zip(loaded.bands, band_structure.bands))
+        for (point, label), (loaded_point, loaded_label) in zip(metadata['k path'], loaded_metadata['k path']):
+            assert np.array_equal(point, loaded_point) and label == loaded_label
+        print('Round trip of the project store passed')
+    finally:
+        shutil.rmtree(folder)
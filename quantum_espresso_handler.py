@@ -1,6 +1,9 @@
 from __future__ import division,absolute_import,print_function,unicode_literals
 import numpy as np
 import solid_state_tools as sst
+import execution_backends
+import engine_futures
+import trajectory_reader
 import periodictable as pt
 import subprocess
 import os
@@ -35,6 +38,93 @@ def convert_greek(input):
             result.append(el)
     return result
 
+
+class RelaxOutputReader(trajectory_reader.TrajectoryReader):
+    """Reads the ionic steps of relax, vc-relax, md and vc-md runs from the output of pw.x incrementally."""
+    def reset_state(self):
+        self.alat = 1.0
+        self.lattice_vectors = np.zeros((3,3))
+        self.unit = 'crystal'
+
+    def parse_line(self, line):
+        stripped = line.strip()
+        if 'lattice parameter (alat)' in line:
+            self.alat = float(line.split('=')[1].split()[0])
+        elif re.match(r'a\([123]\) = \(', stripped):
+            vector = re.findall(r'[-+]?\d*\.\d+', stripped.split('=')[1])
+            self.lattice_vectors[int(stripped[2])-1,:] = np.array(vector, dtype=np.float)*self.alat
+        elif 'positions (alat units)' in line:
+            self.begin_block('initial positions')
+        elif stripped.startswith('CELL_PARAMETERS'):
+            match = re.search(r'alat\s*=\s*([-+]?\d*\.\d+)', stripped)
+            if match:
+                self.alat = float(match.group(1))
+            self.unit = self._unit(stripped)
+            self.begin_block('cell')
+        elif stripped.startswith('ATOMIC_POSITIONS'):
+            self.unit = self._unit(stripped)
+            self.begin_block('positions')
+        elif stripped.startswith('!') and 'total energy' in stripped:
+            self.set_energy(float(stripped.split('=')[1].split()[0])/2)
+        elif stripped.startswith('Forces acting on atoms'):
+            self.begin_block('forces')
+
+    def parse_row(self, name, line):
+        if name == 'initial positions':
+            match = re.match(r'\s*\d+\s+(\S+)\s+tau\(\s*\d+\)\s*=\s*\(\s*(\S+)\s+(\S+)\s+(\S+)', line)
+            if match is None or self._species(match.group(1)) is None:
+                return None
+            return [float(x) for x in match.groups()[1:]] + [self._species(match.group(1))]
+        elif name == 'cell':
+            return trajectory_reader.float_row(line)
+        elif name == 'positions':
+            res = line.split()
+            coords = trajectory_reader.float_row(' '.join(res[1:]))
+            if coords is None or self._species(res[0]) is None:
+                return None
+            return list(coords) + [self._species(res[0])]
+        elif name == 'forces':
+            match = re.search(r'atom\s+\d+\s+type\s+\d+\s+force\s+=\s+(\S+)\s+(\S+)\s+(\S+)', line)
+            if match is None:
+                return None
+            return [float(x) for x in match.groups()]
+
+    def end_block(self, name, rows):
+        if name == 'cell':
+            if len(rows) == 3:
+                self.lattice_vectors = np.array(rows)*self._scale()
+            return
+        elif name == 'forces':
+            # Ry/bohr
+            self.set_forces(np.array(rows)/2)
+            return
+
+        atoms = np.array(rows)
+        if name == 'initial positions':
+            atoms[:,:3] *= self.alat
+            relative_coords = False
+        else:
+            relative_coords = self.unit == 'crystal'
+            if not relative_coords:
+                atoms[:,:3] *= self._scale()
+        self.add_frame(sst.CrystalStructure(self.lattice_vectors.copy(), atoms, relative_coords=relative_coords))
+
+    def _unit(self, header):
+        for unit in ['crystal', 'bohr', 'angstrom', 'alat']:
+            if unit in header.lower():
+                return unit
+        return 'alat'
+
+    def _scale(self):
+        return {'crystal': 1.0, 'bohr': 1.0, 'angstrom': 1/sst.bohr, 'alat': self.alat}[self.unit]
+
+    def _species(self, label):
+        match = re.match(r'[A-Za-z]+', label)
+        if match is None:
+            return None
+        return p_table_rev.get(match.group(0).title())
+
+
 class Handler:
     def __init__(self):
         self.engine_name = 'quantum espresso'
@@ -43,6 +133,9 @@ class Handler:
         self.working_dirctory = '/quantum_espresso_files/'
         self.pseudo_directory = '/pseudos/'
         self.engine_process = None
+        # thread of runs that start the engine several times, e.g. ground state and band structure
+        self.engine_thread = None
+        self.executor = execution_backends.LocalExecutor()
         self.info_file = 'scf.out'
         self.info_text = """
 Quantum ESPRESSO is an integrated suite of Open-Source computer codes for electronic-structure calculations and materials modeling at the nanoscale.
@@ -169,7 +262,8 @@ performed in this run"""}
         self.optical_spectrum_options = {}
         self.optical_spectrum_options_tooltip = {}
 
-        self.relax_file_timestamp = None
+        self.relax_reader = None
+        self.relax_frames_loaded = 0
 
     def find_engine_folder(self):
         p = subprocess.Popen([search_command, 'pw.x'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,shell=shell_bool)
@@ -181,6 +275,7 @@ performed in this run"""}
     def parse_input_file(self, filename):
         raise NotImplementedError()
 
+    @engine_futures.engine_task(engine_futures.read_ground_state)
     def start_ground_state(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a ground state calculation in a subprocess. The configuration is stored in scf_options.
 
@@ -197,7 +292,7 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the band structure if band_structure_points are given (an EnergyDiagram for molecules), otherwise the scf status.
         """
         if crystal_structure.n_atoms//2 >= int(self.scf_options['nbnd']):
             raise Exception('Too few bands')
@@ -210,7 +305,7 @@ Returns:
 
         if band_structure_points is not None:
             def run_bs():
-                while self.is_engine_running():
+                while self._is_process_running():
                     time.sleep(0.001)
                 file = self._make_input_file(filename='bands.in')
                 self._add_scf_to_file(file,crystal_structure,calculation='bands',band_points=band_structure_points)
@@ -220,7 +315,9 @@ Returns:
 
             t = threading.Thread(target=run_bs)
             t.start()
+            self.engine_thread = t
 
+    @engine_futures.engine_task(engine_futures.read_optical_spectrum)
     def start_optical_spectrum(self, crystal_structure):
         """This method starts a optical spectrum calculation in a subprocess. The configuration is stored in optical_spectrum_options.
 
@@ -228,10 +325,11 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the OpticalSpectrum.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_gw)
     def start_gw(self, crystal_structure, band_structure_points=None,blocking=False):
         """This method starts a g0w0 calculation in a subprocess. The configuration is stored in gw_options.
 
@@ -248,10 +346,11 @@ Keyword Args:
                                 Helpful when looping over different calculations in the builtin python terminal.
                                 Default: False
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the quasi particle BandStructure.
         """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_phonons)
     def start_phonon(self, crystal_structure, band_structure_points):
         """This method starts a phonon bandstructure calculation in a subprocess. The configuration is stored in phonons_options.
 
@@ -268,6 +367,7 @@ Returns:
                 """
         raise NotImplementedError
 
+    @engine_futures.engine_task(engine_futures.read_relax)
     def start_relax(self, crystal_structure):
         """This method starts a structure relaxation calculation in a subprocess. The configuration is stored in relax_options.
 
@@ -275,7 +375,7 @@ Args:
     - crystal_structure:        A CrystalStructure or MolecularStructure object that represents the geometric structure of the material under study.
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the relaxed structure.
         """
         if self.relax_options['type'] not in ['relax', 'md', 'vc-relax','vc-md']:
             raise ValueError("Relax type must be relax, md, vc-relax or vc-md")
@@ -286,58 +386,35 @@ Returns:
         file = self._make_input_file()
         self._add_scf_to_file(file,crystal_structure,calculation=self.relax_options['type'])
         file.close()
+        self.relax_reader = None
         self._start_engine()
 
+    def relax_output_reader(self):
+        """Returns a new incremental reader of the output of the relaxation (see trajectory_reader). Threads other than
+the GUI use their own reader, since load_relax_structure is not thread safe."""
+        file = self.project_directory+self.working_dirctory+self.info_file
+        return RelaxOutputReader(file)
+
     def load_relax_structure(self):
         """This method loads the result of a relaxation calculation, which is a molecular or crystal structure.
+Only the output that was written since the last call is parsed. All ionic steps are kept in relax_reader.trajectory.
 
 Returns:
-    - CrystalStructure or MolecularStructure object depending on the material under study.
+    - CrystalStructure or MolecularStructure object depending on the material under study. None if there is no new
+      structure since the last call.
         """
         file = self.project_directory+self.working_dirctory+self.info_file
-        if not os.path.isfile(file):
-            return None
-        if self.relax_file_timestamp is not None and os.path.getmtime(file) == self.relax_file_timestamp:
+        if self.relax_reader is None or self.relax_reader.filename != file:
+            self.relax_reader = self.relax_output_reader()
+            self.relax_frames_loaded = 0
+        if self.relax_reader.update() == 'reset':
+            self.relax_frames_loaded = 0
+
+        trajectory = self.relax_reader.trajectory
+        if len(trajectory) == self.relax_frames_loaded:
             return None
-        self.relax_file_timestamp = os.path.getmtime(file)
-
-        with open(file) as f:
-            text_full = f.read()
-            text = text_full.splitlines()
-
-        matched_lines = [i for i,line in enumerate(text) if 'atomic_positions' in line.lower()]
-        if len(matched_lines) == 0:
-            return None
-        highest_index = max(matched_lines)
-        species = []
-        coords = []
-        for line in text[highest_index+1:]:
-            try:
-                res = line.split()
-                species.append(p_table_rev[res[0]])
-                coords.append(np.array([float(x) for x in res[1:]]))
-            except Exception:
-                if len(res)==0:
-                    continue
-                else:
-                    break
-
-        atoms = np.zeros((len(species),4))
-        for i,atom in enumerate(zip(species,coords)):
-            atoms[i,:3] = atom[1]
-            atoms[i,3] = atom[0]
-
-        if 'CELL_PARAMETERS' in text_full:
-            calculation = 'vc-relax'
-        else:
-            calculation = 'relax'
-
-
-        lattice_vectors = self._read_lattice_vectors(text,calculation=calculation)
-        if lattice_vectors is None:
-            return None
-
-        return sst.CrystalStructure(lattice_vectors,atoms)
+        self.relax_frames_loaded = len(trajectory)
+        return trajectory[-1]
 
     def read_scf_status(self):
         """This method reads the result of a self consistent ground state calculation.
@@ -495,9 +572,10 @@ Returns:
         l_data = np.array(total_res)
         data = l_data.reshape(n_grid,order='C')
 
-        data = data / data.max()
+        data /= data.max()
         return sst.KohnShamDensity(data)
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_ks_density(self, crystal_structure, bs_point):
         """This method starts a calculation of a specific electronic state in a subprocess.
 
@@ -512,7 +590,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the KohnShamDensity.
                 """
         f = self._make_input_file(filename='pp.in')
         inputpp_dic = {'prefix':self.general_options['title'],'outdir':self.project_directory + self.working_dirctory, 'plot_num':7, 'filplot': 'e_density', 'kpoint(1)':bs_point[0], 'kband(1)':bs_point[1]}
@@ -522,6 +600,7 @@ Returns:
         f.close()
         self._start_pp_process()
 
+    @engine_futures.engine_task(engine_futures.read_density)
     def calculate_electron_density(self,crystal_structure):
         """This method starts a calculation of the total (pseudo-) electron density in a subprocess.
 
@@ -533,7 +612,7 @@ Keyword Args:
                                 Default: '40 40 40'
 
 Returns:
-    - None
+    - future:                   EngineFuture of the run. Its result is the electron density.
                 """
         f = self._make_input_file(filename='pp.in')
         inputpp_dic = {'prefix':self.general_options['title'],'outdir':self.project_directory + self.working_dirctory, 'plot_num':0, 'filplot': 'e_density'}
@@ -544,7 +623,7 @@ Returns:
         self._start_pp_process()
 
     def kill_engine(self):
-        """Stops the execution of the engine process. Only possible for local execution and not in case of cluster calculation"""
+        """Stops the execution of the engine process. For cluster calculations the job is cancelled via the executor."""
         try:
             self.engine_process.kill()
             # os.killpg(os.getpgid(self.engine_process.pid), signal.SIGTERM)
@@ -555,21 +634,23 @@ Returns:
         """Determines whether the engine is currently running.
 
 Keyword args:
-    - tasks:    List of tasks that are supposed to be running. Must be supplied when the calculations run on a cluster.
+    - tasks:    List of tasks that are supposed to be running. Not needed anymore since the state of the run is reported by the executor,
+                but still accepted for compatibility.
                 Possible tasks are: ['bandstructure', 'relax', 'ks density', 'scf', 'g0w0', 'g0w0 bands', 'optical spectrum']
 
 Returns:
     - res:      Boolean result. True: engine is running. False: engine is not running.
 """
-        if self.custom_command_active:
-            return self._is_engine_running_custom_command(tasks)
+        # runs that are queued or whose results are still being read count as running
+        return engine_futures.is_busy(self) or self._is_process_running()
+
+    def _is_process_running(self):
+        if self.engine_process is None:
+            return False
+        if self.engine_process.poll() is None:
+            return True
         else:
-            if self.engine_process is None:
-                return False
-            if self.engine_process.poll() is None:
-                return True
-            else:
-                return False
+            return False
 
     def will_scf_run(self):
         return True
@@ -648,33 +729,25 @@ Returns:
 
 
     def _start_pp_process(self):
-        command = 'exec pp.x<pp.in'
-        os.chdir(self.project_directory + self.working_dirctory)
-        self.engine_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                               shell=True,preexec_fn=os.setpgrp)
-        os.chdir(self.project_directory)
+        # pp.x reads the wave functions of the last run, so it runs where the engine ran
+        self.engine_process = self.executor.submit('exec pp.x<pp.in', self.project_directory + self.working_dirctory,
+                                                   shell=True)
 
     def _start_engine(self,filename='scf.in',blocking=False):
-        os.chdir(self.project_directory + self.working_dirctory)
         if self.custom_command_active:
             command = ['bash', self.custom_command]
         else:
             command = self._engine_command
 
-
         outname = filename.split('.')[0] + '.out'
-        final_command = [None]
-        final_command[0] = command[0] + ' <'+filename+' >'+outname
+        final_command = execution_backends.command_to_string(command) + ' <'+filename+' >'+outname
 
-        self.engine_process = subprocess.Popen("exec "+final_command[0], stdout=subprocess.PIPE, stderr=subprocess.PIPE,shell=True)
-        os.chdir(self.project_directory)
+        self.engine_process = self.executor.submit("exec "+final_command, self.project_directory + self.working_dirctory, shell=True)
         if blocking:
-            while self.is_engine_running():
+            while self._is_process_running():
                 time.sleep(0.1)
 
 
-    def _is_engine_running_custom_command(self,tasks):
-        raise NotImplementedError
 
     def _write_block(self,file,block_name,options):
         file.write(block_name+'\n')
@@ -708,52 +781,6 @@ Returns:
             if not os.path.isfile(filepath):
                 copyfile(installation_folder+'/data/pseudos/qe/'+file,filepath)
 
-    def _read_lattice_vectors(self,text,calculation='relax'):
-
-        lattice_vectors = np.zeros((3, 3))
-
-        if calculation == 'relax':
-            matched_line = [i for i, line in enumerate(text) if 'lattice parameter' in line.lower()]
-            line = text[matched_line[0]]
-            res = line.split('=')[1].replace('a.u.','')
-            a = float(res)
-
-            matched_line = [i for i, line in enumerate(text) if 'a(1) =' in line.lower()][0]
-
-            for i in range(matched_line,matched_line+3):
-                line = text[i]
-                res = line.split('=')[1]
-                res = res.replace('(','').replace(')','').split()
-                res = np.array([float(x) for x in res])
-                lattice_vectors[i-matched_line,:] = res*a
-
-        elif calculation == 'vc-relax':
-            matched_lines = [i for i, line in enumerate(text) if 'cell_parameters' in line.lower()]
-            if len(matched_lines) == 0:
-                return None
-            highest_index = max(matched_lines)
-            coords = []
-            for line in text[highest_index + 1:]:
-                try:
-                    res = line.split()
-                    if len(res) == 0:
-                        continue
-                    coords.append(np.array([float(x) for x in res[:]]))
-                except Exception:
-                    if len(res) == 0:
-                        continue
-                    else:
-                        break
-            if len(coords) < 3:
-                return None
-
-            for i in range(3):
-                lattice_vectors[i,:] = coords[i]
-
-        else:
-            raise ValueError('calculation ' + str(calculation)+ ' is not allowed')
-        return lattice_vectors
-
 if __name__ == '__main__':
     atoms = np.array([[0, 0, 0, 6], [0.25, 0.25, 0.25, 6]])
     unit_cell = 6.719 * np.array([[0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
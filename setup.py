@@ -5,10 +5,11 @@ except ImportError:
 
 setup(name='opendft',
       version='1.0',
-      py_modules=['main','solid_state_tools','exciting_handler','abinit_handler','quantum_espresso_handler','nwchem_handler','syntax','TerminalClass','visualization','little_helpers'],
+      py_modules=['main','solid_state_tools','exciting_handler','abinit_handler','quantum_espresso_handler','nwchem_handler','syntax','TerminalClass','visualization','plot_widgets','little_helpers','execution_backends','project_store','headless_export','kramers_kronig','log_tail','console_kernel','engine_futures','trajectory_reader','density_of_states','band_interpolation'],
       author='Jannick Weisshaupt',
       author_email='jannickw@gmx.de',
-      install_requires=['setuptools','numpy','matplotlib','periodictable','pyface','six','pymatgen','PySide','mayavi'],
+      install_requires=['setuptools','numpy','matplotlib','periodictable','pyface','six','pymatgen','PySide','mayavi',
+                        'futures; python_version < "3"'],
       maintainer='Jannick Weisshaupt',
       maintainer_email='jannickw@gmx.de',
       description='A Gui application for density functional theory calculations'
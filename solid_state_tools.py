@@ -4,9 +4,13 @@ import re
 import periodictable as pt
 from bisect import bisect
 import time
-from scipy.spatial import ConvexHull,Voronoi
+import weakref
+from scipy.spatial import ConvexHull,Voronoi,cKDTree
 import os
 from little_helpers import find_data_file
+import kramers_kronig
+import density_of_states
+import band_interpolation
 
 
 from pymatgen.symmetry.bandstructure import HighSymmKpath
@@ -14,6 +18,17 @@ import pymatgen as mg
 
 
 bohr = 0.52917721067
+hartree = 27.21138602
+hbar_c = 1.973269788e-5 # eV cm
+
+optical_constant_names = ('refractive_index','extinction_coefficient','absorption_coefficient','reflectivity','loss_function')
+optical_components = ('','_11','_22','_33')
+# optical constants of every OpticalSpectrum by attribute name, e.g. 'reflectivity_11'
+optical_constants_cache = weakref.WeakKeyDictionary()
+# densities of states of every KPointEigenvalues object by their arguments
+dos_cache = weakref.WeakKeyDictionary()
+# star function interpolations of every KPointEigenvalues object by crystal structure and star ratio
+interpolation_cache = weakref.WeakKeyDictionary()
 
 cov_radii = np.loadtxt(find_data_file('/data/cov_radii.dat'))/bohr
 
@@ -44,19 +59,7 @@ class MolecularStructure(object):
         return self.atoms
 
     def find_bonds(self,abs_coords):
-        n_atoms = abs_coords.shape[0]
-        abs_coords_pure = abs_coords[:,:3]
-
-        dist_mat = np.zeros((n_atoms,n_atoms))
-        bonds = []
-        for j1 in range(n_atoms):
-            for j2 in range(j1+1,n_atoms):
-
-                dist = np.linalg.norm(abs_coords_pure[j1,:]-abs_coords_pure[j2,:] )
-                if dist < (cov_radii[int(abs_coords[j1,3])]+cov_radii[int(abs_coords[j2,3])])*1.3:
-                    dist_mat[j1, j2] = dist
-                    bonds.append([j1,j2]);
-        return bonds
+        return find_bonds(abs_coords)
 
 class CrystalStructure(object):
     def __init__(self,lattice_vectors,atoms,relative_coords=True,scale=1.0):
@@ -87,31 +90,18 @@ class CrystalStructure(object):
     def calc_absolute_coordinates(self,repeat=[1,1,1]):
         n_repeat = repeat[0]*repeat[1]*repeat[2]
 
-        abs_coord = np.zeros((self.n_atoms,repeat[0],repeat[1],repeat[2],4))
+        # integer cell offsets (j1,j2,j3) with j3 running fastest
+        cell_indices = np.indices(repeat).reshape(3,n_repeat).T
+        offsets = np.dot(cell_indices,self.lattice_vectors)
 
-        for j1 in range(repeat[0]):
-            for j2 in range(repeat[1]):
-                for j3 in range(repeat[2]):
-                    for i in range(self.n_atoms):
-                        abs_coord[i,j1,j2,j3,:3] = np.dot(self.lattice_vectors.T,self.atoms[i,:3].T) + j3*self.lattice_vectors[2,:]+j2*self.lattice_vectors[1,:]+j1*self.lattice_vectors[0,:]
-                        abs_coord[i,j1,j2,j3,3] = self.atoms[i,3]
-                abs_coord_out = abs_coord.reshape((n_repeat*self.n_atoms,4))
+        abs_coord = np.zeros((self.n_atoms,n_repeat,4))
+        abs_coord[:,:,:3] = np.dot(self.atoms[:,:3],self.lattice_vectors)[:,np.newaxis,:] + offsets[np.newaxis,:,:]
+        abs_coord[:,:,3] = self.atoms[:,3,np.newaxis]
+        abs_coord_out = abs_coord.reshape((n_repeat*self.n_atoms,4))
         return abs_coord_out
 
     def find_bonds(self,abs_coords):
-        n_atoms = abs_coords.shape[0]
-        abs_coords_pure = abs_coords[:,:3]
-
-        dist_mat = np.zeros((n_atoms,n_atoms))
-        bonds = []
-        for j1 in range(n_atoms):
-            for j2 in range(j1+1,n_atoms):
-
-                dist = np.linalg.norm(abs_coords_pure[j1,:]-abs_coords_pure[j2,:] )
-                if dist < (cov_radii[int(abs_coords[j1,3])]+cov_radii[int(abs_coords[j2,3])])*1.3:
-                    dist_mat[j1, j2] = dist
-                    bonds.append([j1,j2]);
-        return bonds
+        return find_bonds(abs_coords)
 
     def convert_to_tpiba(self,band_structure_points):
         if type(band_structure_points) in [list,tuple]:
@@ -130,6 +120,140 @@ class CrystalStructure(object):
         self.inv_lattice_vectors[1,:] = np.cross(self.lattice_vectors[2,:],self.lattice_vectors[0,:])*2*np.pi/volume
         self.inv_lattice_vectors[2,:] = np.cross(self.lattice_vectors[0,:],self.lattice_vectors[1,:])*2*np.pi/volume
 
+class Trajectory(object):
+    """Sequence of structures with the same atoms, e.g. the ionic steps of a relaxation or a molecular dynamics run.
+
+The frames are kept in arrays whose capacity is doubled when they are full, so appending is cheap and a frame can be
+shown without creating a structure object:
+
+    - positions:        Cartesian coordinates in bohr with shape (n_frames,n_atoms,3) in single precision.
+
+    - lattice_vectors:  Unit cell of every frame with shape (n_frames,3,3). None for molecules.
+
+    - energies:         Total energies in Hartree with shape (n_frames,).
+
+    - forces:           Forces in Hartree/bohr with shape (n_frames,n_atoms,3) in single precision.
+
+Unknown energies and forces are nan.
+
+Keyword args:
+    - species:          Atomic numbers of the atoms. Together with positions a trajectory can be created from arrays.
+
+    - positions:        See above.
+
+    - lattice_vectors:  See above. Either an array of shape (n_frames,3,3) or the cell of all frames with shape (3,3).
+
+    - energies:         See above.
+
+    - forces:           See above.
+    """
+    def __init__(self,species=None,positions=None,lattice_vectors=None,energies=None,forces=None):
+        self.species = None if species is None else np.array(species,dtype=int)
+        self.periodic = lattice_vectors is not None
+        self.n_frames = 0
+        if positions is None:
+            return
+
+        positions = np.asarray(positions,dtype=np.float32)
+        self.n_frames = positions.shape[0]
+        self._allocate(self.n_frames)
+        self._positions[:] = positions
+        if self.periodic:
+            self._lattice_vectors[:] = np.asarray(lattice_vectors,dtype=np.float)
+        if energies is not None:
+            self._energies[:] = energies
+        if forces is not None:
+            self._forces[:] = forces
+
+    def _allocate(self,capacity):
+        n_atoms = len(self.species)
+        self._positions = np.zeros((capacity,n_atoms,3),dtype=np.float32)
+        self._lattice_vectors = np.zeros((capacity,3,3)) if self.periodic else None
+        self._energies = np.full(capacity,np.nan)
+        self._forces = np.full((capacity,n_atoms,3),np.nan,dtype=np.float32)
+
+    def _grow(self):
+        old = (self._positions,self._lattice_vectors,self._energies,self._forces)
+        self._allocate(max(2*len(self._positions),16))
+        for new_array,old_array in zip((self._positions,self._lattice_vectors,self._energies,self._forces),old):
+            if new_array is not None:
+                new_array[:len(old_array)] = old_array
+
+    @property
+    def positions(self):
+        return None if self.n_frames == 0 else self._positions[:self.n_frames]
+
+    @property
+    def lattice_vectors(self):
+        return None if self.n_frames == 0 or not self.periodic else self._lattice_vectors[:self.n_frames]
+
+    @property
+    def energies(self):
+        return np.zeros(0) if self.n_frames == 0 else self._energies[:self.n_frames]
+
+    @property
+    def forces(self):
+        return None if self.n_frames == 0 else self._forces[:self.n_frames]
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self,index):
+        """Returns frame index as CrystalStructure or MolecularStructure."""
+        atoms = self.absolute_coordinates(index)
+        if not self.periodic:
+            return MolecularStructure(atoms)
+        return CrystalStructure(self.lattice_vectors[index],atoms,relative_coords=False)
+
+    def append(self,structure,energy=np.nan,forces=None):
+        """Appends structure, which must have the same atoms as the other frames, as the last frame."""
+        abs_coords = structure.calc_absolute_coordinates()
+        species = abs_coords[:,3].astype(int)
+        periodic = hasattr(structure,'lattice_vectors')
+        if self.n_frames == 0:
+            self.species = species
+            self.periodic = periodic
+            self._allocate(16)
+        elif not np.array_equal(species,self.species) or periodic != self.periodic:
+            raise ValueError('All frames of a trajectory must have the same atoms')
+
+        if self.n_frames == len(self._positions):
+            self._grow()
+        self._positions[self.n_frames] = abs_coords[:,:3]
+        if self.periodic:
+            self._lattice_vectors[self.n_frames] = structure.lattice_vectors
+        self._energies[self.n_frames] = energy
+        self._forces[self.n_frames] = np.nan if forces is None else forces
+        self.n_frames += 1
+
+    def absolute_coordinates(self,index,repeat=[1,1,1]):
+        """Returns the cartesian coordinates and species of frame index like CrystalStructure.calc_absolute_coordinates."""
+        positions = self.positions[index]
+        n_atoms = len(self.species)
+        if not self.periodic:
+            repeat = [1,1,1]
+        n_repeat = repeat[0]*repeat[1]*repeat[2]
+
+        abs_coord = np.zeros((n_atoms,n_repeat,4))
+        abs_coord[:,:,:3] = positions[:,np.newaxis,:]
+        if n_repeat > 1:
+            cell_indices = np.indices(repeat).reshape(3,n_repeat).T
+            abs_coord[:,:,:3] += np.dot(cell_indices,self.lattice_vectors[index])[np.newaxis,:,:]
+        abs_coord[:,:,3] = self.species[:,np.newaxis]
+        return abs_coord.reshape((n_repeat*n_atoms,4))
+
+    def is_last_frame(self,structure,tolerance=1e-4):
+        """Returns whether structure equals the last frame within tolerance (in bohr)."""
+        if self.n_frames == 0 or hasattr(structure,'lattice_vectors') != self.periodic:
+            return False
+        abs_coords = structure.calc_absolute_coordinates()
+        if abs_coords.shape[0] != len(self.species) or not np.array_equal(abs_coords[:,3].astype(int),self.species):
+            return False
+        if self.periodic and not np.allclose(structure.lattice_vectors,self._lattice_vectors[self.n_frames-1],rtol=0,atol=tolerance):
+            return False
+        return np.allclose(abs_coords[:,:3],self._positions[self.n_frames-1],rtol=0,atol=tolerance)
+
+
 class BandStructure(object):
     def __init__(self,bands,special_k_points=None,bs_type='electronic'):
         self.bands = bands
@@ -160,6 +284,277 @@ class BandStructure(object):
             k_bandgap = None
         return bandgap, k_bandgap
 
+    @property
+    def k(self):
+        """Path coordinates of the k points."""
+        return self.bands[0][:, 0]
+
+    def energy_matrix(self):
+        """Returns the band energies as array of shape (n_k,n_bands)."""
+        return np.array([band[:, 1] for band in self.bands]).T
+
+    def path_segments(self):
+        """Returns the segment index of every k point. A new segment starts wherever the path coordinate does not increase,
+i.e. at repeated points where the path jumps between two special k points."""
+        return np.append(0, np.cumsum(np.diff(self.k) <= 1e-10))
+
+    def energies_at(self, k_values):
+        """Returns the energies of all bands at the path coordinates k_values (linear interpolation) as array of shape (len(k_values),n_bands)."""
+        k = self.k
+        energies = self.energy_matrix()
+        k_values = np.atleast_1d(k_values)
+        index = np.clip(np.searchsorted(k, k_values, side='right') - 1, 0, len(k) - 2)
+        dk = k[index + 1] - k[index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(dk > 0, (k_values - k[index]) / dk, 0)
+        t = np.clip(t, 0, 1)[:, np.newaxis]
+        return energies[index] * (1 - t) + energies[index + 1] * t
+
+    def band_velocities(self, k_scale=1.0):
+        """Returns the finite difference derivatives dE/dk of all bands as array of shape (n_k,n_bands) in eV times the unit of the path coordinate.
+The derivatives are taken within each path segment, so jumps of the path do not produce spurious values.
+
+Keyword args:
+    - k_scale:  Factor that converts the path coordinate to 1/bohr. With the path in 1/bohr and k_scale=1
+                the group velocity in atomic units is band_velocities()/hartree.
+        """
+        k = self.k * k_scale
+        energies = self.energy_matrix()
+        velocities = np.zeros(energies.shape)
+        segments = self.path_segments()
+        for segment in np.unique(segments):
+            mask = segments == segment
+            if mask.sum() > 1:
+                velocities[mask] = np.gradient(energies[mask], k[mask], axis=0)
+        return velocities
+
+    def parabolic_fit(self, k_index, band_indices=None, n_points=2, k_scale=1.0):
+        """Fits E(k) = a*(k-k0)**2 + b*(k-k0) + c to the bands around the k point k_index with one least squares solve for all bands.
+Only the up to n_points neighbours on each side that lie on the same path segment are used.
+
+Returns:
+    - coefficients:     Array of shape (3,n_selected_bands) with the rows a, b and c.
+        """
+        k = self.k * k_scale
+        energies = self.energy_matrix()
+        if band_indices is not None:
+            energies = energies[:, band_indices]
+        segments = self.path_segments()
+        window = np.arange(max(k_index - n_points, 0), min(k_index + n_points + 1, len(k)))
+        window = window[segments[window] == segments[k_index]]
+        if len(window) < 3:
+            raise ValueError('Not enough k points around index {0} for a parabolic fit'.format(k_index))
+        dk = k[window] - k[k_index]
+        design = np.stack([dk ** 2, dk, np.ones(len(dk))], axis=1)
+        coefficients = np.linalg.lstsq(design, energies[window], rcond=-1)[0]
+        return coefficients
+
+    def effective_masses(self, k_index, band_indices=None, n_points=2, k_scale=1.0):
+        """Returns the effective masses m*/m_e = hbar^2/(m_e d^2E/dk^2) of the bands at the k point k_index from local parabolic fits.
+Masses are negative at band maxima. The path coordinate times k_scale has to be in 1/bohr."""
+        curvature = 2 * self.parabolic_fit(k_index, band_indices=band_indices, n_points=n_points, k_scale=k_scale)[0]
+        with np.errstate(divide='ignore'):
+            return hartree / curvature
+
+    def band_edges(self):
+        """Returns (valence band index, k index of the valence band maximum, k index of the conduction band minimum)
+or None if the band structure is metallic or has no bands on both sides of zero."""
+        energies = self.energy_matrix()
+        above = np.any(energies > 0, axis=0)
+        if not above.any() or above[0]:
+            return None
+        conduction = np.argmax(above)
+        if energies[:, conduction].min() < 0:
+            return None
+        valence = conduction - 1
+        return valence, np.argmax(energies[:, valence]), np.argmin(energies[:, conduction])
+
+    def find_crossings(self, tolerance=0.01):
+        """Finds the points where neighbouring bands cross or touch.
+
+Bands that are ordered by energy only touch at a crossing, which is found as a local minimum of their distance that
+is smaller than tolerance (eV). Bands that keep their character change their order, which is found as a sign change
+of their difference between two k points of the same segment and located by linear interpolation.
+
+Returns:
+    - k_crossings:      Path coordinates of the crossings.
+
+    - band_indices:     Index i of the lower band of each crossing, the crossing is between band i and i+1.
+
+    - energies:         Energies of the crossings.
+        """
+        k = self.k
+        energies = self.energy_matrix()
+        difference = energies[:, 1:] - energies[:, :-1]
+        segments = self.path_segments()
+        same_segment = (segments[1:] == segments[:-1])[:, np.newaxis]
+
+        # order changes between two neighbouring k points
+        d0 = difference[:-1]
+        d1 = difference[1:]
+        i_k, i_band = np.nonzero((np.sign(d0) * np.sign(d1) < 0) & same_segment)
+        t = d0[i_k, i_band] / (d0[i_k, i_band] - d1[i_k, i_band])
+        k_sign = k[i_k] + t * (k[i_k + 1] - k[i_k])
+        e_sign = energies[i_k, i_band] + t * (energies[i_k + 1, i_band] - energies[i_k, i_band])
+
+        # touching bands
+        gap = np.abs(difference)
+        padded = np.pad(gap, [(1, 1), (0, 0)], mode='constant', constant_values=np.inf)
+        local_minimum = (gap <= padded[:-2]) & (gap < padded[2:]) & (gap < tolerance)
+        j_k, j_band = np.nonzero(local_minimum)
+        k_touch = k[j_k]
+        e_touch = (energies[j_k, j_band] + energies[j_k, j_band + 1]) / 2
+
+        k_crossings = np.concatenate([k_sign, k_touch])
+        band_indices = np.concatenate([i_band, j_band])
+        crossing_energies = np.concatenate([e_sign, e_touch])
+        order = np.lexsort((band_indices, k_crossings))
+        return k_crossings[order], band_indices[order], crossing_energies[order]
+
+
+def band_edge_properties(band_structures, n_points=2, k_scale=1.0):
+    """Evaluates the band edges of many band structures.
+
+Args:
+    - band_structures:  List of BandStructure objects, e.g. the values of the stored band structure results.
+
+Keyword args:
+    - n_points:         Number of neighbours on each side used for the parabolic fits.
+
+    - k_scale:          Factor that converts the path coordinates to 1/bohr.
+
+Returns:
+    - properties:       Structured array with one entry per band structure and the fields bandgap (eV), k_vbm, k_cbm
+                        (path coordinates), hole_mass and electron_mass (m_e). Metallic band structures and failed fits give nan.
+    """
+    properties = np.full(len(band_structures), np.nan, dtype=[('bandgap', float), ('k_vbm', float), ('k_cbm', float),
+                                                             ('hole_mass', float), ('electron_mass', float)])
+    for i, band_structure in enumerate(band_structures):
+        edges = band_structure.band_edges()
+        if edges is None:
+            continue
+        valence, k_vbm, k_cbm = edges
+        energies = band_structure.energy_matrix()
+        properties['bandgap'][i] = energies[k_cbm, valence + 1] - energies[k_vbm, valence]
+        properties['k_vbm'][i] = band_structure.k[k_vbm]
+        properties['k_cbm'][i] = band_structure.k[k_cbm]
+        try:
+            properties['hole_mass'][i] = -band_structure.effective_masses(k_vbm, band_indices=[valence], n_points=n_points, k_scale=k_scale)[0]
+            properties['electron_mass'][i] = band_structure.effective_masses(k_cbm, band_indices=[valence + 1], n_points=n_points, k_scale=k_scale)[0]
+        except ValueError:
+            pass
+    return properties
+
+
+class KPointEigenvalues(object):
+    """Eigenvalues of all bands on a k point mesh, from which densities of states are calculated.
+
+Args:
+    - eigenvalues:  Eigenvalues in eV with shape (n_k,n_bands) or (n_spin,n_k,n_bands) for spin polarized calculations.
+
+Keyword args:
+    - weights:      Weights of the k points with shape (n_k,). Default: equal weights.
+
+    - mesh:         Shape (n1,n2,n3) of the regular k mesh if the eigenvalues cover the full mesh in C order. Needed for
+                    the tetrahedron method.
+
+    - fermi_energy: Fermi energy in eV.
+
+    - k_points:     Coordinates of the k points in units of the reciprocal lattice vectors with shape (n_k,3). Needed
+                    for the interpolation of the bands. Default: the points of mesh if it is given.
+    """
+    def __init__(self,eigenvalues,weights=None,mesh=None,fermi_energy=None,k_points=None):
+        self.eigenvalues = np.asarray(eigenvalues,dtype=np.float)
+        self.weights = weights
+        self.mesh = mesh
+        if k_points is None and mesh is not None:
+            k_points = np.indices(mesh).reshape(3,-1).T/np.array(mesh)
+        self.k_points = k_points
+        self.fermi_energy = fermi_energy
+        self.engine_information = None
+
+    @property
+    def spin_polarized(self):
+        return self.eigenvalues.ndim == 3
+
+    def dos(self,energy=None,method='gaussian',width=0.1,n_points=2001):
+        """Returns the density of states. The result is cached for every set of arguments.
+
+Keyword args:
+    - energy:       Uniform energy grid in eV. Default: n_points from below the lowest to above the highest eigenvalue.
+
+    - method:       'gaussian', 'lorentzian' or 'tetrahedron'. See density_of_states for the methods.
+
+    - width:        Width of the smearing in eV.
+
+Returns:
+    - energy:       The energy grid.
+
+    - dos:          Density of states in states per eV and unit cell summed over spins.
+        """
+        key = (method,width,n_points,None if energy is None else np.asarray(energy,dtype=np.float).tobytes())
+        cache = dos_cache.setdefault(self,{})
+        if key in cache:
+            return cache[key]
+
+        degeneracy = 1.0 if self.spin_polarized else 2.0
+        if method == 'tetrahedron':
+            if self.mesh is None:
+                raise ValueError('The tetrahedron method needs the eigenvalues on the full regular mesh')
+            if energy is None:
+                energy = density_of_states.energy_grid(self.eigenvalues,n_points=n_points)
+            n_bands = self.eigenvalues.shape[-1]
+            eigenvalues = self.eigenvalues.reshape(self.eigenvalues.shape[:-2]+tuple(self.mesh)+(n_bands,))
+            result = density_of_states.tetrahedron_dos(eigenvalues,energy=energy,degeneracy=degeneracy)
+        elif method in ['gaussian','lorentzian']:
+            if energy is None:
+                energy = density_of_states.energy_grid(self.eigenvalues,n_points=n_points,padding=5*width)
+            result = density_of_states.smeared_dos(self.eigenvalues,weights=self.weights,energy=energy,width=width,
+                                                   kind=method,degeneracy=degeneracy)
+        else:
+            raise ValueError('method must be gaussian, lorentzian or tetrahedron')
+        cache[key] = result
+        return result
+
+    def interpolation(self,crystal_structure,star_ratio=5):
+        """Returns the star function interpolation (see band_interpolation) of the bands with the symmetry of
+crystal_structure. It is fitted once for every structure and star_ratio."""
+        if self.k_points is None:
+            raise ValueError('The interpolation needs the coordinates of the k points')
+        key = (crystal_structure.lattice_vectors.tobytes(),crystal_structure.atoms.tobytes(),star_ratio)
+        cache = interpolation_cache.setdefault(self,{})
+        if key not in cache:
+            rotations = band_interpolation.point_group(crystal_structure.lattice_vectors,atoms=crystal_structure.atoms)
+            cache[key] = band_interpolation.StarFunctionInterpolation(self.k_points,self.eigenvalues,
+                                                                      crystal_structure.lattice_vectors,
+                                                                      rotations=rotations,star_ratio=star_ratio)
+        return cache[key]
+
+    def band_structure(self,crystal_structure,k_path,n_points=400,star_ratio=5):
+        """Returns the interpolated BandStructure along k_path, a list of [point,label] like the band_structure_points
+of the engines. The path coordinate is given in 1/bohr and the energies relative to the Fermi energy if it is known.
+For spin polarized calculations the bands of both spins are returned."""
+        k_points,distances,special_k_points = band_interpolation.path_points(k_path,crystal_structure.inv_lattice_vectors,
+                                                                             n_points=n_points)
+        energies = self.interpolation(crystal_structure,star_ratio=star_ratio).energies(k_points)
+        if self.fermi_energy is not None:
+            energies = energies-self.fermi_energy
+        energies = energies.reshape((-1,)+energies.shape[-2:])
+        bands = []
+        for spin_energies in energies:
+            for i in range(spin_energies.shape[1]):
+                bands.append(np.column_stack([distances,spin_energies[:,i]]))
+        return BandStructure(bands,special_k_points=special_k_points)
+
+    def interpolate_mesh(self,crystal_structure,mesh,star_ratio=5):
+        """Returns KPointEigenvalues on the full regular mesh (n1,n2,n3) interpolated from these eigenvalues, e.g. for
+densities of states with the tetrahedron method."""
+        energies = self.interpolation(crystal_structure,star_ratio=star_ratio).mesh_energies(mesh)
+        n_bands = energies.shape[-1]
+        energies = energies.reshape(energies.shape[:-4]+(-1,n_bands))
+        return KPointEigenvalues(energies,mesh=tuple(mesh),fermi_energy=self.fermi_energy)
+
+
 class EnergyDiagram(object):
     def __init__(self,energies,labels,occupations=None):
         self.energies = energies
@@ -208,6 +603,85 @@ class OpticalSpectrum:
         else:
             self.epsilon1 = epsilon1
 
+    def __getattr__(self,name):
+        """Optical constants (see optical_constant_names, optionally with a component suffix like '_11') are computed
+on first access and cached outside of the instance, so they are not stored with the project."""
+        for component in optical_components:
+            if name[:len(name)-len(component)] in optical_constant_names and name.endswith(component):
+                if name not in optical_constants_cache.get(self,{}):
+                    compute_optical_constants([self],component=component)
+                try:
+                    return optical_constants_cache[self][name]
+                except KeyError:
+                    break
+        raise AttributeError(name)
+
+def calculate_optical_constants(energy,epsilon1,epsilon2):
+    """Calculates the optical constants from the dielectric function. epsilon1 and epsilon2 can have any shape with the energy along the last axis.
+
+Returns:
+    - constants:    Dictionary with the refractive index n, extinction coefficient k, absorption coefficient alpha (1/cm),
+                    normal incidence reflectivity R and the loss function -Im(1/epsilon), keyed by optical_constant_names.
+    """
+    abs_epsilon = np.hypot(epsilon1,epsilon2)
+    n = np.sqrt((abs_epsilon+epsilon1)/2)
+    k = np.sqrt(np.maximum((abs_epsilon-epsilon1)/2,0))
+    alpha = 2*energy*k/hbar_c
+    reflectivity = ((n-1)**2+k**2)/((n+1)**2+k**2)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        loss_function = epsilon2/abs_epsilon**2
+    return dict(zip(optical_constant_names,[n,k,alpha,reflectivity,loss_function]))
+
+def compute_optical_constants(optical_spectra,component=''):
+    """Computes the optical constants of a component ('', '_11', '_22' or '_33') for all optical_spectra and caches them.
+Spectra on the same energy grid are calculated together in one vectorized batch. Spectra without the component are skipped."""
+    fill_real_parts(optical_spectra)
+    groups = {}
+    for optical_spectrum in optical_spectra:
+        cache = optical_constants_cache.setdefault(optical_spectrum,{})
+        epsilon1 = optical_spectrum.__dict__.get('epsilon1'+component)
+        epsilon2 = optical_spectrum.__dict__.get('epsilon2'+component)
+        if optical_constant_names[0]+component not in cache and epsilon1 is not None and epsilon2 is not None:
+            groups.setdefault(optical_spectrum.energy.tobytes(),[]).append(optical_spectrum)
+
+    for group in groups.values():
+        epsilon1 = np.array([optical_spectrum.__dict__['epsilon1'+component] for optical_spectrum in group])
+        epsilon2 = np.array([optical_spectrum.__dict__['epsilon2'+component] for optical_spectrum in group])
+        constants = calculate_optical_constants(group[0].energy,epsilon1,epsilon2)
+        for i,optical_spectrum in enumerate(group):
+            cache = optical_constants_cache[optical_spectrum]
+            for name,values in constants.items():
+                cache[name+component] = values[i]
+
+def fill_real_parts(optical_spectra):
+    """Computes the missing real parts of the dielectric functions of optical_spectra with the Kramers-Kronig relation.
+Spectra on the same energy grid are transformed together in one batch."""
+    groups = {}
+    for optical_spectrum in optical_spectra:
+        if optical_spectrum.epsilon1 is None:
+            groups.setdefault(optical_spectrum.energy.tobytes(),[]).append(optical_spectrum)
+
+    for group in groups.values():
+        has_components = [hasattr(optical_spectrum,'epsilon2_11') for optical_spectrum in group]
+        epsilon2 = []
+        for optical_spectrum,components in zip(group,has_components):
+            if components:
+                epsilon2.extend([optical_spectrum.epsilon2_11,optical_spectrum.epsilon2_22,optical_spectrum.epsilon2_33])
+            else:
+                epsilon2.append(optical_spectrum.epsilon2)
+        epsilon1 = kramers_kronig.epsilon1_from_epsilon2(group[0].energy,np.array(epsilon2))
+
+        i = 0
+        for optical_spectrum,components in zip(group,has_components):
+            if components:
+                optical_spectrum.epsilon1_11,optical_spectrum.epsilon1_22,optical_spectrum.epsilon1_33 = epsilon1[i:i+3]
+                optical_spectrum.epsilon1 = epsilon1[i:i+3].mean(axis=0)
+                i += 3
+            else:
+                optical_spectrum.epsilon1 = epsilon1[i]
+                i += 1
+
+
 class StructureParser:
     def __init__(self):
         pass
@@ -399,6 +873,75 @@ class MolecularDensity(object):
         self.origin = origin
         self.engine_information = None
 
+def find_bonds(abs_coords,tolerance=1.3):
+    """Returns the index pairs [i,j] (i<j) of all atoms that are closer than tolerance times the sum of their covalent radii.
+Neighbour candidates are found with a k-d tree, so the cost grows with the number of bonds and not with the square of the number of atoms."""
+    n_atoms = abs_coords.shape[0]
+    if n_atoms < 2:
+        return np.zeros((0,2),dtype=int)
+    radii = cov_radii[abs_coords[:,3].astype(int)]
+    tree = cKDTree(abs_coords[:,:3])
+    pairs = np.array(list(tree.query_pairs(2*radii.max()*tolerance)),dtype=int).reshape(-1,2)
+
+    dist = np.linalg.norm(abs_coords[pairs[:,0],:3]-abs_coords[pairs[:,1],:3],axis=1)
+    pairs = pairs[dist < (radii[pairs[:,0]]+radii[pairs[:,1]])*tolerance]
+    pairs.sort(axis=1)
+    return pairs[np.lexsort((pairs[:,1],pairs[:,0]))]
+
+
+class NeighborList(object):
+    """Verlet neighbor list that finds the bonds (see find_bonds) of a sequence of structures with the same atoms, e.g.
+the frames of a trajectory.
+
+The pairs of atoms that are closer than their bond length plus skin are searched once with a k-d tree. As long as no
+atom moved by more than half of the skin since then, the bonds of a new frame are among these candidates and only
+their distances are computed.
+
+Keyword args:
+    - tolerance:    Atoms are bonded if they are closer than tolerance times the sum of their covalent radii.
+
+    - skin:         Additional distance in bohr up to which pairs are kept as candidates.
+    """
+    def __init__(self,tolerance=1.3,skin=1.0):
+        self.tolerance = tolerance
+        self.skin = skin
+        self.reference = None
+        self.pairs = np.zeros((0,2),dtype=int)
+        self.bond_lengths = np.zeros(0)
+
+    def build(self,abs_coords):
+        self.reference = np.array(abs_coords)
+        radii = cov_radii[abs_coords[:,3].astype(int)]
+        if abs_coords.shape[0] < 2:
+            pairs = np.zeros((0,2),dtype=int)
+        else:
+            tree = cKDTree(abs_coords[:,:3])
+            pairs = np.array(list(tree.query_pairs(2*radii.max()*self.tolerance+self.skin)),dtype=int).reshape(-1,2)
+        bond_lengths = (radii[pairs[:,0]]+radii[pairs[:,1]])*self.tolerance
+        dist = np.linalg.norm(abs_coords[pairs[:,0],:3]-abs_coords[pairs[:,1],:3],axis=1)
+        keep = dist < bond_lengths+self.skin
+        pairs = pairs[keep]
+        pairs.sort(axis=1)
+        order = np.lexsort((pairs[:,1],pairs[:,0]))
+        self.pairs = pairs[order]
+        self.bond_lengths = bond_lengths[keep][order]
+
+    def needs_build(self,abs_coords):
+        if self.reference is None or self.reference.shape != abs_coords.shape:
+            return True
+        if not np.array_equal(self.reference[:,3],abs_coords[:,3]):
+            return True
+        displacement = abs_coords[:,:3]-self.reference[:,:3]
+        return np.einsum('ij,ij->i',displacement,displacement).max() > (self.skin/2)**2
+
+    def find_bonds(self,abs_coords):
+        """Returns the bonds of abs_coords like find_bonds. The neighbor list is rebuilt if necessary."""
+        if self.needs_build(abs_coords):
+            self.build(abs_coords)
+        diff = abs_coords[self.pairs[:,0],:3]-abs_coords[self.pairs[:,1],:3]
+        return self.pairs[np.einsum('ij,ij->i',diff,diff) < self.bond_lengths**2]
+
+
 def calculate_lattice_vectors_from_parameters(parameters):
     a, b, c, alpha, beta, gamma = parameters
     alpha = alpha * np.pi / 180
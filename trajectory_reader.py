@@ -0,0 +1,190 @@
+"""Incremental readers for the output of structure relaxations and molecular dynamics runs.
+
+A reader remembers the byte offset up to which the output file has been parsed, so polling a running calculation only
+reads the bytes that were appended since the last update. Every ionic step is appended to a Trajectory together with
+its energy and forces instead of keeping only the last geometry. The engine specific parsers are implemented in the
+handlers."""
+from __future__ import division
+import os
+import numpy as np
+import solid_state_tools as sst
+
+
+class TrajectoryReader(object):
+    """Base class of the readers of output files that grow by appending.
+
+Subclasses implement parse_line, which is called with every complete line of the file in order. Tables that follow
+a header line are collected with begin_block, parse_row and end_block. The results are stored with add_frame,
+set_energy and set_forces.
+
+Args:
+    - filename:     Path of the output file. It does not need to exist yet.
+
+Keyword args:
+    - encoding:     Encoding used to decode the text.
+
+    - block_size:   Number of bytes that are read at once.
+    """
+    def __init__(self,filename,encoding='utf-8',block_size=2**24):
+        self.filename = filename
+        self.encoding = encoding
+        self.block_size = block_size
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.inode = None
+        self.trajectory = sst.Trajectory()
+        self.block = None
+        self.block_rows = []
+        self.block_skip = 0
+        self.reset_state()
+
+    def reset_state(self):
+        """Resets the parser state of the subclass."""
+        pass
+
+    def update(self):
+        """Parses the lines that were appended since the last call. A line without line break is left for the next call.
+
+Returns:
+    - status:   'unchanged', 'appended' or 'reset' if the file was truncated or replaced and has been parsed anew.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            if self.offset == 0:
+                return 'unchanged'
+            self.reset()
+            return 'reset'
+
+        status = 'appended'
+        if stat.st_size < self.offset or (self.inode is not None and stat.st_ino != self.inode):
+            self.reset()
+            status = 'reset'
+        self.inode = stat.st_ino
+
+        start = self.offset
+        with open(self.filename,'rb') as f:
+            f.seek(self.offset)
+            position = self.offset
+            rest = b''
+            while position < stat.st_size:
+                data = f.read(min(self.block_size,stat.st_size-position))
+                if not data:
+                    break
+                position += len(data)
+                data = rest + data
+                end = data.rfind(b'\n') + 1
+                rest = data[end:]
+                self.offset += end
+                for line in data[:end].decode(self.encoding,'replace').splitlines():
+                    self._feed(line)
+
+        if self.offset == start and status == 'appended':
+            return 'unchanged'
+        return status
+
+    def _feed(self,line):
+        if self.block is not None:
+            row = self.parse_row(self.block,line) if line.strip() else None
+            if row is not None:
+                self.block_rows.append(row)
+                return
+            if not self.block_rows:
+                if not line.strip():
+                    return
+                if self.block_skip > 0:
+                    self.block_skip -= 1
+                    return
+            name, rows = self.block, self.block_rows
+            self.block = None
+            self.block_rows = []
+            self.end_block(name,rows)
+            if not line.strip():
+                return
+        self.parse_line(line)
+
+    def parse_line(self,line):
+        raise NotImplementedError
+
+    def begin_block(self,name,skip=0):
+        """Collects the following lines as rows of the block name. A line is a row if parse_row returns something else
+than None for it. Empty lines and up to skip other lines before the first row are ignored. The first line after the
+rows ends the block and end_block is called with the list of rows."""
+        self.block = name
+        self.block_rows = []
+        self.block_skip = skip
+
+    def parse_row(self,name,line):
+        return None
+
+    def end_block(self,name,rows):
+        pass
+
+    def add_frame(self,structure):
+        """Appends structure to the trajectory. Engines often print the final geometry of a run a second time, so
+structures that equal the last frame are not appended. A structure with other atoms than the previous frames starts a
+new trajectory."""
+        if self.trajectory.is_last_frame(structure):
+            return
+        try:
+            self.trajectory.append(structure)
+        except ValueError:
+            self.trajectory = sst.Trajectory()
+            self.trajectory.append(structure)
+
+    def set_energy(self,energy):
+        """Sets the energy in Hartree of the last frame."""
+        if len(self.trajectory) > 0:
+            self.trajectory.energies[-1] = energy
+
+    def set_forces(self,forces):
+        """Sets the forces in Hartree/bohr of the last frame."""
+        forces = np.asarray(forces)
+        if len(self.trajectory) > 0 and forces.shape == self.trajectory.forces[-1].shape:
+            self.trajectory.forces[-1] = forces
+
+
+class SnapshotReader(TrajectoryReader):
+    """Reader for files that are rewritten with the current geometry at every step, e.g. geometry_opt.xml of exciting.
+
+Args:
+    - filename:     Path of the file.
+
+    - parse_file:   Function that returns the structure in a file given by its path.
+    """
+    def __init__(self,filename,parse_file):
+        self.parse_file = parse_file
+        super(SnapshotReader,self).__init__(filename)
+
+    def reset_state(self):
+        self.file_state = None
+
+    def update(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            if self.file_state is None:
+                return 'unchanged'
+            self.reset()
+            return 'reset'
+        file_state = (stat.st_mtime,stat.st_size)
+        if file_state == self.file_state:
+            return 'unchanged'
+        try:
+            structure = self.parse_file(self.filename)
+        except Exception:
+            # the file may be read while it is rewritten, it is parsed again at the next update
+            return 'unchanged'
+        self.file_state = file_state
+        self.add_frame(structure)
+        return 'appended'
+
+
+def float_row(line,n=3):
+    """Returns the first n numbers of line as an array or None if line does not start with n numbers."""
+    try:
+        return np.array([float(x) for x in line.split()[:n]]) if len(line.split()) >= n else None
+    except ValueError:
+        return None
@@ -3,31 +3,42 @@ from __future__ import division
 from __future__ import generators
 
 import os
-os.environ['ETS_TOOLKIT'] = 'qt4'
-from pyface.qt import QtGui, QtCore
-from traits.api import HasTraits, Instance, on_trait_change, Range, Bool, Button
+# headless_export sets the null toolkit before importing this module
+os.environ.setdefault('ETS_TOOLKIT', 'qt4')
+from traits.api import HasTraits, Instance, on_trait_change, Range, Bool, Button, Int
 from traitsui.api import View, Item, Group
 from mayavi.core.ui.api import MayaviScene, MlabSceneModel, \
     SceneEditor
 from tvtk.tools import visual
+from tvtk.api import tvtk
 import solid_state_tools as sst
+import kramers_kronig
 from mayavi.core.api import Engine
 import copy
 import numpy as np
 import matplotlib as mpl
-mpl.use('Qt4Agg')
-mpl.rcParams['backend.qt4']='PySide'
+if os.environ['ETS_TOOLKIT'] == 'null':
+    mpl.use('Agg')
+    QtCore = None
+else:
+    from pyface.qt import QtCore
+    mpl.use('Qt4Agg')
+    mpl.rcParams['backend.qt4']='PySide'
 from little_helpers import find_data_file
-from bisect import bisect
+from project_store import array_cache
+from collections import deque, OrderedDict
+import weakref
+from contextlib import contextmanager
+import logging
+import time
 # mpl.rc('font',**{'size': 22, 'family':'serif','serif':['Palatino']})
 # mpl.rc('text', usetex=True)
 
 mpl.rc('font',**{'size': 22})
 
 
-from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt4agg import NavigationToolbar2QT as NavigationToolbar
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import random
 
 bohr = 0.52917721
@@ -57,6 +68,70 @@ except IOError:
 colormap_list = sorted(s,key=str.lower)
 
 
+class RenderTimings(object):
+    """Keeps the build and render durations of the last max_entries batched scene updates.
+Functions in listeners are called with each new entry (name, build_time, render_time)."""
+    def __init__(self, max_entries=200):
+        self.entries = deque(maxlen=max_entries)
+        self.listeners = []
+
+    def add(self, name, build_time, render_time):
+        entry = (name, build_time, render_time)
+        self.entries.append(entry)
+        logging.debug('Scene update {0}: build {1:1.1f} ms, render {2:1.1f} ms'.format(name, build_time*1000, render_time*1000))
+        for listener in self.listeners:
+            listener(entry)
+
+
+render_timings = RenderTimings()
+
+
+@contextmanager
+def batched_render(scene, name):
+    """Suspends rendering of scene while the actors of a plot are built and renders once at the end.
+The durations of both steps are recorded in render_timings. Nested batches are merged into the outermost one.
+
+Args:
+    - scene:    MlabSceneModel that is updated.
+
+    - name:     Name of the update under which the timings are recorded.
+    """
+    if scene.disable_render:
+        yield
+        return
+    start = time.time()
+    scene.disable_render = True
+    try:
+        yield
+    finally:
+        build_end = time.time()
+        scene.disable_render = False
+        scene.render()
+        render_timings.add(name, build_end-start, time.time()-build_end)
+
+
+class InactiveTimer(object):
+    """Timer of the null toolkit. Headless rendering has no event loop, so it never fires."""
+    def start(self,interval=None):
+        pass
+
+    def stop(self):
+        pass
+
+    def isActive(self):
+        return False
+
+
+def scene_timer(callback,single_shot=False):
+    """Returns a QTimer that calls callback or an InactiveTimer for the null toolkit."""
+    if QtCore is None:
+        return InactiveTimer()
+    timer = QtCore.QTimer()
+    timer.setSingleShot(single_shot)
+    timer.timeout.connect(callback)
+    return timer
+
+
 def convert_to_greek(input):
     result = []
     for el in input:
@@ -137,12 +212,13 @@ class BrillouinVisualization(HasTraits):
         if self.crystal_structure is None:
             return
 
-        self.scene.mlab.clf(figure=self.scene.mayavi_scene)
+        with batched_render(self.scene,'brillouin window'):
+            self.scene.mlab.clf(figure=self.scene.mayavi_scene)
 
-        if self.k_path is not None:
-            self.plot_path()
+            if self.k_path is not None:
+                self.plot_path()
 
-        self.plot_brillouin_zone()
+            self.plot_brillouin_zone()
         self.picker = self.scene.mayavi_scene.on_mouse_pick(self.picker_callback)
         self.picker.tolerance = 0.01
 
@@ -152,56 +228,57 @@ class BrillouinVisualization(HasTraits):
         #     Arrow_From_A_to_B(0,0,0,*self.crystal_structure.inv_lattice_vectors[i,:],figure=self.scene.mayavi_scene)
 
     def plot_path(self):
-        if self.path_plot is not None:
-            self.path_plot.remove()
-            for text_plot in self.text_plots:
-                text_plot.remove()
+        with batched_render(self.scene,'k path'):
+            if self.path_plot is not None:
+                self.path_plot.remove()
+                for text_plot in self.text_plots:
+                    text_plot.remove()
 
-        if len(self.k_path) == 0:
-            self.path_plot = None
-            return
+            if len(self.k_path) == 0:
+                self.path_plot = None
+                return
 
-        n_path = len(self.k_path)
-        k_path_array = np.zeros((n_path,3))
+            n_path = len(self.k_path)
+            k_path_array = np.zeros((n_path,3))
 
-        for i in range(n_path):
-            k_path_array[i,:] = np.dot(self.crystal_structure.inv_lattice_vectors.T,self.k_path[i][0])
+            for i in range(n_path):
+                k_path_array[i,:] = np.dot(self.crystal_structure.inv_lattice_vectors.T,self.k_path[i][0])
 
-        self.path_plot = self.scene.mlab.plot3d(k_path_array[:,0],k_path_array[:,1],k_path_array[:,2], color=(0, 1, 0),reset_zoom=False, tube_radius=0.02, figure=self.scene.mayavi_scene)
-        # self.scene.mlab.points3d(k_path_array[[0,-1],0],k_path_array[[0,-1],1],k_path_array[[0,-1],2], scale_factor=.1,reset_zoom=False, figure=self.scene.mayavi_scene)
+            self.path_plot = self.scene.mlab.plot3d(k_path_array[:,0],k_path_array[:,1],k_path_array[:,2], color=(0, 1, 0),reset_zoom=False, tube_radius=0.02, figure=self.scene.mayavi_scene)
+            # self.scene.mlab.points3d(k_path_array[[0,-1],0],k_path_array[[0,-1],1],k_path_array[[0,-1],2], scale_factor=.1,reset_zoom=False, figure=self.scene.mayavi_scene)
 
-        labels = [point[1] for point in self.k_path]
-        self.text_plots = [None]*n_path
-        for i in range(n_path):
-            text_plot = self.scene.mlab.text3d(k_path_array[i,0], k_path_array[i,1], k_path_array[i,2],labels[i] ,scale=0.1, figure=self.scene.mayavi_scene)
-            self.text_plots[i] = text_plot
+            labels = [point[1] for point in self.k_path]
+            self.text_plots = [None]*n_path
+            for i in range(n_path):
+                text_plot = self.scene.mlab.text3d(k_path_array[i,0], k_path_array[i,1], k_path_array[i,2],labels[i] ,scale=0.1, figure=self.scene.mayavi_scene)
+                self.text_plots[i] = text_plot
 
     def plot_brillouin_zone(self,plot_connections=True):
+        with batched_render(self.scene,'brillouin zone'):
+            self.wpoints_plot = np.append(self.w_points,np.array([[0,0,0]]),axis=0)
+            # TODO find general way to make the center of facets points
+            # for i in [-1,1]:
+            #     for j in range(3):
+            #         self.wpoints_plot = np.append(self.wpoints_plot, np.array([i*0.5*self.crystal_structure.inv_lattice_vectors[j,:]]), axis=0)
 
-        self.wpoints_plot = np.append(self.w_points,np.array([[0,0,0]]),axis=0)
-        # TODO find general way to make the center of facets points
-        # for i in [-1,1]:
-        #     for j in range(3):
-        #         self.wpoints_plot = np.append(self.wpoints_plot, np.array([i*0.5*self.crystal_structure.inv_lattice_vectors[j,:]]), axis=0)
-
-        # self.scene.mlab.points3d(0.0, 0.0, 0.0, color=(0.7, 0.7, 0.7), scale_factor=.1, figure=self.scene.mayavi_scene)
-        self.plot_of_vertices = self.scene.mlab.points3d(self.wpoints_plot[:, 0], self.wpoints_plot[:, 1], self.wpoints_plot[:, 2], color=(0.7, 0.7, 0.7), scale_factor=.1,figure=self.scene.mayavi_scene)
-        self.glyph_points = self.plot_of_vertices.glyph.glyph_source.glyph_source.output.points.to_array()
+            # self.scene.mlab.points3d(0.0, 0.0, 0.0, color=(0.7, 0.7, 0.7), scale_factor=.1, figure=self.scene.mayavi_scene)
+            self.plot_of_vertices = self.scene.mlab.points3d(self.wpoints_plot[:, 0], self.wpoints_plot[:, 1], self.wpoints_plot[:, 2], color=(0.7, 0.7, 0.7), scale_factor=.1,figure=self.scene.mayavi_scene)
+            self.glyph_points = self.plot_of_vertices.glyph.glyph_source.glyph_source.output.points.to_array()
 
-        self.scene.mlab.triangular_mesh(self.w_points[:, 0], self.w_points[:, 1], self.w_points[:, 2], self.brillouin_edges,opacity=0.3,color=(0.5,0.5,0.5),tube_radius=2,figure=self.scene.mayavi_scene)
+            self.scene.mlab.triangular_mesh(self.w_points[:, 0], self.w_points[:, 1], self.w_points[:, 2], self.brillouin_edges,opacity=0.3,color=(0.5,0.5,0.5),tube_radius=2,figure=self.scene.mayavi_scene)
 
-        # if plot_connections:
-        #     for i, connection in enumerate(self.brillouin_edges):
-        #         for con in connection:
-        #             bond = [i, con]
-        #             self.scene.mlab.plot3d(self.w_points[bond, 0], self.w_points[bond, 1], self.w_points[bond, 2],figure=self.scene.mayavi_scene,tube_radius=0.01)
+            # if plot_connections:
+            #     for i, connection in enumerate(self.brillouin_edges):
+            #         for con in connection:
+            #             bond = [i, con]
+            #             self.scene.mlab.plot3d(self.w_points[bond, 0], self.w_points[bond, 1], self.w_points[bond, 2],figure=self.scene.mayavi_scene,tube_radius=0.01)
 
-        self.plot_unit_vectors()
+            self.plot_unit_vectors()
 
-        self.outline = self.scene.mlab.outline(line_width=3,figure=self.scene.mayavi_scene)
-        self.outline.outline_mode = 'cornered'
+            self.outline = self.scene.mlab.outline(line_width=3,figure=self.scene.mayavi_scene)
+            self.outline.outline_mode = 'cornered'
 
-        self.outline.bounds = ( - 0.001, + 0.001, - 0.001,  + 0.001,- 0.001,  + 0.001)
+            self.outline.bounds = ( - 0.001, + 0.001, - 0.001,  + 0.001,- 0.001,  + 0.001)
 
     def picker_callback(self,picker):
         """ Picker callback: this get called when on pick events.
@@ -228,6 +305,27 @@ class BrillouinVisualization(HasTraits):
                 self.parent.set_path(self.k_path)
 
 
+def unit_cell_grid(lattice_vectors,repeat):
+    """Returns the vertices and the unique edges of a grid of repeat[0] x repeat[1] x repeat[2] unit cells.
+
+Vertex (i,j,k) has the index (i*(repeat[1]+1)+j)*(repeat[2]+1)+k, so every edge is found once by pairing each vertex with
+its neighbour one step further along one lattice vector.
+
+Returns:
+    - points:       Numpy array of shape ((repeat[0]+1)*(repeat[1]+1)*(repeat[2]+1),3) with the cartesian vertex coordinates.
+
+    - connections:  Integer numpy array of shape (n_edges,2) with the vertex indices of the edges.
+    """
+    shape = tuple(n+1 for n in repeat)
+    index = np.arange(np.prod(shape)).reshape(shape)
+    points = np.dot(np.indices(shape).reshape(3,-1).T,lattice_vectors)
+
+    connections = [np.stack([index[:-1,:,:].ravel(),index[1:,:,:].ravel()],axis=1),
+                   np.stack([index[:,:-1,:].ravel(),index[:,1:,:].ravel()],axis=1),
+                   np.stack([index[:,:,:-1].ravel(),index[:,:,1:].ravel()],axis=1)]
+    return points,np.concatenate(connections)
+
+
 class StructureVisualization(HasTraits):
     n_x    = Range(1, 10, 1, mode='spinner')#)
     n_y  = Range(1, 10, 1,  mode='spinner')#mode='spinner')
@@ -238,8 +336,14 @@ class StructureVisualization(HasTraits):
     show_bonds = Bool(True)
     show_atoms = Bool(True)
 
+    # playback of trajectories
+    last_frame = Int(0)
+    frame = Range(0, 'last_frame', mode='slider')
+    play_but = Button(label='Play/Pause')
+
     view = View(Item('scene', editor=SceneEditor(scene_class=MayaviScene),
                      height=450, width=500, show_label=False),Group('_', 'n_x', 'n_y', 'n_z','show_unitcell','show_bonds','show_atoms',orientation='horizontal'),
+                Group(Item('frame'),Item('play_but',show_label=False),orientation='horizontal',visible_when='last_frame > 0'),
                 resizable=True, # We need this to resize with the parent widget
                 )
 
@@ -250,8 +354,35 @@ class StructureVisualization(HasTraits):
         self.crystal_structure = crystal_structure
         self.density_plotted = None
         self.cp = None
+        self.density_replicas = []
+
+        # Densities with more grid points than this are first shown on a coarser level of the resolution pyramid.
+        # The full grid is contoured once no new plot was requested for refine_delay ms.
+        self.interactive_grid_points = 48**3
+        self.refine_delay = 500
+        self.refine_timer = scene_timer(self.refine_density_plot,single_shot=True)
+        self.last_density_options = None
+
+        # The displayed structure is kept in persistent sources: one glyph per species and one line set each for
+        # the bonds and the unit cell. update_plot only changes the data of these sources.
+        self.atom_glyphs = {}
+        self.line_sets = {}
+
+        # A trajectory is shown frame by frame through the same sources. The bonds of the frames are taken from a
+        # neighbor list. Frames are rendered without anti-aliasing, which is added once the frame stays for still_delay ms.
+        self.trajectory = None
+        self.neighbor_list = sst.NeighborList()
+        self.frame_interval = 40
+        self.playback_timer = scene_timer(self.play_next_frame)
+        self.still_delay = 300
+        self.still_timer = scene_timer(lambda: self.update_plot(keep_view=True),single_shot=True)
 
     def clear_plot(self):
+        self.refine_timer.stop()
+        self.remove_density_replicas()
+        self.cp = None
+        self.atom_glyphs = {}
+        self.line_sets = {}
         self.scene.mlab.clf(figure=self.scene.mayavi_scene)
 
     @on_trait_change('scene.activated,show_unitcell,show_bonds,show_atoms,n_x,n_y,n_z')
@@ -260,102 +391,240 @@ class StructureVisualization(HasTraits):
             keep_view = kwargs['keep_view']
         else:
             keep_view = False
-        if self.crystal_structure is None:
+        if self.crystal_structure is None and self.trajectory is None:
             return
-        self.scene.anti_aliasing_frames = 20
-        # We can do normal mlab calls on the embedded scene.
-        self.scene.mlab.clf(figure=self.scene.mayavi_scene)
-        repeat = [self.n_x,self.n_y,self.n_z]
+        with batched_render(self.scene,'structure'):
+            self.scene.anti_aliasing_frames = kwargs.get('anti_aliasing_frames',20)
+            self.clear_density_plot()
+            repeat = [self.n_x,self.n_y,self.n_z]
 
-        if keep_view:
-            cur_view = self.scene.mlab.view(figure=self.scene.mayavi_scene)
-            cur_roll = self.scene.mlab.roll(figure=self.scene.mayavi_scene)
+            # the camera is left alone while the scene is only updated, it is only reset when building from scratch
+            reset_view = not keep_view and len(self.atom_glyphs) == 0 and len(self.line_sets) == 0
+            abs_coord_atoms = self.absolute_coordinates(repeat=repeat)
 
-        if self.show_atoms:
-            self.plot_atoms(repeat=repeat)
+            if self.show_atoms:
+                self.plot_atoms(repeat=repeat,abs_coord_atoms=abs_coord_atoms)
+            else:
+                self.remove_atoms()
 
-        if self.show_bonds:
-            self.plot_bonds(repeat=repeat)
+            if self.show_bonds:
+                self.plot_bonds(repeat=repeat,abs_coord_atoms=abs_coord_atoms)
+            else:
+                self.remove_line_set('bonds')
 
-        if self.show_unitcell:
-            self.plot_unit_cell(repeat=repeat)
+            if self.show_unitcell:
+                self.plot_unit_cell(repeat=repeat)
+            else:
+                self.remove_line_set('unit cell')
+
+            if reset_view:
+                self.scene.reset_zoom()
+
+    def set_trajectory(self,trajectory,frame=-1):
+        """Shows the frames of trajectory, starting with frame. With trajectory None crystal_structure is shown again."""
+        self.stop_playback()
+        self.trajectory = None
+        self.frame = 0
+        if trajectory is None or len(trajectory) == 0:
+            self.last_frame = 0
+            return
+        self.neighbor_list = sst.NeighborList()
+        frame = frame % len(trajectory)
+        self.crystal_structure = trajectory[frame]
+        self.trajectory = trajectory
+        self.last_frame = len(trajectory)-1
+        self.frame = frame
+
+    @on_trait_change('frame')
+    def show_frame(self):
+        if self.trajectory is None:
+            return
+        self.still_timer.start(self.still_delay)
+        self.update_plot(keep_view=True,anti_aliasing_frames=0)
+
+    @on_trait_change('play_but')
+    def toggle_playback(self):
+        if self.playback_timer.isActive():
+            self.stop_playback()
+        elif self.trajectory is not None:
+            self.playback_timer.start(self.frame_interval)
+
+    def stop_playback(self):
+        self.playback_timer.stop()
+
+    def play_next_frame(self):
+        if self.trajectory is None:
+            self.stop_playback()
+            return
+        self.frame = (self.frame+1) % (self.last_frame+1)
+
+    def absolute_coordinates(self,repeat=[1,1,1]):
+        """Returns the cartesian coordinates and species of the displayed structure, which is the current frame if a
+trajectory is shown."""
+        if self.trajectory is not None:
+            return self.trajectory.absolute_coordinates(self.frame,repeat=repeat)
+        return self.crystal_structure.calc_absolute_coordinates(repeat=repeat)
+
+    def displayed_lattice_vectors(self):
+        """Returns the unit cell of the displayed structure or None for molecules."""
+        if self.trajectory is not None:
+            return self.trajectory.lattice_vectors[self.frame] if self.trajectory.periodic else None
+        if type(self.crystal_structure) is sst.MolecularStructure:
+            return None
+        return self.crystal_structure.lattice_vectors
 
-        if keep_view:
-            self.scene.mlab.view(azimuth=cur_view[0],elevation=cur_view[1],distance=cur_view[2],focalpoint=cur_view[3],figure=self.scene.mayavi_scene)
-            self.scene.mlab.roll(cur_roll,figure=self.scene.mayavi_scene)
+    def plot_line_set(self,points,connections,scalars=None,tube_radius=0.05,tube_sides=6):
+        """Renders the lines between the point pairs in connections as tubes of a single polydata with one actor.
 
-    def check_if_line_exists(self,p1,p2,list_of_lines):
-        for line in list_of_lines:
-            x1 = line[0]
-            x2 = line[1]
-            norm1 = np.linalg.norm(p1-x1)+np.linalg.norm(p2-x2)
-            norm2 = np.linalg.norm(p1-x2)+np.linalg.norm(p2-x1)
-            if norm1 < 0.05 or norm2 < 0.05:
-                return True
-        return False
+Args:
+    - points:       Numpy array of shape (n,3) with the cartesian coordinates of the points.
 
-    def plot_unit_cell(self, repeat=[1, 1, 1]):
-        if type(self.crystal_structure) is sst.MolecularStructure:
-            return
-        cell = self.crystal_structure.lattice_vectors
-        existing_lines = []
+    - connections:  Integer numpy array of shape (m,2). Each row holds the indices of the end points of a line.
 
-        for j1 in range(repeat[0]):
-            for j2 in range(repeat[1]):
-                for j3 in range(repeat[2]):
-                    offset = j1 * cell[0, :] + j2 * cell[1, :] + j3 * cell[2, :]
-                    self.plot_single_unit_cell(offset)
-
-    def plot_single_unit_cell(self,offset):
-        cell = self.crystal_structure.lattice_vectors
-        a1 = cell[0,:]
-        a2 = cell[1,:]
-        a3 = cell[2,:]
-
-        p1 = offset
-        p2 = offset+a1
-        p3 = offset+a2
-        p4 = offset+a3
-        p5 = offset+a1+a2
-        p6 = offset+a1+a3
-        p7 = offset+a2+a3
-        p8 = offset+a1+a2+a3
-
-        coords = np.array([p1,p2,p5,p3,p1,p4,p6,p8,p7,p4,p6,p2,p5,p8,p7,p3])
-        self.scene.mlab.plot3d(coords[:,0],coords[:,1],coords[:,2], tube_radius=0.05,figure=self.scene.mayavi_scene)
-
-    def plot_atoms(self, repeat=[1, 1, 1]):
-        abs_coord_atoms = self.crystal_structure.calc_absolute_coordinates(repeat=repeat)
-        species = set(abs_coord_atoms[:,3].astype(np.int))
-        n_species = len(species)
-        n_atoms = abs_coord_atoms.shape[0]
+Keyword args:
+    - scalars:      Numpy array of shape (n,) with point scalars that are used for coloring.
+
+    - tube_radius:  Radius of the tubes.
+
+    - tube_sides:   Number of sides of the tubes.
 
+Returns:
+    - surface:      The mayavi surface module of the tubes.
+        """
+        mlab = self.scene.mlab
+        if scalars is None:
+            source = mlab.pipeline.scalar_scatter(points[:,0],points[:,1],points[:,2],figure=self.scene.mayavi_scene)
+        else:
+            source = mlab.pipeline.scalar_scatter(points[:,0],points[:,1],points[:,2],scalars,figure=self.scene.mayavi_scene)
+        source.mlab_source.dataset.lines = connections
+        source.update()
+        tubes = mlab.pipeline.tube(source,tube_radius=tube_radius,tube_sides=tube_sides)
+        surface = mlab.pipeline.surface(tubes,figure=self.scene.mayavi_scene)
+        return source,surface
+
+    def update_line_set(self,name,key,points,connections,scalars=None,tube_radius=0.05,tube_sides=6):
+        """Shows the line set name with the given points and connections. An existing line set of that name gets
+its data replaced, otherwise it is created with plot_line_set. key is the data the line set was built from
+and is used by line_set_is_current to skip updates. Returns the surface module of the line set."""
+        if name in self.line_sets:
+            source,surface,old_key,old_connections = self.line_sets[name]
+            if np.array_equal(old_connections,connections):
+                # same lines, e.g. in the next frame of a trajectory: only the point data is changed in place
+                if scalars is None:
+                    source.mlab_source.set(x=points[:,0],y=points[:,1],z=points[:,2])
+                else:
+                    source.mlab_source.set(x=points[:,0],y=points[:,1],z=points[:,2],scalars=scalars)
+            else:
+                if scalars is None:
+                    source.mlab_source.reset(x=points[:,0],y=points[:,1],z=points[:,2])
+                else:
+                    source.mlab_source.reset(x=points[:,0],y=points[:,1],z=points[:,2],scalars=scalars)
+                source.mlab_source.dataset.lines = connections
+                source.update()
+        else:
+            source,surface = self.plot_line_set(points,connections,scalars=scalars,tube_radius=tube_radius,tube_sides=tube_sides)
+        self.line_sets[name] = (source,surface,key,connections)
+        return surface
+
+    def line_set_is_current(self,name,key):
+        return name in self.line_sets and np.array_equal(self.line_sets[name][2],key)
+
+    def remove_line_set(self,name):
+        if name in self.line_sets:
+            source,surface,key,connections = self.line_sets.pop(name)
+            source.remove()
+
+    def plot_unit_cell(self, repeat=[1, 1, 1]):
+        with batched_render(self.scene,'unit cell'):
+            cell = self.displayed_lattice_vectors()
+            if cell is None:
+                self.remove_line_set('unit cell')
+                return
+            key = np.append(cell.ravel(),repeat)
+            if self.line_set_is_current('unit cell',key):
+                return
+            points,connections = unit_cell_grid(cell,repeat)
+            self.update_line_set('unit cell',key,points,connections,tube_radius=0.05,tube_sides=6)
+
+    def plot_atoms(self, repeat=[1, 1, 1], abs_coord_atoms=None):
+        """Shows the atoms with one glyph per species. Glyphs of species that are already displayed get their
+points replaced in place, glyphs are only created or removed when the set of species changes."""
+        with batched_render(self.scene,'atoms'):
+            if abs_coord_atoms is None:
+                abs_coord_atoms = self.absolute_coordinates(repeat=repeat)
+            atom_species = abs_coord_atoms[:,3].astype(np.int)
+            species = set(atom_species)
+
+            for specie in set(self.atom_glyphs.keys())-species:
+                self.remove_atoms(specie)
+
+            for specie in species:
+                sub_coords = abs_coord_atoms[atom_species == specie,:3]
+
+                if specie in self.atom_glyphs:
+                    glyph,displayed_coords = self.atom_glyphs[specie]
+                    if np.array_equal(displayed_coords,sub_coords):
+                        continue
+                    elif displayed_coords.shape == sub_coords.shape:
+                        glyph.mlab_source.set(x=sub_coords[:,0],y=sub_coords[:,1],z=sub_coords[:,2])
+                    else:
+                        glyph.mlab_source.reset(x=sub_coords[:,0],y=sub_coords[:,1],z=sub_coords[:,2])
+                else:
+                    atom_size = 0.4*np.log(specie)+0.6
+                    try:
+                        atomic_color = colors[specie]
+                    except KeyError:
+                        atomic_color = (0.8,0.8,0.8)
+                    glyph = self.scene.mlab.points3d(sub_coords[:,0],sub_coords[:,1],sub_coords[:,2],
+                                                     scale_factor=atom_size,resolution=26,
+                                                     color=atomic_color,figure=self.scene.mayavi_scene)
+                self.atom_glyphs[specie] = (glyph,sub_coords)
+
+    def remove_atoms(self,specie=None):
+        """Removes the glyph of specie or of all species if specie is None."""
+        if specie is None:
+            species = list(self.atom_glyphs.keys())
+        else:
+            species = [specie]
         for specie in species:
-            species_mask = abs_coord_atoms[:,3].astype(np.int) == specie
-            sub_coords = abs_coord_atoms[species_mask,:]
-
-            cov_radius = cov_radii[specie]
-            atom_size = 0.4*np.log(specie)+0.6
-            try:
-                atomic_color = colors[specie]
-            except KeyError:
-                atomic_color = (0.8,0.8,0.8)
-            self.scene.mlab.points3d(sub_coords[:,0],sub_coords[:,1],sub_coords[:,2],
-                                     scale_factor=atom_size,resolution=26,
-                                     color=atomic_color,figure=self.scene.mayavi_scene)
+            glyph,displayed_coords = self.atom_glyphs.pop(specie)
+            glyph.mlab_source.m_data.remove()
 
     def clear_density_plot(self):
+        self.refine_timer.stop()
+        self.remove_density_replicas()
         if self.cp is not None:
-            pass
+            self.cp.remove()
+        self.cp = None
+
+    def plot_density(self,ks_density,contours=10,transparent=True,colormap='hot',opacity=0.5,level_of_detail=None):
+        """Plots isosurfaces of ks_density.
+
+For periodic densities the isosurface is extracted once on the unit cell grid and the other images of the
+repeat are additional actors that share this geometry and are shifted by lattice vectors.
+
+Keyword args:
+    - level_of_detail:  Level of the resolution pyramid, every 2**level_of_detail grid point is used.
+                        None (default) picks a coarse level for large grids and renders the full grid
+                        once the user stopped adjusting.
+        """
+        self.clear_density_plot()
 
-    def plot_density(self,ks_density,contours=10,transparent=True,colormap='hot',opacity=0.5):
         repeat = [self.n_x, self.n_y, self.n_z]
+        periodic = type(ks_density) is sst.KohnShamDensity
+        if not periodic and type(ks_density) is not sst.MolecularDensity:
+            raise ValueError('Invalid type for density')
 
         cur_view = self.scene.mlab.view()
         cur_roll = self.scene.mlab.roll()
 
-        dens = ks_density.density
-        dens_plot = np.tile(dens,repeat)
+        dens = array_cache.get(ks_density.density)
+        if level_of_detail is None:
+            level_of_detail = self.interactive_level_of_detail(dens.shape)
+            refine = level_of_detail > 0
+        else:
+            refine = False
+        dens_plot, fractions = self.density_pyramid_level(dens, level_of_detail, periodic=periodic)
 
         if type(contours) == int:
             color = None
@@ -369,30 +638,70 @@ class StructureVisualization(HasTraits):
 
         polydata = self.cp.actor.actors[0].mapper.input
         pts = np.array(polydata.points) - 1
+        frac_pts = np.zeros(pts.shape)
+        for i in range(3):
+            frac_pts[:,i] = np.interp(pts[:,i], np.arange(len(fractions[i])), fractions[i])
 
-        if type(ks_density) is sst.KohnShamDensity:
+        if periodic:
             unit_cell = self.crystal_structure.lattice_vectors
-            # Transform the points to the unit cell:
-            larger_cell= np.zeros((3,3))
-            larger_cell[0,:]=unit_cell[0,:]*repeat[0]
-            larger_cell[1,:]=unit_cell[1,:]*repeat[1]
-            larger_cell[2,:]=unit_cell[2,:]*repeat[2]
-
-            polydata.points = np.dot(pts, larger_cell / np.array(dens_plot.shape)[:, np.newaxis])
-        elif type(ks_density) is sst.MolecularDensity:
+            polydata.points = np.dot(frac_pts, unit_cell)
+            self.replicate_density(unit_cell, repeat)
+        else:
             lattice_vecs = ks_density.grid_vectors
             origin = ks_density.origin
-            polydata.points = np.dot(pts, lattice_vecs / np.array(dens_plot.shape)[:, np.newaxis])+origin
-
-        else:
-            raise ValueError('Invalid type for density')
-
+            polydata.points = np.dot(frac_pts, lattice_vecs)+origin
 
         # self.scene.mlab.view(distance='auto')
         self.scene.mlab.view(azimuth=cur_view[0],elevation=cur_view[1],distance=cur_view[2],focalpoint=cur_view[3],figure=self.scene.mayavi_scene)
         self.scene.mlab.roll(cur_roll,figure=self.scene.mayavi_scene)
         self.density_plotted = ks_density
 
+        self.last_density_options = {'contours': contours, 'transparent': transparent, 'colormap': colormap,
+                                     'opacity': opacity}
+        if refine:
+            self.refine_timer.start(self.refine_delay)
+
+    def refine_density_plot(self):
+        if self.density_plotted is None or self.last_density_options is None:
+            return
+        self.plot_density(self.density_plotted, level_of_detail=0, **self.last_density_options)
+
+    def interactive_level_of_detail(self, shape):
+        level = 0
+        while np.prod([-(-n // 2**level) for n in shape]) > self.interactive_grid_points:
+            level += 1
+        return level
+
+    def density_pyramid_level(self, dens, level, periodic=True):
+        """Returns a strided view of dens with every 2**level point and the fractional coordinates
+of the grid points along each axis. For periodic densities the first plane is appended at the end of
+every axis so that the isosurfaces of neighbouring cells join."""
+        step = 2**level
+        dens_level = dens[::step,::step,::step]
+        fractions = [np.arange(0, n, step) / n for n in dens.shape]
+        if periodic:
+            dens_level = np.pad(dens_level, [(0, 1)] * 3, mode='wrap')
+            fractions = [np.append(fraction, 1.0) for fraction in fractions]
+        return dens_level, fractions
+
+    def replicate_density(self, unit_cell, repeat):
+        actor = self.cp.actor.actors[0]
+        for j1 in range(repeat[0]):
+            for j2 in range(repeat[1]):
+                for j3 in range(repeat[2]):
+                    if j1 == j2 == j3 == 0:
+                        continue
+                    offset = j1 * unit_cell[0, :] + j2 * unit_cell[1, :] + j3 * unit_cell[2, :]
+                    replica = tvtk.Actor(mapper=actor.mapper, property=actor.property, position=offset)
+                    self.density_replicas.append(replica)
+        if len(self.density_replicas) > 0:
+            self.scene.add_actors(self.density_replicas)
+
+    def remove_density_replicas(self):
+        if len(self.density_replicas) > 0:
+            self.scene.remove_actors(self.density_replicas)
+            self.density_replicas = []
+
 
     # def bonds_to_paths(self,bonds):
     # """See here my failed attempt on graph theory. Seems there is a reason that there is a mathematical field to it. Who would have thought?"""
@@ -438,537 +747,281 @@ class StructureVisualization(HasTraits):
 
 
 
-    def plot_bonds(self,repeat=[1,1,1]):
-        abs_coord_atoms = self.crystal_structure.calc_absolute_coordinates(repeat=repeat)
-        bonds = self.crystal_structure.find_bonds(abs_coord_atoms)
-
-        for bond in bonds:
-            i1 = bond[0]
-            i2 = bond[1]
-            p1 = abs_coord_atoms[i1,:3]
-            p2 = abs_coord_atoms[i2,:3]
-            self.scene.mlab.plot3d([p1[0], p2[0]], [p1[1], p2[1]], [p1[2], p2[2]], tube_radius=0.125,tube_sides=18,figure=self.scene.mayavi_scene)
-
-
-class OpticalSpectrumVisualization(QtGui.QWidget):
-    def __init__(self, parent=None):
-        super(OpticalSpectrumVisualization, self).__init__()
-        self.first_plot_bool = True
-        self.last_optical_spectrum = None
-        # a figure instance to plot on
-        self.figure = plt.figure(1)
-        plt.close(plt.figure(1))
-        self.ax = None
-
-        self.canvas = FigureCanvas(self.figure)
-
-        self.toolbar = NavigationToolbar(self.canvas, self)
-
-        # color = self.palette().color(QtGui.QPalette.Base)
-        # self.figure.patch.set_facecolor([color.red()/255,color.green()/255,color.blue()/255])
-        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236 / 255])
-        # self.figure.patch.set_alpha(1.0)
-        # self.figure.patch.set_facecolor('blue')
-
-        layout = QtGui.QVBoxLayout()
-        layout.addWidget(self.toolbar)
-        layout.addWidget(self.canvas)
-
-        option_widget = QtGui.QWidget()
-        option_widget.setFixedHeight(60)
-        option_layout = QtGui.QHBoxLayout(option_widget)
-        option_layout.setAlignment(QtCore.Qt.AlignLeft)
-        layout.addWidget(option_widget)
-        from main import EntryWithLabel
-
-        self.select_epsilon_cb =  QtGui.QComboBox(self)
-        option_layout.addWidget(self.select_epsilon_cb)
-        self.select_epsilon_cb.addItem('Angular mean')
-        self.select_epsilon_cb.addItem(u"ε_11")
-        self.select_epsilon_cb.addItem(u"ε_22")
-        self.select_epsilon_cb.addItem(u"ε_33")
-
-        self.select_epsilon_cb.setCurrentIndex(0)
-        self.select_epsilon_cb.currentIndexChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
-
-        self.imaginary_checkbox = QtGui.QCheckBox('Imag',self)
-        option_layout.addWidget(self.imaginary_checkbox)
-        self.imaginary_checkbox.toggle()
-        self.imaginary_checkbox.stateChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
-
-        self.real_checkbox = QtGui.QCheckBox('Real',self)
-        option_layout.addWidget(self.real_checkbox)
-        self.real_checkbox.stateChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
-
-        width_text = 70
-        width_label = 40
-
-        self.Emin_entry = EntryWithLabel(option_widget,'Emin',width_text=width_text,width_label=width_label)
-        self.Emin_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
-        option_layout.addWidget(self.Emin_entry)
-
-        self.Emax_entry = EntryWithLabel(option_widget,'Emax',width_text=width_text,width_label=width_label)
-        self.Emax_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
-        option_layout.addWidget(self.Emax_entry)
-
-        self.eps_min_entry = EntryWithLabel(option_widget,u"ε min",width_text=width_text,width_label=width_label)
-        self.eps_min_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
-        option_layout.addWidget(self.eps_min_entry)
-
-        self.eps_max_entry = EntryWithLabel(option_widget,u"ε max",width_text=width_text,width_label=width_label)
-        self.eps_max_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
-        option_layout.addWidget(self.eps_max_entry)
-
-        self.broadening_entry = EntryWithLabel(option_widget,u"Γ",width_text=width_text,width_label=width_label)
-        self.broadening_entry.connect_editFinished(lambda: self.plot(self.last_optical_spectrum[0],name_list=self.last_optical_spectrum[1]))
-        option_layout.addWidget(self.broadening_entry)
-
-        self.broadening_mode_cb = QtGui.QComboBox(self)
-        option_layout.addWidget(self.broadening_mode_cb)
-        self.broadening_mode_cb.addItem('Lorentzian')
-        self.broadening_mode_cb.addItem('Gaussian')
-        self.broadening_mode_cb.addItem('None')
-
-        self.broadening_mode_cb.setCurrentIndex(0)
-        self.broadening_mode_cb.currentIndexChanged.connect(lambda: self.plot(self.last_optical_spectrum[0], name_list=self.last_optical_spectrum[1]))
-        self.broadening_mode_cb.setMaximumWidth(150)
-
-        self.setLayout(layout)
-        self.show()
-
-    def clear_plot(self):
-        if not self.first_plot_bool:
-            self.figure.clf()
-            self.first_plot_bool = True
-            self.canvas.draw()
-
-    def read_entries(self):
-        try:
-            Emin = float(self.Emin_entry.get_text())
-        except Exception:
-            Emin = None
-
-        try:
-            Emax = float(self.Emax_entry.get_text())
-        except Exception:
-            Emax = None
-
-        try:
-            eps_max = float(self.eps_max_entry.get_text())
-        except Exception:
-            eps_max = None
-
-        try:
-            eps_min = float(self.eps_min_entry.get_text())
-        except Exception:
-            eps_min = None
-
-        try:
-            gamma = float(self.broadening_entry.get_text())
-        except Exception:
-            gamma = None
-
-        broaden_mode = self.broadening_mode_cb.currentText().lower()
-
-        return {'Emin':Emin,'Emax':Emax,'eps min':eps_min,'eps max':eps_max,'Gamma':gamma,'broaden mode':broaden_mode}
-
-    def plot(self, optical_spectrum_list,*args,**kwargs):
-        name_list = kwargs.pop('name_list',None)
-        if optical_spectrum_list is None:
-            return
-
-        if type(optical_spectrum_list) is not list:
-            optical_spectrum_list = [optical_spectrum_list]
-
-        self.last_optical_spectrum = [optical_spectrum_list,name_list]
-        if self.first_plot_bool:
-            self.ax = self.figure.add_subplot(111)
-            self.ax.format_coord = lambda x, y: u'E = {0:1.2f} eV, ε = {1:1.3f}'.format(x,y)
-        self.ax.cla()
-
-        entry_values = self.read_entries()
-        Emin = entry_values['Emin']
-        Emax= entry_values['Emax']
-        eps_min = entry_values['eps min']
-        eps_max =entry_values['eps max']
-        gamma = entry_values['Gamma']
-        broaden_mode = entry_values['broaden mode']
-
-        if Emin is not None:
-            self.ax.set_xlim(left=Emin)
-        else:
-            self.ax.set_xlim(left=optical_spectrum_list[0].energy.min())
-
-        if Emax is not None:
-            self.ax.set_xlim(right=Emax)
-        else:
-            self.ax.set_xlim(right=optical_spectrum_list[0].energy.max())
-
-        if eps_min is not None:
-            self.ax.set_ylim(bottom=eps_min)
-        if eps_max is not None:
-            self.ax.set_ylim(top=eps_max)
-
-        if name_list is None:
-            name_list = len(optical_spectrum_list)*['']
-
-        handles = []
-        for optical_spectrum,name in zip(optical_spectrum_list,name_list):
-
-            if self.imaginary_checkbox.checkState():
-                E_plot = optical_spectrum.energy
-
-                cur_index_eps = self.select_epsilon_cb.currentIndex()
-                if cur_index_eps == 0:
-                    epsilon = optical_spectrum.epsilon2
-                elif cur_index_eps == 1:
-                    epsilon = optical_spectrum.epsilon2_11
-                elif cur_index_eps == 2:
-                    epsilon = optical_spectrum.epsilon2_22
-                elif cur_index_eps == 3:
-                    epsilon = optical_spectrum.epsilon2_33
-
-                if gamma is None:
-                    epsilon_plot = epsilon
-                else:
-                    E_plot,epsilon_plot = self.broaden_spectrum(E_plot,epsilon,width=gamma,mode=broaden_mode)
-
-                p, = self.ax.plot(E_plot, epsilon_plot, linewidth=2,label=name+'_imag')
-                handles.append(p)
-
-            if self.real_checkbox.checkState():
-                E_plot = optical_spectrum.energy
-
-                cur_index_eps = self.select_epsilon_cb.currentIndex()
-                if cur_index_eps == 0:
-                    epsilon = optical_spectrum.epsilon1
-                elif cur_index_eps == 1:
-                    epsilon = optical_spectrum.epsilon1_11
-                elif cur_index_eps == 2:
-                    epsilon = optical_spectrum.epsilon1_22
-                elif cur_index_eps == 3:
-                    epsilon = optical_spectrum.epsilon1_33
-
-                if gamma is None:
-                    epsilon_plot = epsilon
-                else:
-                    E_plot,epsilon_plot = self.broaden_spectrum(E_plot,epsilon,width=gamma,mode=broaden_mode)
-
-                p, = self.ax.plot(E_plot, epsilon_plot, linewidth=2,label=name+'_real')
-                handles.append(p)
-
-
-        self.ax.set_xlabel('Energy [eV]')
-        self.ax.set_ylabel(r'Dielectric function $\varepsilon(\omega)$')
-
-        if name_list is not None and len(handles)>1:
-            legend = self.ax.legend(loc='best',fancybox=True,framealpha=0.9)
-            legend_frame = legend.get_frame()
-            legend_frame.set_facecolor([0.95,0.95,0.95])
-            legend_frame.set_linewidth(0)
-
-
-        if self.first_plot_bool:
-            self.first_plot_bool = False
-            self.figure.tight_layout()
-        self.canvas.draw()
-
-    def broaden_spectrum(self,energy,epsilon,width,mode='lorentzian'):
-
-        if mode == 'lorentzian':
-            def broaden_function(x, width):
-                return width**2/(x**2+width**2)
-        elif mode == 'gaussian':
-            def broaden_function(x, width):
-                return np.exp(-x ** 2 / (2 * width ** 2))
-        elif mode == 'none':
-            return energy,epsilon
-
-        E_range = energy.max() - energy.min()
-        dx = E_range / len(energy)
-
-        conv_range = 50*width
-        gx = np.arange(-conv_range/2, conv_range/2, dx)
-        broadenarray = broaden_function(gx, width)
-        broadenarray = broadenarray / np.sum(broadenarray)
-
-        epsilon_out = np.convolve(epsilon, broadenarray, mode="full")
-        energy_out = np.linspace(energy.min()-conv_range/2,energy.max()+conv_range/2,len(epsilon_out))
-
-        return energy_out,epsilon_out
-
-
-class BandStructureVisualization(QtGui.QWidget):
-    def __init__(self, parent=None):
-        super(BandStructureVisualization, self).__init__()
-        self.first_plot_bool = True
-        # a figure instance to plot on
-        self.figure = plt.figure(1)
-        plt.close(plt.figure(1))
-        self.ax = None
-        self.last_bandstructure = None
-        self.canvas = FigureCanvas(self.figure)
-
-        self.toolbar = NavigationToolbar(self.canvas, self)
-
-        # color = self.palette().color(QtGui.QPalette.Base)
-        # self.figure.patch.set_facecolor([color.red() / 255, color.green() / 255, color.blue() / 255])
-        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236/ 255])
-
-        layout = QtGui.QVBoxLayout()
-        layout.addWidget(self.toolbar)
-        layout.addWidget(self.canvas)
-
-        option_widget = QtGui.QWidget()
-        option_widget.setFixedHeight(60)
-        option_layout = QtGui.QHBoxLayout(option_widget)
-        option_layout.setAlignment(QtCore.Qt.AlignLeft)
-        layout.addWidget(option_widget)
-        from main import EntryWithLabel
-        self.Emin_entry = EntryWithLabel(option_widget,'Emin')
-        self.Emin_entry.connect_editFinished(lambda: self.plot(self.last_bandstructure))
-        option_layout.addWidget(self.Emin_entry)
-        self.Emax_entry = EntryWithLabel(option_widget,'Emax')
-        self.Emax_entry.connect_editFinished(lambda: self.plot(self.last_bandstructure))
-        option_layout.addWidget(self.Emax_entry)
-
-        # layout.addWidget(self.button)
-        self.setLayout(layout)
-        self.show()
-
-    def clear_plot(self):
-        if not self.first_plot_bool:
-            self.ax.cla()
-            self.canvas.draw()
-
-    def plot(self,band_structure,*args,**kwargs):
-        if band_structure is None:
-            return
-        if type(band_structure) is list:
-            band_structure = band_structure[0]
-        self.last_bandstructure = band_structure
-        if self.first_plot_bool:
-            self.ax = self.figure.add_subplot(111)
-        if type(band_structure) is sst.EnergyDiagram:
-            self.plot_energy_diagram(band_structure)
-        elif type(band_structure) is sst.BandStructure:
-            self.plot_bandstructure(band_structure)
-
-        if self.first_plot_bool:
-            self.first_plot_bool = False
-            self.figure.tight_layout()
-
-        try:
-            Emin = float(self.Emin_entry.get_text())
-        except Exception:
-            Emin = None
-
-        try:
-            Emax = float(self.Emax_entry.get_text())
-        except Exception:
-            Emax = None
-
-        if Emin is not None:
-            self.ax.set_ylim(bottom=Emin)
-        if Emax is not None:
-            self.ax.set_ylim(top=Emax)
-        self.canvas.draw()
-
-    def plot_energy_diagram(self,energy_diagram):
-
-        self.ax.format_coord = lambda x, y: 'E = {0:1.2f} eV, E_gap = {1:1.2f} eV'.format(*self.make_interactive_text_energy_diagram(x,y,energy_diagram))
-
-        self.ax.cla()
-
-        energies = energy_diagram.energies
-        labels = energy_diagram.labels
-        gap = energy_diagram.homo_lumo_gap
-
-        self.ax.set_xlim(-1,1)
-        self.ax.get_xaxis().set_ticks([])
-        energy_range = max(energies) - min(energies)
-        self.ax.set_ylim(min(energies)-energy_range*0.05,max(energies)+energy_range*0.05)
-
-        self.ax.plot([-0.4,0.4],[energy_diagram.E_fermi]*2,'k--')
-        for i,info in enumerate(zip(energies,labels)):
-            energy = info[0]
-            label = info[1]
-            self.ax.plot([-0.3,0.3],[energy,energy])
-            if i%2 == 0:
-                text_pos = 0.38
-                alignment = 'right'
+    def plot_bonds(self,repeat=[1,1,1],abs_coord_atoms=None):
+        with batched_render(self.scene,'bonds'):
+            if abs_coord_atoms is None:
+                abs_coord_atoms = self.absolute_coordinates(repeat=repeat)
+            if self.line_set_is_current('bonds',abs_coord_atoms):
+                return
+            if self.trajectory is not None:
+                bonds = self.neighbor_list.find_bonds(abs_coord_atoms)
             else:
-                text_pos = -0.38
-                alignment = 'left'
-            self.ax.text(text_pos,energy,label,verticalalignment='center', horizontalalignment=alignment)
-
-        self.ax.set_ylabel("Energy eV")
-        self.ax.set_title('Energy diagram. Homo-Lumo gap = {0:1.2f} eV'.format(gap))
-
-    def plot_bandstructure(self,band_structure):
-        self.ax.format_coord = lambda x, y: 'k_d = {0:1.1f}, E = {1:1.2f} eV, Gap = {2:1.2f} eV'.format(
-            *self.make_interactive_text(x, y, band_structure))
-
-        self.ax.cla()
-        for band in band_structure.bands:
-            self.ax.plot(band[:, 0], band[:, 1], color='#1f77b4', linewidth=2)
-
-        xlength = band[:, 0].max() - band[:, 0].min()
-        self.ax.set_xlim(band[:, 0].min() - xlength / 800, band[:, 0].max())
-        self.ax.plot([band[:, 0].min(), band[:, 0].max()], [0, 0], 'k--')
-
-        if band_structure.special_k_points is not None and len(band_structure.special_k_points)>0:
-            for xc, xl in band_structure.special_k_points:
-                self.ax.axvline(x=xc, color='k', linewidth=1.5)
-
-            unzipped_k = list(zip(*band_structure.special_k_points))
-            special_k_points = unzipped_k[0]
-            special_k_points_label = convert_to_greek(unzipped_k[1])
-
-            self.ax.set_xticks(special_k_points)
-            self.ax.set_xticklabels(special_k_points_label, rotation='horizontal', horizontalalignment='center')
+                bonds = self.crystal_structure.find_bonds(abs_coord_atoms)
+
+            if len(bonds) == 0:
+                self.remove_line_set('bonds')
+                return
+
+            # every bond is split at its center into two halves that are colored like the atom they belong to.
+            # All halves end up as lines of a single polydata that is rendered with one tube filter and one actor.
+            n_bonds = bonds.shape[0]
+            p1 = abs_coord_atoms[bonds[:,0],:3]
+            p2 = abs_coord_atoms[bonds[:,1],:3]
+            center = (p1+p2)/2
+            points = np.stack([p1,center,center,p2],axis=1).reshape(4*n_bonds,3)
+
+            atom_species = abs_coord_atoms[:,3].astype(np.int)
+            species = np.unique(atom_species)
+            species_index = np.searchsorted(species,atom_species[bonds])
+            scalars = np.repeat(species_index,2,axis=1).reshape(4*n_bonds)
+
+            connections = np.arange(4*n_bonds).reshape(2*n_bonds,2)
+            surface = self.update_line_set('bonds',abs_coord_atoms,points,connections,scalars=scalars,tube_radius=0.125,tube_sides=18)
+
+            lut_manager = surface.module_manager.scalar_lut_manager
+            table = np.zeros((len(species),4))
+            for i,specie in enumerate(species):
+                table[i,:3] = colors.get(specie,(0.8,0.8,0.8))
+            table[:,:3] *= 255
+            table[:,3] = 255
+            lut_manager.number_of_colors = len(species)
+            lut_manager.lut.table = table.astype(np.uint8)
+            lut_manager.use_default_range = False
+            lut_manager.data_range = (-0.5,len(species)-0.5)
+
+
+optical_components = list(sst.optical_components)
+
+# plottable quantities of optical spectra: axis label and the attribute names of the curves,
+# the first curve is drawn for the 'imaginary' and the second for the 'real' option
+optical_quantities = OrderedDict([
+    ('dielectric function',(r'Dielectric function $\varepsilon(\omega)$',[('epsilon2','_imag'),('epsilon1','_real')])),
+    ('refractive index',(r'Refractive index $n$, extinction coefficient $\kappa$',[('extinction_coefficient','_kappa'),('refractive_index','_n')])),
+    ('absorption coefficient',(r'Absorption coefficient $\alpha$ [1/cm]',[('absorption_coefficient','')])),
+    ('reflectivity',(r'Reflectivity $R$',[('reflectivity','')])),
+    ('loss function',(r'Loss function $-\mathrm{Im}(1/\varepsilon)$',[('loss_function','')]))])
+
+# broadened spectra of every spectrum, keyed by (quantity, width, mode)
+broadening_cache = weakref.WeakKeyDictionary()
+
+
+def draw_optical_spectra(ax,optical_spectrum_list,name_list=None,component=0,imaginary=True,real=False,Emin=None,Emax=None,
+                         eps_min=None,eps_max=None,gamma=None,broaden_mode='lorentzian',quantity='dielectric function'):
+    """Draws the dielectric functions or derived optical constants of optical_spectrum_list into the matplotlib axes ax.
+
+Keyword args:
+    - component:    0 for the angular mean, 1, 2, 3 for the diagonal components 11, 22, 33
+
+    - imaginary:    Draw the imaginary parts (extinction coefficient for the refractive index)
+
+    - real:         Draw the real parts (refractive index n)
+
+    - gamma:        Broadening width in eV. None for no broadening.
+
+    - broaden_mode: 'lorentzian', 'gaussian' or 'none'
+
+    - quantity:     One of the keys of optical_quantities. Quantities with a single curve ignore imaginary and real.
+    """
+    if name_list is None:
+        name_list = len(optical_spectrum_list)*['']
+
+    ylabel,curves = optical_quantities[quantity]
+    if len(curves) > 1:
+        curves = [curve for curve,show in zip(curves,[imaginary,real]) if show]
+    if any(attribute == 'epsilon1' for attribute,label in curves):
+        sst.fill_real_parts(optical_spectrum_list)
+    if quantity != 'dielectric function' and (gamma is None or broaden_mode == 'none'):
+        sst.compute_optical_constants(optical_spectrum_list,component=optical_components[component])
+
+    handles = []
+    for optical_spectrum,name in zip(optical_spectrum_list,name_list):
+        for attribute,label in curves:
+            E_plot,epsilon_plot = broadened_spectrum(optical_spectrum,attribute+optical_components[component],gamma,mode=broaden_mode)
+            p, = ax.plot(E_plot, epsilon_plot, linewidth=2,label=name+label)
+            handles.append(p)
+
+    ax.set_xlabel('Energy [eV]')
+    ax.set_ylabel(ylabel)
+
+    if name_list is not None and len(handles)>1:
+        legend = ax.legend(loc='best',fancybox=True,framealpha=0.9)
+        legend_frame = legend.get_frame()
+        legend_frame.set_facecolor([0.95,0.95,0.95])
+        legend_frame.set_linewidth(0)
+
+    set_optical_limits(ax,optical_spectrum_list,Emin=Emin,Emax=Emax,eps_min=eps_min,eps_max=eps_max)
+
+def set_optical_limits(ax,optical_spectrum_list,Emin=None,Emax=None,eps_min=None,eps_max=None):
+    """Sets the axis limits of an optical spectrum plot. Limits that are None fall back to the energy range of the first
+spectrum and to the autoscaled range of the plotted data."""
+    ax.set_autoscaley_on(True)
+    ax.relim()
+    ax.autoscale_view(scalex=False)
+
+    if Emin is None:
+        Emin = optical_spectrum_list[0].energy.min()
+    if Emax is None:
+        Emax = optical_spectrum_list[0].energy.max()
+    ax.set_xlim(Emin,Emax)
+
+    if eps_min is not None:
+        ax.set_ylim(bottom=eps_min)
+    if eps_max is not None:
+        ax.set_ylim(top=eps_max)
+
+
+def broadened_spectrum(optical_spectrum,quantity,width,mode='lorentzian'):
+    """Returns the energy and the attribute quantity (e.g. 'epsilon2_11' or 'reflectivity') of optical_spectrum broadened
+with width and mode. Optical constants are calculated from the broadened dielectric function.
+Results are memoized per spectrum, so replotting with the same broadening does not recompute them."""
+    if width is None or mode == 'none':
+        return optical_spectrum.energy,getattr(optical_spectrum,quantity)
+
+    cache = broadening_cache.setdefault(optical_spectrum,{})
+    key = (quantity,width,mode)
+    if key not in cache:
+        for name in sst.optical_constant_names:
+            if quantity.startswith(name):
+                sst.fill_real_parts([optical_spectrum])
+                component = quantity[len(name):]
+                energy,epsilon1 = broadened_spectrum(optical_spectrum,'epsilon1'+component,width,mode=mode)
+                energy,epsilon2 = broadened_spectrum(optical_spectrum,'epsilon2'+component,width,mode=mode)
+                cache[key] = energy,sst.calculate_optical_constants(energy,epsilon1,epsilon2)[name]
+                break
         else:
-            special_k_points = []
-            special_k_points_label = []
-
-        if band_structure.bs_type == 'electronic':
-            bandgap = band_structure.bandgap
-            k_bandgap = band_structure.k_bandgap
-            if k_bandgap is None and bandgap is not None:
-                title_bandgap = ' $E_g = %1.1f $ eV' % bandgap + ' (indirect)'
-            elif bandgap is None:
-                title_bandgap = ' (metallic)'
-            elif k_bandgap in special_k_points:
-                k_bandgap_label = np.array(special_k_points_label)[k_bandgap == special_k_points][0]
-                title_bandgap = ' $E_g$ = %1.1f eV' % bandgap + ' at ' + k_bandgap_label
-            else:
-                title_bandgap = ' $E_g$ = %1.1f eV' % bandgap + ' (direct)'
-
-            self.ax.set_title('KS bandstructure,' + title_bandgap, fontsize=25)
+            values = getattr(optical_spectrum,quantity)
+            if values is None:
+                return optical_spectrum.energy,values
+            cache[key] = broaden_spectrum(optical_spectrum.energy,values,width,mode=mode)
+    return cache[key]
+
+def broaden_spectrum(energy,epsilon,width,mode='lorentzian'):
+    """Convolves epsilon with a lorentzian or gaussian of the given width (eV) using FFTs.
+
+The spectrum is first resampled on the bounded uniform grid of kramers_kronig.uniform_grid. Beyond the energy
+range it is continued with its first and last value, so that the result does not drop off at the edges.
+
+Returns:
+    - energy_out:   Uniform energy grid over the range of energy.
+
+    - epsilon_out:  Broadened spectrum on energy_out.
+    """
+    if mode == 'lorentzian':
+        def broaden_function(x, width):
+            return width**2/(x**2+width**2)
+        kernel_range = 25*width
+    elif mode == 'gaussian':
+        def broaden_function(x, width):
+            return np.exp(-x ** 2 / (2 * width ** 2))
+        kernel_range = 6*width
+    elif mode == 'none':
+        return energy,epsilon
+    else:
+        raise ValueError('Unknown broadening mode: '+mode)
+
+    energy_out = kramers_kronig.uniform_grid(energy,start=energy.min())
+    dx = energy_out[1] - energy_out[0]
+    epsilon_uniform = np.interp(energy_out, energy, epsilon)
+
+    n_kernel = int(np.ceil(kernel_range / dx))
+    gx = np.arange(-n_kernel, n_kernel + 1) * dx
+    broadenarray = broaden_function(gx, width)
+    broadenarray = broadenarray / np.sum(broadenarray)
+
+    padded = np.pad(epsilon_uniform, n_kernel, mode='edge')
+    n_fft = 2**int(np.ceil(np.log2(len(padded) + len(broadenarray) - 1)))
+    convolved = np.fft.irfft(np.fft.rfft(padded, n_fft) * np.fft.rfft(broadenarray, n_fft), n_fft)
+    epsilon_out = convolved[2 * n_kernel:2 * n_kernel + len(energy_out)]
+
+    return energy_out,epsilon_out
+
+
+def nearest_index(values,value):
+    """Returns the index of the entry of the sorted array values that is closest to value."""
+    index = np.searchsorted(values,value)
+    if index == 0:
+        return 0
+    elif index == len(values):
+        return np.searchsorted(values,values[-1])
+    elif value-values[index-1] <= values[index]-value:
+        # first of possibly repeated k values, e.g. at the corners of the path
+        return np.searchsorted(values,values[index-1])
+    return index
+
+
+def draw_energy_diagram(ax,energy_diagram):
+    """Draws the levels of energy_diagram (sst.EnergyDiagram) into the matplotlib axes ax."""
+    ax.cla()
+
+    energies = energy_diagram.energies
+    labels = energy_diagram.labels
+    gap = energy_diagram.homo_lumo_gap
+
+    ax.set_xlim(-1,1)
+    ax.get_xaxis().set_ticks([])
+    energy_range = max(energies) - min(energies)
+    ax.set_ylim(min(energies)-energy_range*0.05,max(energies)+energy_range*0.05)
+
+    ax.plot([-0.4,0.4],[energy_diagram.E_fermi]*2,'k--')
+    for i,info in enumerate(zip(energies,labels)):
+        energy = info[0]
+        label = info[1]
+        ax.plot([-0.3,0.3],[energy,energy])
+        if i%2 == 0:
+            text_pos = 0.38
+            alignment = 'right'
         else:
-            self.ax.set_ylim(bottom=0)
-            self.ax.set_title('Phonon bandstructure', fontsize=25)
-
-    def make_interactive_text(self,k_in,E,band_structure):
-        bands = band_structure.bands
-        k = band_structure.bands[0][:,0]
-        index_k = np.argmin(np.abs(k-k_in))
-        E_values_at_k = sorted([band[index_k,1] for band in bands])
-        E_index = bisect(E_values_at_k,E)
-        try:
-            E_above = E_values_at_k[E_index]
-            E_below = E_values_at_k[E_index-1]
-            gap = E_above - E_below
-        except IndexError:
-            gap = 0
-        if gap<0:
-            gap = 0
-        return [k_in,E,gap]
-
-    def make_interactive_text_energy_diagram(self,x,E,energy_diagram):
-        energies = energy_diagram.energies
-        E_index = bisect(energies,E)
-        try:
-            E_above = energies[E_index]
-            E_below = energies[E_index-1]
-            gap = E_above - E_below
-        except IndexError:
-            gap = 0
-        if gap<0:
-            gap = 0
-        return [E,gap]
-
-    def export(self,filename,band_structure,code=False):
-        bands = band_structure.bands
-        data = np.zeros((bands[0].shape[0],len(bands)+1))
-        data[:,0] = bands[0][:,0]
-        for i,band in enumerate(bands):
-            data[:,i+1] = band[:,1]
-        np.savetxt(filename,data)
-
-        if code:
-            #TODO do this!
-            code_string = """
-import numpy as np
-import matplotlib.pyplot as plt
-
-            
-self.first_plot_bool = True
-self.figure = plt.figure(1)
-plt.close(plt.figure(1))
-self.ax = None
-self.last_bandstructure = None"""
-
-
-class ScfVisualization(QtGui.QWidget):
-    def __init__(self, parent=None):
-        super(ScfVisualization, self).__init__()
-
-        # a figure instance to plot on
-        self.figure = plt.figure(2)
-        plt.close(plt.figure(2))
-        self.ax = None
-        self.first_plot_bool = True
-        self.canvas = FigureCanvas(self.figure)
-
-        # color = self.palette().color(QtGui.QPalette.Base)
-        # self.figure.patch.set_facecolor([color.red() / 255, color.green() / 255, color.blue() / 255])
-        self.figure.patch.set_facecolor([236 / 255, 236 / 255, 236 / 255])
-        # self.figure.patch.set_facecolor('none')
-        # self.figure.patch.set_alpha(0.0)
-
-        self.toolbar = NavigationToolbar(self.canvas, self)
-
-        # Just some button connected to `plot` method
-        # self.button = QtGui.QPushButton('Plot')
-        # self.button.clicked.connect(self.plot)
-
-        # set the layout
-        layout = QtGui.QVBoxLayout()
-        layout.addWidget(self.toolbar)
-        layout.addWidget(self.canvas)
-        # layout.addWidget(self.button)
-        self.setLayout(layout)
-        self.show()
-
-    def clear_plot(self):
-        if not self.first_plot_bool:
-            self.ax.cla()
-            self.canvas.draw()
-
-    def plot(self,scf_data):
-        if self.first_plot_bool:
-            self.ax = self.figure.add_subplot(111)
-        self.ax.cla()
-
-        xmax = int(round(scf_data[:,0].max()))+1
-        xmin = int(scf_data[:,0].min())
-        dist = xmax - xmin
-        if dist<10:
-            step = 1
-            ms = 12
-        elif dist < 20:
-            step = 2
-            ms = 12
-        elif dist < 50:
-            step = 5
-            ms = 9
+            text_pos = -0.38
+            alignment = 'left'
+        ax.text(text_pos,energy,label,verticalalignment='center', horizontalalignment=alignment)
+
+    ax.set_ylabel("Energy eV")
+    ax.set_title('Energy diagram. Homo-Lumo gap = {0:1.2f} eV'.format(gap))
+
+
+def draw_bandstructure(ax,band_structure):
+    """Draws band_structure (sst.BandStructure) into the matplotlib axes ax."""
+    ax.cla()
+    segments = [band[:, :2] for band in band_structure.bands]
+    ax.add_collection(LineCollection(segments, colors='#1f77b4', linewidths=2))
+    ax.autoscale_view()
+
+    k = segments[-1][:, 0]
+    xlength = k.max() - k.min()
+    ax.set_xlim(k.min() - xlength / 800, k.max())
+    ax.plot([k.min(), k.max()], [0, 0], 'k--')
+
+    if band_structure.special_k_points is not None and len(band_structure.special_k_points)>0:
+        for xc, xl in band_structure.special_k_points:
+            ax.axvline(x=xc, color='k', linewidth=1.5)
+
+        unzipped_k = list(zip(*band_structure.special_k_points))
+        special_k_points = unzipped_k[0]
+        special_k_points_label = convert_to_greek(unzipped_k[1])
+
+        ax.set_xticks(special_k_points)
+        ax.set_xticklabels(special_k_points_label, rotation='horizontal', horizontalalignment='center')
+    else:
+        special_k_points = []
+        special_k_points_label = []
+
+    if band_structure.bs_type == 'electronic':
+        bandgap = band_structure.bandgap
+        k_bandgap = band_structure.k_bandgap
+        if k_bandgap is None and bandgap is not None:
+            title_bandgap = ' $E_g = %1.1f $ eV' % bandgap + ' (indirect)'
+        elif bandgap is None:
+            title_bandgap = ' (metallic)'
+        elif k_bandgap in special_k_points:
+            k_bandgap_label = np.array(special_k_points_label)[k_bandgap == special_k_points][0]
+            title_bandgap = ' $E_g$ = %1.1f eV' % bandgap + ' at ' + k_bandgap_label
         else:
-            step = int(round((dist//10)/5)*5)
-            ms = 6
-        xint = list(range(0,xmax,step))[1:]
-
-        self.ax.plot(scf_data[:,0], scf_data[:,1], marker='o',color='#1f77b4',ms=ms,markeredgecolor='none',linewidth=0)
-        self.ax.plot(scf_data[:, 0], scf_data[:, 1], linestyle='--', color='#1f77b4', linewidth=3,alpha=0.5)
-        self.ax.set_xlim(scf_data[:,0].min()-0.1,scf_data[:,0].max()+0.1)
-
-        self.ax.set_xticks(xint)
-        self.ax.set_xlabel('Scf iteration')
-        self.ax.set_ylabel('Total Energy')
-        if self.first_plot_bool:
-            self.first_plot_bool = False
-            self.figure.tight_layout()
-        self.canvas.draw()
+            title_bandgap = ' $E_g$ = %1.1f eV' % bandgap + ' (direct)'
+
+        ax.set_title('KS bandstructure,' + title_bandgap, fontsize=25)
+    else:
+        ax.set_ylim(bottom=0)
+        ax.set_title('Phonon bandstructure', fontsize=25)
 
 
 if __name__ == "__main__":